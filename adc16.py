@@ -1,18 +1,33 @@
 import time
 import copy
+import json
 import corr
 import os
 import sys
 import numpy as np
 import struct
 import logging
+import threading
 from pprint import pprint
 import matplotlib.pyplot as plt
+import adc16_layout
+import adc16_stats
+import adc16_trace
 
 
 
 katcp_port=7147
 
+# HMCAD1511 coarse gain.  With coarse_gain_cfg (register 0x33 bit 0) set the
+# 4 bit gain codes select a gain factor rather than a gain in dB:
+GAIN_CODES = {1:0, 1.25:1, 2:2, 2.5:3, 4:4, 5:5, 8:6, 10:7, 12.5:8, 16:9, 20:10, 25:11, 32:12, 50:13}
+GAIN_LADDER = sorted(GAIN_CODES)
+# Register holding the gain codes in each demux mode and the bit shift of the
+# code of each de-interleaved input (adc16_layout.DEMUX_INPUTS order):
+#   0x2a cgain4_ch1..ch4 (quad channel), 0x2b cgain2_ch1/ch2 (dual channel)
+#   and cgain1_ch1 (single channel)
+GAIN_FIELDS = {1: (0x2a, [0,4,8,12]), 2: (0x2b, [0,4]), 4: (0x2b, [8])}
+
 
 # Provides KATCP wrapper around ADC16 based CASPER design.  Includes many
 # convenience functions for writing to the registers of the ADC chips,
@@ -138,6 +153,46 @@ katcp_port=7147
 
 
 
+def measure_clocks(adcs,interval=0.1):
+	"""
+	Measure the clocks of many boards (ADC16 instances) at once, one thread
+	per board, so the whole fleet takes about one interval.  Returns the
+	(MHz, +-MHz) of each board in order.
+	"""
+	results = [None]*len(adcs)
+	def measure(i):
+		results[i] = adcs[i].measure_clock(interval,refresh=True)
+	threads = [threading.Thread(target=measure,args=(i,)) for i in range(len(adcs))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+
+def poll_status(adcs,max_age=0):
+	"""
+	Read the controller status of many boards (ADC16 instances) at once, one
+	thread and one read_int per board, so a rack takes about one round trip.
+	Returns the adc16_layout.ControllerStatus of each board in order, or the
+	exception raised for a board that could not be read.
+	"""
+	results = [None]*len(adcs)
+	def poll(i):
+		try:
+			results[i] = adcs[i].status(max_age)
+		except Exception as e:
+			results[i] = e
+	threads = [threading.Thread(target=poll,args=(i,)) for i in range(len(adcs))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+
 class ADC16():#katcp.RoachClient):
 
 	def __init__(self,**kwargs):
@@ -156,39 +211,55 @@ class ADC16():#katcp.RoachClient):
 		self.demux_mode = kwargs['demux_mode']		
 		self.gain = kwargs['gain']
 		#create a chip dictionary to facilitate writing to adc16_controller	
+		#Chips a-c on SNAP, a-h on ROACH2 designs, the bit masks of each chip come from adc16_layout.CHIP_MASKS
 		self.chips = {}
-		self.chip_select_a = 0
-		self.chip_select_b = 0
-		self.chip_select_c = 0
 		for chip in kwargs['chips']:
-			if chip == 'a'or chip == 'A':
-				self.chips['a'] = 0
-				self.chip_select_a = 1 << self.chips['a']
-			elif chip == 'b' or chip ==  'B':
-				self.chips['b'] = 1
-				self.chip_select_b = 1 << self.chips['b']
-			elif chip == 'c' or chip == 'C':
-				self.chips['c'] = 2
-				self.chip_select_c = 1 << self.chips['c']
-			else:
-				logging.error('Invalid chip name passed, available values: a, b or c, default is all chips selected')
+			if chip.lower() not in adc16_layout.CHIP_INDEX:
+				logging.error('Invalid chip name passed, available values: a to h, default is all chips selected')
 				exit(1)
-		self.chip_select = self.chip_select_a | self.chip_select_b | self.chip_select_c
+			self.chips[chip.lower()] = adc16_layout.CHIP_INDEX[chip.lower()]
+		#Chip numbers in order, and the SPI chip select of all of them
+		self.chip_nums = sorted(self.chips.values())
+		self.chip_select = adc16_layout.chip_mask(self.chip_nums,adc16_layout.CHIP_SELECT)
+		#Delay tap of every lane (in adc16_layout.LANES order) of each calibrated chip
+		self.taps = {}
+		#Error free taps confirmed on either side of each of those taps (the smaller side), per lane
+		self.margins = {}
+		#Bitslips the last sync of each of those chips needed, per lane, for tap_search_cost
+		self.bitslips = {}
+		#(MHz, +-MHz) from measure_clock, measured once per session
+		self.board_clock = None
+		#Last decoded controller status and how many seconds status() may reuse it
+		self._status = None
+		self.status_ttl = kwargs.get('status_ttl', 2.0)
 		print('Chips select:',bin(self.chip_select))
 
 
 
 
-		#Instantiating a snap object with attributes of FpgaClient class
-		print('Connecting to SNAP.....')
-		self.snap = corr.katcp_wrapper.FpgaClient(kwargs['host'], self.katcp_port, timeout=10)
-		time.sleep(1)
+		#Seconds to wait for a newly enabled test pattern to reach the snapshot BRAMs
+		self.pattern_settle = kwargs.get('pattern_settle', 1)
+
+		#Instantiating a snap object with attributes of FpgaClient class, unless an already connected
+		#client is passed in (e.g. adc16_replay.RecordingClient or adc16_replay.ReplayClient)
+		if kwargs.get('client') is not None:
+			self.snap = kwargs['client']
+		else:
+			print('Connecting to SNAP.....')
+			self.snap = corr.katcp_wrapper.FpgaClient(kwargs['host'], self.katcp_port, timeout=10)
+			time.sleep(1)
 
 		if  self.snap.is_connected():
 			print('Connected to SNAP!')	
 		else:
 			logging.error('Couldn\'t connect to SNAP, check your connection..')
 			exit(1)
+		#Calibration phases are traced into a no-op tracer unless enable_tracing is called
+		self.tracer = adc16_trace.NullTracer()
+		#SPI writes are only traced when debugging, or when asked for with the spi_trace kwarg (ring size)
+		self.spi_trace = None
+		if kwargs.get('spi_trace') or kwargs['verbosity'] == True:
+			self.enable_spi_trace(kwargs.get('spi_trace') or 256)
 		#Dealing with flags passed into argsparse at the prompt by the user
 		if kwargs['skip_flag'] == True:
 			print('Not programming the bof file')
@@ -198,41 +269,52 @@ class ADC16():#katcp.RoachClient):
 			print('Programmed!')
 
 		
+	#Records spans of the calibration phases, with KATCP call counts, into self.tracer.
+	#Save them with self.tracer.save(path) and open the file in chrome://tracing or Perfetto.
+	def enable_tracing(self):
+		self.tracer = adc16_trace.Tracer()
+		self.snap = self.tracer.wrap(self.snap)
+
 	#write_adc is used for writing specific ADC registers.
 	#ADC controller can only write to adc one bit at a time at rising clock edge
-	def write_adc(self,addr,data):
+	#chip_select overrides the chips selected in the constructor for this write
+	def write_adc(self,addr,data,chip_select=None):
 		SCLK = 0x200
-		CS = self.chip_select
+		CS = self.chip_select if chip_select is None else chip_select
 		IDLE = SCLK
 		SDA_SHIFT = 8
+		#Debug tracing goes to a ring buffer of whole register writes (see enable_spi_trace), one
+		#check per register write instead of formatting a log line for every one of the 50 edges
+		if self.spi_trace is not None:
+			self.spi_trace.record(CS,addr,data)
 		self.snap.write_int('adc16_controller',IDLE,offset=0,blindwrite=True)
 		for i in range(8):
 			addr_bit = (addr>>(8-i-1))&1
 			state = (addr_bit<<SDA_SHIFT) | CS
 			self.snap.write_int('adc16_controller',state,offset=0,blindwrite=True)
-			logging.debug("Printing address state written to adc16_controller, offset=0, clock low")
-			logging.debug(np.binary_repr(state,width=32))
-	#		print(np.binary_repr(state,width=32))
 			state = (addr_bit<<SDA_SHIFT) | CS | SCLK
 			self.snap.write_int('adc16_controller',state,offset=0,blindwrite=True)
-			logging.debug("Printing address state written to adc16_controller, offset=0, clock high")
-			logging.debug(np.binary_repr(state,width=32))
-	#		print(np.binary_repr(state,width=32))
 		for j in range(16):
 			data_bit = (data>>(16-j-1))&1
 			state = (data_bit<<SDA_SHIFT) | CS
 			self.snap.write_int('adc16_controller',state,offset=0,blindwrite=True)
-			logging.debug("Printing data state written to adc16_controller, offset=0, clock low")
-			logging.debug(np.binary_repr(state,width=32))
-	#		print(np.binary_repr(state,width=32))
 			state =( data_bit<<SDA_SHIFT) | CS | SCLK	
 			self.snap.write_int('adc16_controller',state,offset=0,blindwrite=True)		
-			logging.debug("Printing data address state written to adc16_controller, offset=0, clock high")
-			logging.debug(np.binary_repr(state,width=32))
-	#		print(np.binary_repr(state,width=32))
 		
 		self.snap.write_int('adc16_controller',IDLE,offset=0,blindwrite=True)
 
+	#Keeps the last size SPI register writes in memory, they are written to the log by dump_spi_trace
+	#when calibration fails
+	def enable_spi_trace(self,size=256):
+		self.spi_trace = adc16_trace.SpiTraceRing(size)
+
+	def dump_spi_trace(self):
+		if self.spi_trace is None:
+			return
+		logging.error('Last {0} of {1} SPI writes (time, chip select, register, value):'.format(len(self.spi_trace.last()),self.spi_trace.total))
+		for line in self.spi_trace.format():
+			logging.error(line)
+
 	def power_cycle(self):
 		logging.info('Power cycling the ADC')
 		#power adc down
@@ -242,6 +324,8 @@ class ADC16():#katcp.RoachClient):
 
 	def adc_reset(self):
 		logging.info('Initializing ADC')
+		#The lock bits may change with the reset
+		self._status = None
 		#reset adc	
                 self.write_adc(0x00,0x0001)
 
@@ -322,6 +406,10 @@ class ADC16():#katcp.RoachClient):
                 else:
 			print('Design is not ADC16-based')
 			exit(1)
+		#NNNN is compiled into the design, the status read by clock_locked is reused
+		num_chips = self.status().num_chips
+		if num_chips and self.chip_nums[-1] >= num_chips:
+			logging.warning('Design supports {0} ADC chips, chip {1} is not one of them'.format(num_chips,adc16_layout.CHIP_NAMES[self.chip_nums[-1]]))
 
 
 
@@ -341,7 +429,7 @@ class ADC16():#katcp.RoachClient):
   # Default is :ramp.  Any value other than shown above is the same as :none
   # (i.e. pass through sampled data).
 
-	def enable_pattern(self,pattern):                                                                                           
+	def enable_pattern(self,pattern,custom=None):
 		self.write_adc(0x25,0x00)
 		self.write_adc(0x45,0x00)
                 if pattern =='ramp':
@@ -350,18 +438,28 @@ class ADC16():#katcp.RoachClient):
                         self.write_adc(0x45,0x0001)
                 elif pattern == 'sync':
                         self.write_adc(0x45,0x0002)
+		elif pattern == 'custom':
+			#Single custom pattern, custom is its 8 bits (default is the -p bitstream, e.g. '10110110')
+			if custom is None:
+				custom = int(self.test_pattern,2)
+			self.write_adc(0x26,(custom&0xff)<<8)
+			self.write_adc(0x25,0x0010)
 		else:
 			print('Invalid test pattern selected')
 			exit(1)
-#		else:
-#			self.write_adc(0x25,0x10)
-#			self.write_adc(0x26,(self.expected)<<8)
-		time.sleep(1)
+		time.sleep(self.pattern_settle)
 
-	def read_ram(self,device):
+	#Pulses the Snap Request bit of the control register (word 1). All adc16_wb_ram{n} BRAMs
+	#capture on the same request, so one trigger gives time aligned snapshots of every chip.
+	#Returns the host time right after the request was written.
+	def snap_trigger(self):
 		SNAP_REQ = 0x00010000
 		self.snap.write_int('adc16_controller',0, offset=1,blindwrite=True)
 		self.snap.write_int('adc16_controller',SNAP_REQ, offset=1,blindwrite=True)
+		return time.time()
+
+	def read_ram(self,device):
+		self.snap_trigger()
 		#Read the device that is passed to the read_ram method,1024 elements at a time,snapshot is a binary string that needs to get unpacked
 		#Part of the read request is the size parameter,1024, which specifies the amount of bytes to read form the device
 		snapshot = self.snap.read(device,1024,offset=0)
@@ -394,325 +492,613 @@ class ADC16():#katcp.RoachClient):
 #			print('{:08b}'.format(array_data[k]))	
 #			j += 8
 #			k += 8
+
+	def read_all_rams(self,chips=None):
+		"""
+		Capture every selected chip with a single snap request.  Returns a
+		(chips, 1024) int8 array and the trigger time.  Rows follow the order
+		of the chips argument (chip letters), default is all chips passed to
+		the constructor in chip number order.
+		"""
+		if chips is None:
+			return self.read_rams(self.chip_nums)
+		return self.read_rams([self.chips[chip] for chip in chips])
+
+	#read_all_rams by chip number (or a list of them), as used by the calibration code
+	def read_rams(self,chip_nums):
+		if isinstance(chip_nums,int):
+			chip_nums = [chip_nums]
+		data = np.empty((len(chip_nums),1024), dtype=np.int8)
+		trig_time = self.snap_trigger()
+		for row,chip_num in enumerate(chip_nums):
+			#Same signed char mapping as read_ram, without going through a tuple
+			data[row] = np.frombuffer(self.snap.read(adc16_layout.RAMS[chip_num],1024,offset=0), dtype=np.int8)
+		return data, trig_time
 	#function that tests taps, it shifts data checks with the expected data and ouputs the error count
 
 	
 	#The ADC16 controller word (the offset in write_int method) 2 and 3 are for delaying taps of A and B lanes, respectively.
-	#Refer to the memory map word 2 and word 3 for clarification. The memory map was made for a ROACH design so it has chips A-H. 
-	#SNAP 1 design has three chips
+	#Refer to the memory map word 2 and word 3 for clarification. The memory map was made for a ROACH design so it has chips A-H.
+	#SNAP 1 design has three chips. The bits of each chip are in adc16_layout.CHIP_MASKS, chip_num can be
+	#a single chip number or a list of them, which are then bitslipped/delayed with the same writes.
 	def bitslip(self,chip_num,channel):
 		chan_shift = 5
 		chan_select_bs = channel << chan_shift
-		state = 0
-		chip_shift = 8
-		chip_select_bs = 1 << chip_shift+chip_num
+		chip_select_bs = adc16_layout.chip_mask(chip_num,adc16_layout.BITSLIP)
 		state = (chip_select_bs | chan_select_bs)
 #		print('Bitslip state written to offset=1:',bin(state))
 		self.snap.write_int('adc16_controller', 0, offset=1, blindwrite=True)
 		self.snap.write_int('adc16_controller', state, offset=1, blindwrite=True)
-	#	regvalue=self.snap.read('adc16_controller', 32, offset=1)
-	#	print('Bitslip Reg Value\n')
-	#	print(struct.unpack('>32b', regvalue))
 		self.snap.write_int('adc16_controller', 0, offset=1, blindwrite=True)
-			
-		
-	def delay_tap(self,tap,channel,chip_num):
-		
-
-		if channel == 'all':
-			chan_select = (0xf<<(chip_num*4))
-			
-
-			delay_tap_mask = 0x1f
-			self.snap.write_int('adc16_controller', 0 , offset = 2,blindwrite=True)
-			self.snap.write_int('adc16_controller', 0 , offset = 3,blindwrite=True)
-			#Set tap bits
-			self.snap.write_int('adc16_controller', delay_tap_mask & tap , offset = 1,blindwrite=True)
-			#Set strobe bits
-			self.snap.write_int('adc16_controller', chan_select, offset = 2,blindwrite=True)
-			self.snap.write_int('adc16_controller', chan_select, offset = 3,blindwrite=True)
-			#Clear all bits
-			self.snap.write_int('adc16_controller', 0 , offset = 1,blindwrite=True)
-			self.snap.write_int('adc16_controller', 0 , offset = 2,blindwrite=True)
-			self.snap.write_int('adc16_controller', 0 , offset = 3,blindwrite=True)
-			#Note this return statement, after all channels have been bitslip it'll exit out of the function. 
-			#the function is called again after figuring out the best tap with a single channel argument. 
-			return
-		elif channel == '1a':
-			chan_select = 0x1<<(chip_num*4)
-			lane_offset = 2
-		elif channel == '1b':
-			chan_select = 0x1<<(chip_num*4)
-			lane_offset = 3
-		elif channel == '2a':
-			chan_select = 0x2<<(chip_num*4)
-			lane_offset = 2
-		elif channel == '2b':
-			chan_select = 0x2<<(chip_num*4)
-			lane_offset = 3
-		elif channel == '3a':
-			chan_select = 0x4<<(chip_num*4)
-			lane_offset = 2
-		elif channel == '3b':
-			chan_select = 0x4<<(chip_num*4)
-			lane_offset = 3
-		elif channel == '4a':
-			chan_select = 0x8<<(chip_num*4)
-			lane_offset = 2
-		elif channel == '4b':
-			chan_select = 0x8<<(chip_num*4)
-			lane_offset = 3
-		
-
-
 
+	#Loads tap into every lane whose bit is set in the strobe masks of word 2 (A lanes) and word 3 (B lanes)
+	def strobe_taps(self,tap,strobe_a,strobe_b):
 		delay_tap_mask = 0x1f
-		self.snap.write_int('adc16_controller', 0 , offset = lane_offset,blindwrite=True)
+		self.snap.write_int('adc16_controller', 0 , offset = 2,blindwrite=True)
+		self.snap.write_int('adc16_controller', 0 , offset = 3,blindwrite=True)
 		#Set tap bits
 		self.snap.write_int('adc16_controller', delay_tap_mask & tap , offset = 1,blindwrite=True)
 		#Set strobe bits
-		self.snap.write_int('adc16_controller', chan_select , offset = lane_offset,blindwrite=True)
+		self.snap.write_int('adc16_controller', strobe_a, offset = 2,blindwrite=True)
+		self.snap.write_int('adc16_controller', strobe_b, offset = 3,blindwrite=True)
 		#Clear all bits
 		self.snap.write_int('adc16_controller', 0 , offset = 1,blindwrite=True)
 		self.snap.write_int('adc16_controller', 0 , offset = 2,blindwrite=True)
 		self.snap.write_int('adc16_controller', 0 , offset = 3,blindwrite=True)
-	
+
+	#channel is 'all' or one of the lanes '1a', '1b', ... '4b'
+	def delay_tap(self,tap,channel,chip_num):
+		chan_select = adc16_layout.chip_mask(chip_num,adc16_layout.STROBE)
+		if channel == 'all':
+			self.strobe_taps(tap,chan_select,chan_select)
+			return
+		lane_bits, lane_offset = adc16_layout.LANE_STROBE[adc16_layout.LANES.index(channel)]
+		chan_select &= lane_bits
+		if lane_offset == 2:
+			self.strobe_taps(tap,chan_select,0)
+		else:
+			self.strobe_taps(tap,0,chan_select)
+
+	#Sets every lane of several chips at once, taps maps chip number -> 8 taps in adc16_layout.LANES order.
+	#Lanes that get the same tap are strobed together, so this takes at most 32 strobes however many chips there are.
+	def set_taps(self,taps):
+		strobes = {}
+		for chip_num,lane_taps in taps.items():
+			chip_strobe = adc16_layout.CHIP_MASKS[chip_num][adc16_layout.STROBE]
+			for k,tap in enumerate(lane_taps):
+				lane_bits, lane_offset = adc16_layout.LANE_STROBE[k]
+				strobes.setdefault(int(tap),[0,0])[lane_offset-2] |= chip_strobe & lane_bits
+		for tap in sorted(strobes):
+			self.strobe_taps(tap,strobes[tap][0],strobes[tap][1])
 
 	#returns an array of error counts for a given tap(assume structure chan 1a, chan 1b, chan 2a, chan 2b etc.. until chan 4b
-	#taps argument can have a value of an int or a string. If it's a string then it will iterate through all 32 taps 
+	#taps argument can have a value of an int or a string. If it's a string then it will iterate through all 32 taps
 	#if it's an int it will only delay all channels by that particular tap value.
 	def test_tap(self,chip_num,taps):
-		if taps  == 'all':			
-			
-			error_count=[]
-			#read_ram reuturns an array of data form a sanpshot from ADC output
-			for tap in range(32):	
-				
-				self.delay_tap(tap,'all',chip_num)
-				data = self.read_ram('adc16_wb_ram{0}'.format(chip_num))
-				#each tap will return an error count for each channel and lane, so an array of 8 elements with an error count for each
-
-				chan1a_error = 0
-				chan1b_error = 0
-				chan2a_error = 0
-				chan2b_error = 0
-				chan3a_error = 0
-				chan3b_error = 0
-				chan4a_error = 0
-				chan4b_error = 0
-			
-			
-			
-			
-				i=0
-				while i < 1024:
-					if data[i] != 0x2a:
-						chan1a_error += 1
-					if data[i+1] != 0x2a:
-						chan1b_error += 1
-					if data[i+2] != 0x2a:
-						chan2a_error += 1
-					if data[i+3] != 0x2a:
-						chan2b_error += 1
-					if data[i+4] != 0x2a:
-						chan3a_error += 1
-
-					if data[i+5] != 0x2a:
-						chan3b_error += 1
-					if data[i+6] != 0x2a:
-						chan4a_error += 1
-					if data[i+7] != 0x2a:
-						chan4b_error += 1
-					i += 8
-
-				error_count.append([chan1a_error,chan1b_error, chan2a_error, chan2b_error, chan3a_error, chan3b_error, chan4a_error, chan4b_error])
-			return(error_count)
-		else:
-
-			error_count=[]
-			#read_ram reuturns an array of data form a sanpshot from ADC output
-				
-			self.delay_tap(taps,'all',chip_num)
-			data = self.read_ram('adc16_wb_ram{0}'.format(chip_num))
+		if taps  == 'all':
 			#each tap will return an error count for each channel and lane, so an array of 8 elements with an error count for each
-
-			chan1a_error = 0
-			chan1b_error = 0
-			chan2a_error = 0
-			chan2b_error = 0
-			chan3a_error = 0
-			chan3b_error = 0
-			chan4a_error = 0
-			chan4b_error = 0
-		
-		
-		
-		
-			i=0
-			while i < 1024:
-				if data[i] != 0x2a: 
-					chan1a_error += 1
-				if data[i+1] != 0x2a: 
-					chan1b_error += 1
-				if data[i+2] !=	0x2a:
-					chan2a_error += 1
-				if data[i+3] != 0x2a:
-					chan2b_error += 1
-				if data[i+4] != 0x2a:
-					chan3a_error += 1
-
-				if data[i+5] != 0x2a:
-					chan3b_error += 1
-				if data[i+6] != 0x2a:
-					chan4a_error += 1
-				if data[i+7] != 0x2a:
-					chan4b_error += 1
-				i += 8
-
-			error_count.append([chan1a_error,chan1b_error, chan2a_error, chan2b_error, chan3a_error, chan3b_error, chan4a_error, chan4b_error])
+			return self.test_taps(chip_num,range(32))[:,0].tolist()
+		else:
+			error_count = self.test_taps(chip_num,[taps])[:,0].tolist()
 			logging.debug('Error count for {0} tap: {1}'.format(taps,error_count))
 			return(error_count)
-	def walk_taps(self):
-		for chip,chip_num in self.chips.iteritems():
-			#Set demux 4 on the FPGA side (just rearranging outputs as opposed to dividing clock and assigning channels)
-			self.set_demux_fpga(4)	
-
-			print('Calibrating chip %s...'%chip)	
-			logging.debug('Setting deskew pattern...')
-			logging.debug('Stuff in chip %s before enabling pattern'%chip)
-			logging.debug(self.read_ram('adc16_wb_ram{0}'.format(chip_num)))
-			self.enable_pattern('deskew')
-			logging.debug('Stuff in chip after enabling test mode\n')
-			logging.debug(self.read_ram('adc16_wb_ram{0}'.format(chip_num)))
 
-			logging.debug('Taps before bitslipping anything\n')
-			logging.debug(self.test_tap(chip_num,'all'))
-			#check if either of the extreme tap setting returns zero errors in any one of the channels. Bitslip if True. 
-			#This is to make sure that the eye of the pattern is swept completely
-			error_counts_0 = self.test_tap(chip_num,0)
-			error_counts_31 = self.test_tap(chip_num,31)
-			for i in range(8):
-				if not(error_counts_0[0][i]) or not(error_counts_31[0][i]): 
-					logging.debug('Bitslipping chan %i' %i)
-					self.bitslip(chip_num,i)
-					error_counts_0 = self.test_tap(chip_num,0)
-					error_counts_31 = self.test_tap(chip_num,31)
+	#Error counts of several chips at once: every tap in taps is set on all lanes of all the chips with one strobe
+	#and checked with one snap request. Returns a (taps, chips, 8 lanes) array, chips in chip_nums order.
+	def test_taps(self,chip_nums,taps):
+		if isinstance(chip_nums,int):
+			chip_nums = [chip_nums]
+		error_count = np.empty((len(taps),len(chip_nums),8), dtype=int)
+		for row,tap in enumerate(taps):
+			self.delay_tap(tap,'all',chip_nums)
+			error_count[row] = adc16_layout.lane_errors(self.read_rams(chip_nums)[0])
+		return error_count
 
-	
-			#error_list is a list of 32 'rows'(corresponding to the 32 taps) , each row containing 8 elements,each element is the number of errors  	
-			#of that lane  when compared to the expected value. read_ram method unpacks 1024 bytes. There are 8
-			#lanes so each lane gets 1024/8=128 read outs from a single call to read_ram method, like this, channel_1a etc. represent the errors in that channel
-			# tap 0: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
-			# tap 1: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
-			# .....: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
-			# tap 31:[ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
-			error_list = self.test_tap(chip_num,'all')
-			good_tap_range = []	
-			best_tap_range = []
-			logging.debug('Printing the list of errors, each row is a tap\n')
-			logging.debug(['chan1a','chan1b','chan2a','chan2b','chan3a','chan3b','chan4a','chan4b'])
-			logging.debug(error_list)
-			min_tap=[]
-			max_tap=[]
-			#This loop goes through error_list, finds the elements with a value of 0 and appends them to the good tap range list 
-			#It also picks out the elements corresponding to different channels and groups them together. The error_list is a list where each 'row' is a different tap
-			#I wanted to find the elements in each channel that have zero errors, group the individual channels, and get the value of the tap in which they're in - which is the index of the row
+	def walk_taps(self):
+		chips = sorted(self.chips, key=self.chips.get)
+		with self.tracer.span('walk_taps', chips=''.join(chips)):
+			self.walk_chips_taps(chips)
+
+	#Calibrates several chips together: sweeps the delay taps over the deskew pattern, sets every lane to the
+	#middle of its eye and bitslips the lanes until the sync pattern is aligned. Every step strobes and
+	#captures all the chips at once, so an 8 chip board takes as many KATCP calls as a single chip (plus the reads).
+	#For the same reason the trace spans cover all the chips, their args give the per chip results (bitslips,
+	#eye widths and taps of each lane) instead of per chip times.
+	def walk_chips_taps(self,chips):
+		chip_nums = [self.chips[chip] for chip in chips]
+		#Set demux 4 on the FPGA side (just rearranging outputs as opposed to dividing clock and assigning channels)
+		self.set_demux_fpga(4)
+
+		print('Calibrating chip %s...'%', '.join(chips))
+		#The extra captures and the extra sweep below are only there for the debug log, skip them otherwise
+		debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+		logging.debug('Setting deskew pattern...')
+		if debug:
+			logging.debug('Stuff in chips %s before enabling pattern'%', '.join(chips))
+			logging.debug(self.read_rams(chip_nums)[0])
+		self.enable_pattern('deskew')
+		if debug:
+			logging.debug('Stuff in chips after enabling test mode\n')
+			logging.debug(self.read_rams(chip_nums)[0])
+			logging.debug('Taps before bitslipping anything\n')
+			logging.debug(self.test_taps(chip_nums,range(32)))
+		#check if either of the extreme tap setting returns zero errors in any one of the channels. Bitslip if True.
+		#This is to make sure that the eye of the pattern is swept completely
+		with self.tracer.span('bitslip_check', chips=''.join(chips)) as span:
+			error_counts = self.test_taps(chip_nums,[0,31])
+			bitslips = np.zeros((len(chips),8), dtype=int)
 			for i in range(8):
-				good_tap_range.append([])
-				#j represents the tap value
-				for j in range(32):
-					#i represents the channel/lane value
-					if error_list[j][i]==0:
-						good_tap_range[i].append(j)
-		#	find the min and max of each element of good tap range and call delay tap 
+				rows = [row for row in range(len(chip_nums)) if not(error_counts[0,row,i]) or not(error_counts[1,row,i])]
+				slip = [chip_nums[row] for row in rows]
+				if slip:
+					logging.debug('Bitslipping chan %i of chips %s' %(i,slip))
+					self.bitslip(slip,i)
+					bitslips[rows,i] += 1
+					error_counts = self.test_taps(chip_nums,[0,31])
+			span.set(**dict(('bitslips_'+chip,bitslips[row].tolist()) for row,chip in enumerate(chips)))
+
+
+		#error_list holds 32 'rows'(corresponding to the 32 taps), each row has a row per chip of 8 elements, each element is the number of errors
+		#of that lane  when compared to the expected value. read_ram method unpacks 1024 bytes. There are 8
+		#lanes so each lane gets 1024/8=128 read outs from a single call to read_ram method, like this, channel_1a etc. represent the errors in that channel
+		# tap 0: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
+		# tap 1: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
+		# .....: [ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
+		# tap 31:[ channel_1a channel_1b channel_2a channel_2b channel_3a channel_3b channel_4a channel_4b]
+		with self.tracer.span('sweep', chips=''.join(chips)) as span:
+			error_list = self.test_taps(chip_nums,range(32))
+			eye_widths = (error_list == 0).sum(axis=0)
+			span.set(**dict(('good_taps_'+chip,eye_widths[row].tolist()) for row,chip in enumerate(chips)))
+		logging.debug('Printing the list of errors, each row is a tap\n')
+		logging.debug(['chan1a','chan1b','chan2a','chan2b','chan3a','chan3b','chan4a','chan4b'])
+		logging.debug(error_list)
+		#The good taps of a lane are the taps (rows of error_list) where the lane has zero errors
+		good = error_list == 0
+		tap_values = np.arange(32)[:,np.newaxis,np.newaxis]
+		min_tap = np.where(good,tap_values,32).min(axis=0)
+		max_tap = np.where(good,tap_values,-1).max(axis=0)
+		if debug:
 			logging.debug('Printing good tap values for each channel...each row corresponds to different channel')
-				
-			for i in range(len(good_tap_range)):
-				logging.debug('Channel {0}: {1}'.format(i+1,good_tap_range[i]))
-
-			channels = ['1a','1b','2a','2b','3a','3b','4a','4b']
-			for k in range(8):
-				min_tap = min(good_tap_range[k])
-				max_tap = max(good_tap_range[k])
+			for row,chip in enumerate(chips):
+				for i in range(8):
+					logging.debug('Chip {0} channel {1}: {2}'.format(chip,i+1,np.flatnonzero(good[:,row,i]).tolist()))
+
+		channels = adc16_layout.LANES
+		with self.tracer.span('tap_apply', chips=''.join(chips)) as span:
+			for row,k in zip(*np.nonzero(~good.any(axis=0))):
+				logging.error('No tap of chip {0} lane {1} captures the deskew pattern without errors'.format(chips[row],channels[k]))
+				self.dump_spi_trace()
+				exit(1)
+			best_taps = (min_tap+max_tap)//2
+			self.set_taps(dict((chip_nums[row],best_taps[row].tolist()) for row in range(len(chips))))
+			#Remember the taps so recalibrate_incremental can track the eye from here, and how many
+			#error free taps each lane has on either side of its tap
+			margin = np.minimum(best_taps-min_tap,max_tap-best_taps)
+			for row,chip in enumerate(chips):
+				self.taps[chip] = best_taps[row].tolist()
+				self.margins[chip] = margin[row].tolist()
+			span.set(**dict(('taps_'+chip,self.taps[chip]) for chip in chips))
+		if debug:
+			logging.debug('Printing the calibrated data from chips {0}.....'.format(chip_nums))
+			logging.debug(self.read_rams(chip_nums)[0])
 
-				best_tap = (min_tap+max_tap)//2
-				self.delay_tap(best_tap,channels[k],chip_num)
-			logging.debug('Printing the calibrated data from ram{0}.....'.format(self.chips[chip]))
-			logging.debug(self.read_ram('adc16_wb_ram{0}'.format(self.chips[chip])))
 
 
 
+		#Bitslip channels until the sync pattern is captured
+		with self.tracer.span('sync_chips', chips=''.join(chips)) as span:
+			bitslips = self.sync_chips(chip_nums)
+			for chip in chips:
+				self.bitslips[chip] = bitslips[self.chips[chip]]
+			span.set(**dict(('bitslips_'+chip,self.bitslips[chip]) for chip in chips))
 
-			#Bitslip channels until the sync pattern is captured
-			self.sync_chips(chip_num)
 
 
 
+	def recalibrate_incremental(self,window=2,sync=False):
+		"""
+		Re-centre the delay taps of calibrated chips without resetting the ADC.
+		Probes the deskew pattern at taps within +-window of each lane's current
+		tap and moves lanes whose eye has drifted to the middle of the error free
+		taps seen.  All chips are probed together.  Chips where any lane shows no
+		error free tap in the window (or that were never calibrated) get a full
+		walk_chips_taps instead.  With sync set the tracked chips are also
+		bitslipped onto the sync pattern, which is needed when the taps came
+		from load_taps.  Window 0 only checks the current taps.  Returns a dict
+		of chip -> 'tracked' or 'full'.
+		"""
+		channels = adc16_layout.LANES
+		offsets = range(-window,window+1)
+		result = {}
+		self.set_demux_fpga(4)
+		self.enable_pattern('deskew')
+		chips = sorted(self.chips, key=self.chips.get)
+		tracked = [chip for chip in chips if chip in self.taps]
+		lost = [chip for chip in chips if chip not in self.taps]
+		new_taps = {}
+		new_margins = {}
+		if tracked:
+			with self.tracer.span('recalibrate_incremental', chips=''.join(tracked)):
+				chip_nums = [self.chips[chip] for chip in tracked]
+				current = np.array([self.taps[chip] for chip in tracked])
+				#error_list[offset index][chip][lane], like test_taps over all taps but only around the current taps
+				error_list = np.empty((len(offsets),len(tracked),8), dtype=int)
+				for row,offset in enumerate(offsets):
+					probe = np.clip(current+offset,0,31)
+					self.set_taps(dict((chip_nums[i],probe[i].tolist()) for i in range(len(tracked))))
+					error_list[row] = adc16_layout.lane_errors(self.read_rams(chip_nums)[0])
+				for i,chip in enumerate(tracked):
+					logging.debug('Errors around the current taps of chip {0}, offsets {1}:\n{2}'.format(chip,list(offsets),error_list[:,i]))
+					chip_taps = []
+					chip_margins = []
+					for k in range(8):
+						good = [offsets[j] for j in range(len(offsets)) if error_list[j][i][k]==0 and 0<=current[i][k]+offsets[j]<=31]
+						if not good:
+							logging.warning('Lost the eye of chip {0} lane {1} around tap {2}'.format(chip,channels[k],current[i][k]))
+							lost.append(chip)
+							break
+						#Take the run of good offsets closest to the current tap and move to its middle
+						nearest = min(good, key=abs)
+						min_off = max_off = nearest
+						while min_off-1 in good:
+							min_off -= 1
+						while max_off+1 in good:
+							max_off += 1
+						chip_taps.append(int(current[i][k]+(min_off+max_off)//2))
+						chip_margins.append((max_off-min_off)//2)
+					else:
+						new_taps[chip] = chip_taps
+						#Window 0 only checks the taps, it can't measure a margin: keep the one measured before (or loaded), if any
+						if window:
+							new_margins[chip] = chip_margins
+				#Put every lane of the chips that were probed on its new tap (or back where it was if its chip is lost)
+				self.set_taps(dict((chip_nums[i],new_taps.get(chip,self.taps[chip])) for i,chip in enumerate(tracked)))
+				for chip in sorted(new_taps, key=self.chips.get):
+					logging.info('Chip {0} taps {1} -> {2}'.format(chip,self.taps[chip],new_taps[chip]))
+					self.taps[chip] = new_taps[chip]
+					if chip in new_margins:
+						self.margins[chip] = new_margins[chip]
+					result[chip] = 'tracked'
+				if sync and new_taps:
+					bitslips = self.sync_chips([self.chips[chip] for chip in sorted(new_taps, key=self.chips.get)])
+					for chip in new_taps:
+						self.bitslips[chip] = bitslips[self.chips[chip]]
+		if lost:
+			lost.sort(key=self.chips.get)
+			with self.tracer.span('walk_taps', chips=''.join(lost)):
+				self.walk_chips_taps(lost)
+			for chip in lost:
+				result[chip] = 'full'
+		self.clear_pattern()
+		self.set_demux_fpga(self.demux_mode)
+		return result
 
+	#chip_num can be a single chip number or a list of them, the chips are bitslipped together.
+	#Returns the number of bitslips of each lane, as a dict of chip number -> 8 counts.
 	def sync_chips(self,chip_num):
-			
+		chip_nums = [chip_num] if isinstance(chip_num,int) else list(chip_num)
+		bitslips = dict((n,[0]*8) for n in chip_nums)
 		#channels = {0:'1a',1:'1b',2:'2a',3:'2b',4:'3a',5:'3b',6:'4a',7:'4b'}
 		self.enable_pattern('sync')
-		 			
-			
-		snap = self.read_ram('adc16_wb_ram{0}'.format(chip_num))
+
+
+		snap = self.read_rams(chip_nums)[0]
 		logging.debug('Snapshot before bitslipping:\n')
-		logging.debug(snap[0:8])
-		
+		logging.debug(snap[:,0:8])
+
 		for i in range(8):
 			loop_ctl=0
-			while snap[i] != 0x70:
-				logging.debug('Bitsliping channel %i\n'%i)
-				self.bitslip(chip_num,i)
-				snap = self.read_ram('adc16_wb_ram{0}'.format(chip_num))
+			while True:
+				slip = [chip_nums[row] for row in range(len(chip_nums)) if snap[row,i] != adc16_layout.SYNC_EXPECTED]
+				if not slip:
+					break
+				logging.debug('Bitsliping channel %i of chips %s\n'%(i,slip))
+				self.bitslip(slip,i)
+				for n in slip:
+					bitslips[n][i] += 1
+				snap = self.read_rams(chip_nums)[0]
 				logging.debug('Snapshot after bitslipping:\n')
-				logging.debug(snap[0:8])
+				logging.debug(snap[:,0:8])
 				loop_ctl+=1
 				if loop_ctl>10:
 					print("It appears that bitslipping is not working, make sure you're using the version of Jasper library")
+					self.dump_spi_trace()
 					exit(1)
-	def clock_locked(self):
-		locked_bit = self.snap.read_int('adc16_controller',offset=0) >> 24
-		if locked_bit & 3:
+		return bitslips
+
+	def validate_ramp(self):
+		"""
+		Check the links of all chips with one snapshot of the ramp pattern
+		(see adc16_layout.ramp_check) instead of re-running the deskew and
+		sync checks.  Logs every lane that is not word aligned or has bit
+		errors and returns the ramp_check dict plus 'chips' (the row order)
+		and 'ok'.
+		"""
+		chips = sorted(self.chips, key=self.chips.get)
+		self.set_demux_fpga(4)
+		self.enable_pattern('ramp')
+		data = self.read_all_rams(chips)[0]
+		self.clear_pattern()
+		self.set_demux_fpga(self.demux_mode)
+		result = adc16_layout.ramp_check(data)
+		for row,chip in enumerate(chips):
+			for k,lane in enumerate(adc16_layout.LANES):
+				if result['aligned'][row,k]:
+					continue
+				if not result['ramp'][row,k]:
+					logging.warning('Chip {0} lane {1}: no ramp received, {2:.0%} of the samples follow it'.format(chip,lane,result['monotonic'][row,k]))
+					continue
+				slip = result['slip'][row,k]
+				bad_bits = [b for b in range(8) if result['bit_errors'][row,k,b]]
+				if slip:
+					logging.warning('Chip {0} lane {1}: word boundary off by {2:+d} bits (+ late, - early), errors in bits {3}'.format(chip,lane,
+						slip,bad_bits))
+				else:
+					logging.warning('Chip {0} lane {1}: word aligned, errors in bits {2}'.format(chip,lane,bad_bits))
+		result['chips'] = chips
+		result['ok'] = bool(result['aligned'].all())
+		if result['ok']:
+			logging.info('Ramp pattern received without errors on all lanes')
+		return result
+
+	#Decoded controller word 0 (adc16_layout.ControllerStatus). A status read less than max_age seconds
+	#ago (default status_ttl) is reused, so repeated checks during a calibration cost a single read_int.
+	def status(self,max_age=None):
+		if max_age is None:
+			max_age = self.status_ttl
+		now = time.time()
+		if self._status is None or now-self._status.time > max_age:
+			self._status = adc16_layout.decode_status(self.snap.read_int('adc16_controller',offset=0),now)
+		return self._status
+
+	#Only the LL bits are checked unless measure is set, measuring the clock takes interval seconds
+	#(or nothing if it was already measured this session)
+	def clock_locked(self,max_age=None):
+		status = self.status(max_age)
+		if status.locked:
 			logging.info('ADC clock is locked!!!')
-			print(self.snap.est_brd_clk())
 		else:
-			logging.error('ADC clock not locked, check your clock source/correctly set demux mode')
+			logging.error('ADC clock not locked (status word 0x{0:08x}), check your clock source/correctly set demux mode'.format(status.word))
+			self.dump_spi_trace()
 			exit(1)
+	def measure_clock(self,interval=0.1,refresh=False):
+		"""
+		Estimate the FPGA clock from two reads of the free running
+		sys_clkcounter register interval seconds apart.  Returns (MHz, +-MHz),
+		the error covers the time each read spent on the network plus one
+		counter tick.  The result is cached for the session, pass refresh to
+		measure again.  interval must stay below one wrap of the 32 bit counter
+		(~17 s at 250 MHz).
+		"""
+		if self.board_clock is not None and not refresh:
+			return self.board_clock
+		t0 = time.time()
+		count0 = self.snap.read_uint('sys_clkcounter')
+		t1 = time.time()
+		time.sleep(interval)
+		t2 = time.time()
+		count1 = self.snap.read_uint('sys_clkcounter')
+		t3 = time.time()
+		ticks = (count1-count0) % (1<<32)
+		#Each read happened somewhere inside its request's round trip, take the middle
+		elapsed = ((t2+t3)-(t0+t1))/2.0
+		uncertainty = ((t1-t0)+(t3-t2))/2.0
+		mhz = ticks/elapsed/1e6
+		error_mhz = mhz*uncertainty/elapsed + 1/elapsed/1e6
+		self.board_clock = (mhz,error_mhz)
+		return self.board_clock
+
 	def clear_pattern(self):
 		"""Clears test pattern from ADCs"""
 		self.write_adc(0x25,0x00)
 		self.write_adc(0x45,0x00)
 	def set_gain(self):
-		if self.demux_mode==1:
-			self.write_adc(0x2a,self.gain*0x1111)
-		elif self.demux_mode==2:
-			self.write_adc(0x2b,self.gain*0x0011)
-		elif self.demux_mode==4:
-			self.write_adc(0x2b,self.gain*0x0100) 
-		else:
+		if self.demux_mode not in GAIN_FIELDS:
 			print('demux mode is not set')
 			exit(1)
-	def calibrate(self):
-		
-		self.adc_initialize()
-		#check if clock is locked
-		self.clock_locked()
-		#check if design is ADC16 based
-		self.adc16_based()
-		#Setting gain value, default is 1
-		self.set_gain()
-		#Calibrate ADC by going through various tap values
-		self.walk_taps()
-		#Clear pattern setting registers so real data could be taken
-		self.clear_pattern()
-		print('Setting fpga demux to %i'%self.demux_mode)	
-		self.set_demux_fpga(self.demux_mode)	
-			
-
-
-
-
-
-
+		if self.gain not in GAIN_CODES:
+			logging.error('Invalid gain {0}, possible values: {1}'.format(self.gain,' '.join('%g'%g for g in GAIN_LADDER)))
+			exit(1)
+		reg, shifts = GAIN_FIELDS[self.demux_mode]
+		#Gain codes are factors, not dB
+		self.write_adc(0x33,0x0001)
+		self.write_adc(reg,sum(GAIN_CODES[self.gain]<<shift for shift in shifts))
+
+	#Writes a separate gain for every input of every chip. gains is a (chips, inputs) array of
+	#values from GAIN_LADDER, rows in the order of the chips list (chip letters).
+	def write_gains(self,gains,chips):
+		reg, shifts = GAIN_FIELDS[self.demux_mode]
+		self.write_adc(0x33,0x0001)
+		for chip,chip_gains in zip(chips,gains):
+			value = sum(GAIN_CODES[gain]<<shift for gain,shift in zip(chip_gains,shifts))
+			self.write_adc(reg,value,chip_select=adc16_layout.CHIP_MASKS[self.chips[chip]][adc16_layout.CHIP_SELECT])
+
+	def auto_gain(self,target_rms=16,max_clip=1e-3,snapshots=4,max_iters=6,tolerance=0.2):
+		"""
+		Pick the coarse gain of every input of every chip so sampled data has
+		an RMS close to (not above) target_rms LSB with less than max_clip of
+		the samples at the rails.  Each step takes snapshots captures of all
+		chips at once, estimates every input's ideal gain from its RMS and
+		jumps straight to the nearest gain below it on the ladder, stepping
+		down one more where the data clips.  Inputs within tolerance (as a
+		fraction) of target_rms are left alone.  Stops when no gain changes.
+		Expects a calibrated board with the test pattern cleared.  Returns a
+		dict of chip -> list of gains (adc16_layout.DEMUX_INPUTS order).
+		"""
+		chips = sorted(self.chips, key=self.chips.get)
+		ladder = np.array(GAIN_LADDER, dtype=float)
+		ninputs = len(adc16_layout.DEMUX_INPUTS[self.demux_mode])
+		start = GAIN_LADDER.index(self.gain) if self.gain in GAIN_CODES else 0
+		idx = np.full((len(chips),ninputs), start, dtype=int)
+		for iteration in range(max_iters):
+			self.write_gains(ladder[idx],chips)
+			captures = np.array([self.read_all_rams(chips)[0] for n in range(snapshots)])
+			stats = adc16_stats.snapshot_stats(captures,self.demux_mode)
+			logging.debug('Gains {0}\nRMS {1}\nclipping {2}'.format(ladder[idx],stats['rms'],stats['clip_fraction']))
+			desired = ladder[idx] * target_rms / np.maximum(stats['rms'],0.5)
+			new_idx = np.clip(np.searchsorted(ladder,desired,side='right')-1,0,len(ladder)-1)
+			#Inputs already within tolerance of the target stay put, so noise in the RMS estimate
+			#can't flip them between two neighbouring gains
+			settled = np.abs(stats['rms']-target_rms) <= tolerance*target_rms
+			new_idx[settled] = idx[settled]
+			clipped = stats['clip_fraction'] > max_clip
+			new_idx[clipped] = np.maximum(np.minimum(new_idx[clipped],idx[clipped]-1),0)
+			if (new_idx == idx).all():
+				break
+			idx = new_idx
+		else:
+			self.write_gains(ladder[idx],chips)
+		self.gains = dict((chip,[float(g) for g in ladder[idx[row]]]) for row,chip in enumerate(chips))
+		logging.info('Gains after {0} snapshots: {1}'.format((iteration+1)*snapshots,self.gains))
+		return self.gains
+
+	#Writes the taps found by calibration (and their margins and bitslips) to a JSON file for load_taps
+	def save_taps(self,path):
+		with open(path,'w') as f:
+			json.dump({'taps':self.taps,'margins':self.margins,'bitslips':self.bitslips,'time':time.time()},f,sort_keys=True)
+
+	#Takes the taps of the selected chips from a save_taps file (or its contents as a dict), so calibrate(budget)
+	#can start from them. Returns the chips that were in the file.
+	def load_taps(self,path):
+		if isinstance(path,dict):
+			saved = path
+		else:
+			with open(path) as f:
+				saved = json.load(f)
+		loaded = [chip for chip in sorted(self.chips, key=self.chips.get) if chip in saved['taps']]
+		for chip in loaded:
+			self.taps[chip] = [int(tap) for tap in saved['taps'][chip]]
+			#Older files hold a null margin for chips whose margin was unknown
+			if saved.get('margins',{}).get(chip) is not None:
+				self.margins[chip] = [int(margin) for margin in saved['margins'][chip]]
+			else:
+				self.margins.pop(chip,None)
+			if chip in saved.get('bitslips',{}):
+				self.bitslips[chip] = [int(count) for count in saved['bitslips'][chip]]
+			else:
+				self.bitslips.pop(chip,None)
+		return loaded
+
+	#Seconds per KATCP request (the mean of count status reads) and per capture of all chips (read_rams)
+	def measure_latency(self,count=3):
+		start = time.time()
+		for i in range(count):
+			self.status(0)
+		request = (time.time()-start)/count
+		start = time.time()
+		self.read_rams(self.chip_nums)
+		return request, time.time()-start
+
+	#Estimated (KATCP requests, captures, pattern settles) of finding the taps of all chips, including the sync and
+	#putting the demux mode back: a full walk_chips_taps with window None, otherwise recalibrate_incremental(window,sync=True)
+	def tap_search_cost(self,window):
+		write_adc = 50
+		strobe = 8
+		chips = sorted(self.chips, key=self.chips.get)
+		#set_taps strobes each distinct tap once, the known taps if there are any for every chip
+		known = [tap for chip in chips for tap in self.taps.get(chip,[])]
+		if len(known) == 8*len(chips):
+			set_taps = strobe*len(set(known))
+		else:
+			set_taps = strobe*min(32,8*len(chips))
+		#FPGA demux both ways, deskew and sync pattern (two writes to clear, one to set) and clear_pattern
+		requests = 2 + 2*3*write_adc + 2*write_adc
+		#Syncing takes a capture, then a bitslip and a capture per slip of each lane, the chips slipping together: as many
+		#as the chip needing most. Charge what the last sync of each chip needed, about 4 per lane for chips never synced
+		slips = sum(max(self.bitslips.get(chip,[4]*8)[k] for chip in chips) for k in range(8))
+		requests += 3*slips
+		captures = 1 + slips
+		if window is None:
+			#Bitslip check (two taps, about 4 bitslips each followed by the two taps again) and the 32 tap sweep,
+			#a strobe and a capture per tap
+			requests += 2*strobe + 4*(3+2*strobe) + 32*strobe + set_taps
+			captures += 2 + 4*2 + 32
+		else:
+			requests += (2*window+1)*set_taps + set_taps
+			captures += 2*window+1
+		return requests, captures, 2
 
+	def plan_taps(self,seconds,latency):
+		"""
+		The most thorough tap search that fits in seconds, given the
+		(seconds per request, seconds per capture) latency from
+		measure_latency, as (path, window): ('full', None), ('incremental',
+		window) with the widest window that fits or ('cached', 0), which only
+		checks the known taps.  Without known taps for every chip it is always
+		the full sweep.
+		"""
+		options = [('full',None)]
+		if all(chip in self.taps for chip in self.chips):
+			options += [('incremental',window) for window in (2,1)] + [('cached',0)]
+		for path,window in options:
+			requests,captures,settles = self.tap_search_cost(window)
+			if requests*latency[0] + captures*latency[1] + settles*self.pattern_settle <= seconds:
+				return path,window
+		logging.warning('No tap search fits in the {0:.2f} s left, taking the quickest one'.format(seconds))
+		return options[-1]
+
+	def calibrate(self,budget=None,plan=None):
+		"""
+		Initialize the ADCs, check the clock and find the delay taps and
+		bitslips of every lane.  Without a budget the taps come from a full
+		sweep.  With a budget (seconds) the tap search is planned against the
+		deadline: after the init, lock check and gain the request latency is
+		measured and plan_taps picks the full sweep, an incremental search
+		around the known taps (from an earlier calibration or load_taps) or a
+		check of the known taps.  Chips failing the incremental search or the
+		check get a full sweep whatever the budget.  The lanes are always
+		synced.  plan forces the (path, window) plan_taps would pick, which
+		adc16_replay uses to take the recorded path whatever the replayed
+		latency.  Returns a dict with the 'path' taken and its 'window', the
+		result of each chip ('chips', chip -> 'tracked' or 'full'), the
+		smallest error free 'margin' in taps on either side of any lane (as
+		last measured: the cached path only checks the taps and keeps the
+		margins from load_taps, None if they are unknown), 'latency' (from
+		measure_latency, None without a budget), 'seconds' and 'budget'.
+		"""
+		start = time.time()
+		path,window = 'full',None
+		latency = None
+		with self.tracer.span('calibrate'):
+			with self.tracer.span('adc_initialize'):
+				self.adc_initialize()
+			#check if clock is locked
+			with self.tracer.span('clock_locked'):
+				self.clock_locked()
+			#check if design is ADC16 based
+			with self.tracer.span('adc16_based'):
+				self.adc16_based()
+			#Setting gain value, default is 1
+			with self.tracer.span('set_gain'):
+				self.set_gain()
+			if budget is not None:
+				latency = self.measure_latency()
+				if plan is None:
+					path,window = self.plan_taps(start+budget-time.time(),latency)
+				else:
+					path,window = plan
+				logging.info('{0:.2f} ms per request, {1:.2f} ms per capture, {2:.2f} s left: {3} tap search'.format(latency[0]*1e3,
+					latency[1]*1e3,start+budget-time.time(),path))
+			if path == 'full':
+				#Calibrate ADC by going through various tap values
+				self.walk_taps()
+				#Clear pattern setting registers so real data could be taken
+				with self.tracer.span('clear_pattern'):
+					self.clear_pattern()
+				print('Setting fpga demux to %i'%self.demux_mode)	
+				with self.tracer.span('set_demux_fpga'):
+					self.set_demux_fpga(self.demux_mode)
+				result = dict((chip,'full') for chip in self.chips)
+			else:
+				result = self.recalibrate_incremental(window,sync=True)
+		seconds = time.time()-start
+		margins = [self.margins.get(chip) for chip in self.chips]
+		margin = None if None in margins else min(min(chip_margins) for chip_margins in margins)
+		margin_text = 'unknown' if margin is None else '{0} taps'.format(margin)
+		if budget is None:
+			logging.info('Calibrated in {0:.2f} s, margin {1}'.format(seconds,margin_text))
+		else:
+			logging.info('Calibrated ({0}) in {1:.2f} s of a {2:.2f} s budget, margin {3}'.format(path,seconds,budget,margin_text))
+			if seconds > budget:
+				logging.warning('Calibration overran its budget by {0:.2f} s'.format(seconds-budget))
+		return {'path':path, 'window':window, 'chips':result, 'margin':margin, 'latency':latency, 'seconds':seconds, 'budget':budget}
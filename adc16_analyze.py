@@ -0,0 +1,156 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+
+import adc16_layout
+import adc16_pfb
+import adc16_stats
+import adc16_recorder
+import adc16_xcorr
+
+
+# Batch analysis of a dataset recorded with adc16_recorder.py, spread over a
+# process pool.
+#
+# The dataset is split into shards of whole captures.  Each worker opens the
+# dataset itself (a read-only memmap, so only the shard's pages are read and
+# nothing is pickled but the shard bounds), de-interleaves the captures and
+# runs the same vectorized kernels as the live tools on them:
+# adc16_stats.input_histograms and the adc16_pfb channelizer.  Shards return
+# histograms and summed power spectra, which simply add, so the merge is a
+# sum and the result does not depend on how the dataset was split.
+
+#Captures a worker processes per vectorized pass, bounds its memory use
+BATCH = 256
+
+#Dataset memmaps opened by this (worker) process
+_datasets = {}
+
+
+def _open(path):
+	if path not in _datasets:
+		_datasets[path] = adc16_recorder.open_dataset(path)
+	return _datasets[path]
+
+
+def analyze_shard(args):
+	"""
+	Worker: histograms (chips, inputs, 256) and summed PFB power spectra
+	(chips, inputs, nchan) of captures start to stop.
+	"""
+	path, start, stop, nchips, demux_mode, nchan, ntaps = args
+	data, index = _open(path)
+	pfb = adc16_pfb.PolyphaseFilterbank(nchan, ntaps)
+	hist = 0
+	power = 0
+	for first in range(start, stop, BATCH):
+		last = min(first + BATCH, stop)
+		captures = np.asarray(data[first * nchips:last * nchips]).reshape(last - first, nchips, -1)
+		hist = hist + adc16_stats.input_histograms(captures, demux_mode)
+		samples = adc16_layout.deinterleave(captures, demux_mode).astype(np.float32)
+		power = power + pfb.power(samples).sum(axis=0)
+	return hist, power, stop - start
+
+
+def analyze(path, processes=None, shard_captures=1024, nchan=32, ntaps=4, demux_mode=None):
+	"""
+	Analyze a whole dataset with a pool of processes (default one per core).
+	Returns a dict with the histogram_stats of every input ('stats', arrays
+	shaped (chips, inputs)), the mean PFB power spectrum of every input
+	('power', (chips, inputs, nchan)), input 'labels', 'captures' and
+	'seconds'.
+	"""
+	start_time = time.time()
+	data, index = adc16_recorder.open_dataset(path)
+	ncaptures, chip_nums, recorded_demux = adc16_recorder.dataset_layout(index)
+	if not ncaptures:
+		raise ValueError('%s holds no captures' % path)
+	if demux_mode is None:
+		demux_mode = recorded_demux
+	shards = [(path, first, min(first + shard_captures, ncaptures), len(chip_nums), demux_mode, nchan, ntaps)
+		for first in range(0, ncaptures, shard_captures)]
+	pool = multiprocessing.Pool(processes)
+	try:
+		hist = 0
+		power = 0
+		count = 0
+		for shard_hist, shard_power, n in pool.imap_unordered(analyze_shard, shards):
+			hist = hist + shard_hist
+			power = power + shard_power
+			count += n
+	finally:
+		pool.close()
+		pool.join()
+	return {'stats': adc16_stats.histogram_stats(hist), 'hist': hist, 'power': power / count,
+		'labels': adc16_xcorr.input_labels(chip_nums, demux_mode), 'captures': count,
+		'seconds': time.time() - start_time}
+
+
+def make_dataset(path, ncaptures=8192, nchips=3, demux_mode=2, rms=8.0):
+	"""Record ncaptures simulated captures (noise plus a tone per input) to a dataset for benchmarking."""
+	rng = np.random.RandomState(0)
+	tone = 20 * np.sin(2 * np.pi * 0.1 * np.arange(1024))
+	recorder = adc16_recorder.CaptureRecorder(path)
+	for n in range(ncaptures):
+		data = np.clip(np.round(rng.randn(nchips, 1024) * rms + tone), -128, 127).astype(np.int8)
+		recorder.append(data, float(n), list(range(nchips)), demux_mode, 1)
+	recorder.close()
+
+
+def benchmark(path=None, process_counts=None, shard_captures=512):
+	"""
+	Captures/s analyze reaches with each number of processes in
+	process_counts (default 1, 2, 4 ... up to the number of cores).  path is
+	a recorded dataset, None records a simulated one to a temporary
+	directory first.
+	"""
+	if process_counts is None:
+		process_counts = [1]
+		while process_counts[-1] * 2 <= multiprocessing.cpu_count():
+			process_counts.append(process_counts[-1] * 2)
+	tmp = None
+	if path is None:
+		tmp = tempfile.mkdtemp()
+		path = os.path.join(tmp, 'benchmark')
+		make_dataset(path)
+	try:
+		results = []
+		for processes in process_counts:
+			result = analyze(path, processes, shard_captures)
+			results.append((processes, result['captures'] / result['seconds']))
+		return results
+	finally:
+		if tmp is not None:
+			shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_analyze.py DATASET [OPTIONS], statistics and spectra of every input of a dataset recorded with adc16_recorder.py')
+	p.add_argument('dataset', type = str, nargs = '?', default = None, help = 'dataset name given to adc16_recorder.py, optional with --benchmark')
+	p.add_argument('-p', '--processes', dest = 'processes', type = int, default = None, help = 'Number of worker processes, default is one per core')
+	p.add_argument('-s', '--shard', dest = 'shard_captures', type = int, default = 1024, help = 'Captures per shard handed to a worker, default is 1024')
+	p.add_argument('-n', '--nchan', dest = 'nchan', type = int, default = 32, help = 'Number of PFB channels, default is 32')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = None, help = 'Demux mode to de-interleave with, default is the recorded one')
+	p.add_argument('--benchmark', action = 'store_true', dest = 'benchmark', help = 'time the analysis with 1, 2, 4 ... processes (on a simulated dataset if none is given)')
+	args = p.parse_args()
+
+	if args.benchmark:
+		results = benchmark(args.dataset)
+		for processes, rate in results:
+			print('%3d processes: %8.0f captures/s  %5.2fx' % (processes, rate, rate / results[0][1]))
+	else:
+		if args.dataset is None:
+			p.error('specify the dataset or --benchmark')
+		result = analyze(args.dataset, args.processes, args.shard_captures, args.nchan, demux_mode=args.demux_mode)
+		stats = result['stats']
+		print('%d captures in %.2f s' % (result['captures'], result['seconds']))
+		print('input    mean     rms    clip  eff. bits  peak channel')
+		nchips, ninputs = stats['rms'].shape
+		for i, label in enumerate(result['labels']):
+			chip, inp = divmod(i, ninputs)
+			print('%-5s %7.2f %7.2f %7.4f %10.2f %13d' % (label, stats['mean'][chip, inp], stats['rms'][chip, inp],
+				stats['clip_fraction'][chip, inp], stats['effective_bits'][chip, inp], result['power'][chip, inp, 1:].argmax() + 1))
@@ -0,0 +1,351 @@
+import json
+import time
+import zlib
+import struct
+import numpy as np
+
+import adc16_layout
+
+
+# Compact archive format for ADC captures.
+#
+# Samples are stored de-interleaved (adc16_layout.deinterleave) in chunks of
+# a fixed number of captures, each chunk (captures, chips, inputs, samples)
+# int8.  Every chunk is encoded with each codec and the smallest result is
+# kept:
+#
+#   raw    the int8 samples as they are
+#   for    frame of reference: samples minus the chunk minimum, bit packed
+#          to the width the chunk's range needs (a signal swinging +-6 LSB
+#          takes 4 bits per sample), up to 8 bits
+#   delta  first sample of every series kept as is, the differences between
+#          neighbouring samples bit packed like 'for' (wins on slow signals)
+#   zlib   zlib level 1 of the raw samples
+#
+# Bit packing is vectorized: every group of 8 values is shifted into one 64
+# bit word and the low width bytes of the words are kept, see pack_bits.
+#
+# File layout (little endian):
+#
+#   'ADC16ARC' version u4, header length u4, JSON header (chip numbers,
+#              demux mode, snapshot length, chunk size)
+#   chunks     CHUNK_HEADER, trigger times f8 per capture, payload
+#   index      INDEX_DTYPE entry per chunk
+#   footer     index offset u8, number of chunks u4, 'ADC16END'
+#
+# The index at the end lets a reader go straight to any chunk (read_chunk)
+# without scanning the file.
+
+MAGIC = b'ADC16ARC'
+END_MAGIC = b'ADC16END'
+FORMAT_VERSION = 1
+
+CODECS = ('raw', 'for', 'delta', 'zlib')
+
+#codec number, bit width, reference value (minimum), payload length, captures
+CHUNK_HEADER = struct.Struct('<BBhII')
+FOOTER = struct.Struct('<QI8s')
+
+INDEX_DTYPE = np.dtype([
+	('offset', '<u8'),	#file offset of the chunk header
+	('length', '<u4'),	#bytes in the chunk including its header
+	('first', '<u4'),	#number of the first capture in the chunk
+	('captures', '<u4'),
+	('codec', 'u1'),
+	('width', 'u1'),
+	('timestamp', '<f8'),	#trigger time of the first capture
+])
+
+
+def pack_bits(values, width):
+	"""
+	Pack non-negative integers below 2**width (width <= 8) into bytes.
+	Every 8 values become width bytes: they are shifted into one little
+	endian 64 bit word per group and the low width bytes of it are kept.
+	"""
+	values = np.asarray(values).ravel()
+	if width == 0:
+		return b''
+	groups = np.zeros(-(-len(values) // 8) * 8, dtype=np.uint64)
+	groups[:len(values)] = values
+	words = (groups.reshape(-1, 8) << (np.arange(8, dtype=np.uint64) * np.uint64(width))).sum(axis=1, dtype=np.uint64)
+	return words.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :width].tobytes()
+
+
+def unpack_bits(payload, width, count):
+	"""Inverse of pack_bits, returns count int32 values."""
+	if width == 0:
+		return np.zeros(count, dtype=np.int32)
+	ngroups = -(-count // 8)
+	words = np.zeros((ngroups, 8), dtype=np.uint8)
+	words[:, :width] = np.frombuffer(payload, dtype=np.uint8, count=ngroups * width).reshape(ngroups, width)
+	words = words.view('<u8')
+	values = (words >> (np.arange(8, dtype=np.uint64) * np.uint64(width))) & np.uint64((1 << width) - 1)
+	return values.ravel()[:count].astype(np.int32)
+
+
+def _frame(values):
+	"""(reference, width) to bit pack values, width None if they need more than 8 bits."""
+	if not values.size:
+		return 0, 0
+	reference = int(values.min())
+	width = (int(values.max()) - reference).bit_length()
+	return reference, (width if width <= 8 else None)
+
+
+def encode_chunk(chunk, codecs=CODECS):
+	"""
+	Encode a (captures, chips, inputs, samples) int8 chunk with the smallest
+	of codecs, returns (codec, width, reference, payload).  The packed size
+	of 'for' and 'delta' follows from the bit width, so only the winner is
+	actually packed.
+	"""
+	chunk = np.ascontiguousarray(chunk, dtype=np.int8)
+	count = chunk.size
+	nseries = count // chunk.shape[-1] if count else 0
+	best = None
+	for codec in codecs:
+		if codec == 'raw':
+			candidate = (count, codec, 0, 0, None)
+		elif codec == 'for':
+			values = chunk.astype(np.int32)
+			reference, width = _frame(values)
+			if width is None:
+				continue
+			candidate = (-(-count // 8) * width, codec, width, reference, values)
+		elif codec == 'delta':
+			values = np.diff(chunk.astype(np.int32), axis=-1)
+			reference, width = _frame(values)
+			if width is None:
+				continue
+			candidate = (nseries + -(-values.size // 8) * width, codec, width, reference, values)
+		elif codec == 'zlib':
+			payload = zlib.compress(chunk.tobytes(), 1)
+			candidate = (len(payload), codec, 0, 0, payload)
+		else:
+			raise ValueError('Unknown codec %r' % (codec,))
+		if best is None or candidate[0] < best[0]:
+			best = candidate
+	if best is None:
+		#The data needs all 8 bits and raw was not among the codecs
+		best = (count, 'raw', 0, 0, None)
+	size, codec, width, reference, values = best
+	if codec == 'raw':
+		payload = chunk.tobytes()
+	elif codec == 'for':
+		payload = pack_bits(values - reference, width)
+	elif codec == 'delta':
+		payload = chunk[..., 0].tobytes() + pack_bits(values - reference, width)
+	else:
+		payload = values
+	return codec, width, reference, payload
+
+
+def decode_chunk(codec, width, reference, payload, shape):
+	"""Decode a chunk payload back to an int8 array of shape (captures, chips, inputs, samples)."""
+	count = int(np.prod(shape))
+	if codec == 'raw':
+		data = np.frombuffer(payload, dtype=np.int8, count=count)
+	elif codec == 'for':
+		data = (unpack_bits(payload, width, count) + reference).astype(np.int8)
+	elif codec == 'delta':
+		nseries = count // shape[-1]
+		first = np.frombuffer(payload, dtype=np.int8, count=nseries).astype(np.int32)
+		deltas = unpack_bits(payload[nseries:], width, nseries * (shape[-1] - 1)) + reference
+		values = np.empty((nseries, shape[-1]), dtype=np.int32)
+		values[:, 0] = first
+		values[:, 1:] = deltas.reshape(nseries, shape[-1] - 1)
+		data = np.cumsum(values, axis=-1).astype(np.int8)
+	elif codec == 'zlib':
+		data = np.frombuffer(zlib.decompress(payload), dtype=np.int8, count=count)
+	else:
+		raise ValueError('Unknown codec %r' % (codec,))
+	return data.reshape(shape)
+
+
+class ArchiveWriter():
+
+	def __init__(self, path, chip_nums, demux_mode, snapshot_len=1024, chunk_captures=64, codecs=CODECS):
+		self.chip_nums = list(chip_nums)
+		self.demux_mode = demux_mode
+		self.ninputs = len(adc16_layout.DEMUX_INPUTS[demux_mode])
+		self.snapshot_len = snapshot_len
+		self.chunk_captures = chunk_captures
+		self.codecs = codecs
+		self.shape = (len(self.chip_nums), self.ninputs, snapshot_len // self.ninputs)
+		self._buffer = np.empty((chunk_captures,) + self.shape, dtype=np.int8)
+		self._times = np.empty(chunk_captures, dtype='<f8')
+		self._fill = 0
+		self.captures = 0
+		self.index = []
+		self.raw_bytes = 0
+		self._file = open(path, 'wb')
+		header = json.dumps({'chip_nums': self.chip_nums, 'demux_mode': demux_mode,
+			'snapshot_len': snapshot_len, 'chunk_captures': chunk_captures}).encode('ascii')
+		self._file.write(MAGIC + struct.pack('<II', FORMAT_VERSION, len(header)) + header)
+
+	def append(self, data, trig_time):
+		"""Add one (chips, snapshot_len) capture as returned by ADC16.read_all_rams."""
+		self._buffer[self._fill] = adc16_layout.deinterleave(data, self.demux_mode)
+		self._times[self._fill] = trig_time
+		self._fill += 1
+		if self._fill == self.chunk_captures:
+			self.flush()
+
+	def append_many(self, data, trig_times):
+		"""Add a (captures, chips, snapshot_len) batch."""
+		for capture, trig_time in zip(data, trig_times):
+			self.append(capture, trig_time)
+
+	def flush(self):
+		"""Write the buffered captures out as a chunk."""
+		if not self._fill:
+			return
+		n = self._fill
+		codec, width, reference, payload = encode_chunk(self._buffer[:n], self.codecs)
+		offset = self._file.tell()
+		self._file.write(CHUNK_HEADER.pack(CODECS.index(codec), width, reference, len(payload), n))
+		self._file.write(self._times[:n].tobytes())
+		self._file.write(payload)
+		self.index.append((offset, self._file.tell() - offset, self.captures, n, CODECS.index(codec), width, self._times[0]))
+		self.raw_bytes += n * len(self.chip_nums) * self.snapshot_len
+		self.captures += n
+		self._fill = 0
+
+	def close(self):
+		self.flush()
+		index_offset = self._file.tell()
+		self._file.write(np.array(self.index, dtype=INDEX_DTYPE).tobytes())
+		self._file.write(FOOTER.pack(index_offset, len(self.index), END_MAGIC))
+		self.size = self._file.tell()
+		self._file.close()
+
+
+class ArchiveReader():
+
+	def __init__(self, path):
+		self._file = open(path, 'rb')
+		try:
+			if self._file.read(len(MAGIC)) != MAGIC:
+				raise ValueError('%s is not an ADC16 archive' % path)
+			version, header_len = struct.unpack('<II', self._file.read(8))
+			if version != FORMAT_VERSION:
+				raise ValueError('Unsupported archive version %r' % (version,))
+			self.header = json.loads(self._file.read(header_len).decode('ascii'))
+			self.chip_nums = self.header['chip_nums']
+			self.demux_mode = self.header['demux_mode']
+			ninputs = len(adc16_layout.DEMUX_INPUTS[self.demux_mode])
+			self.shape = (len(self.chip_nums), ninputs, self.header['snapshot_len'] // ninputs)
+			self._file.seek(-FOOTER.size, 2)
+			index_offset, nchunks, end = FOOTER.unpack(self._file.read(FOOTER.size))
+			if end != END_MAGIC:
+				raise ValueError('%s has no index, the writer was not closed' % path)
+			self._file.seek(index_offset)
+			self.index = np.frombuffer(self._file.read(nchunks * INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)
+		except Exception:
+			self._file.close()
+			raise
+		self.captures = int(self.index['captures'].sum())
+
+	def __len__(self):
+		return len(self.index)
+
+	def read_chunk(self, i):
+		"""
+		Returns the (captures, chips, inputs, samples) int8 samples of chunk i
+		and the trigger time of each capture.
+		"""
+		entry = self.index[i]
+		self._file.seek(int(entry['offset']))
+		raw = self._file.read(int(entry['length']))
+		codec, width, reference, length, n = CHUNK_HEADER.unpack_from(raw)
+		times = np.frombuffer(raw, dtype='<f8', count=n, offset=CHUNK_HEADER.size)
+		payload = raw[CHUNK_HEADER.size + 8 * n:]
+		return decode_chunk(CODECS[codec], width, reference, payload, (n,) + self.shape), times
+
+	def chunk_of(self, capture):
+		"""Number of the chunk holding capture number capture."""
+		return int(np.searchsorted(self.index['first'], capture, side='right')) - 1
+
+	def read_capture(self, capture):
+		"""Samples (chips, inputs, samples) and trigger time of one capture."""
+		i = self.chunk_of(capture)
+		data, times = self.read_chunk(i)
+		row = capture - int(self.index['first'][i])
+		return data[row], times[row]
+
+	def close(self):
+		self._file.close()
+
+
+def convert(dataset, path, chunk_captures=64):
+	"""Write an adc16_recorder dataset to an archive, returns the ArchiveWriter."""
+	import adc16_recorder
+	data, index = adc16_recorder.open_dataset(dataset)
+	ncaptures, chip_nums, demux_mode = adc16_recorder.dataset_layout(index)
+	if not ncaptures:
+		raise ValueError('%s holds no captures' % dataset)
+	nchips = len(chip_nums)
+	captures = data.reshape(ncaptures, nchips, data.shape[-1])
+	writer = ArchiveWriter(path, chip_nums, demux_mode, data.shape[-1], chunk_captures)
+	writer.append_many(captures, index['timestamp'][::nchips])
+	writer.close()
+	return writer
+
+
+def test_signal(ncaptures=256, nchips=3, rms=3.0, tone=0.0):
+	"""Captures of Gaussian noise of rms LSB, plus a slow tone of that amplitude if given."""
+	rng = np.random.RandomState(0)
+	data = rng.randn(ncaptures, nchips, 1024) * rms
+	if tone:
+		data += tone * np.sin(2 * np.pi * np.arange(1024) / 200.0)
+	return np.clip(np.round(data), -128, 127).astype(np.int8)
+
+
+def benchmark(data, demux_mode=2, chunk_captures=64, codecs=CODECS):
+	"""
+	Compression ratio and encode/decode MB/s (of raw samples) over a
+	(captures, chips, snapshot_len) array, all chunks encoded with the
+	given codecs.
+	"""
+	ninputs = len(adc16_layout.DEMUX_INPUTS[demux_mode])
+	samples = adc16_layout.deinterleave(data, demux_mode)
+	chunks = [samples[i:i + chunk_captures] for i in range(0, len(samples), chunk_captures)]
+	start = time.time()
+	encoded = [encode_chunk(chunk, codecs) for chunk in chunks]
+	encode_time = time.time() - start
+	start = time.time()
+	for chunk, (codec, width, reference, payload) in zip(chunks, encoded):
+		decoded = decode_chunk(codec, width, reference, payload, chunk.shape)
+	decode_time = time.time() - start
+	if not (decoded == chunks[-1]).all():
+		raise ValueError('Chunk did not survive encoding')
+	nbytes = float(data.size)
+	packed = sum(len(payload) + CHUNK_HEADER.size + 8 * len(chunk) for chunk, (codec, width, reference, payload) in zip(chunks, encoded))
+	used = dict((codec, sum(1 for e in encoded if e[0] == codec)) for codec in codecs)
+	return {'ratio': nbytes / packed, 'encode_mbps': nbytes / encode_time / 1e6, 'decode_mbps': nbytes / decode_time / 1e6, 'codecs': used}
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_archive.py DATASET OUTPUT [OPTIONS], compress a dataset recorded with adc16_recorder.py')
+	p.add_argument('dataset', type = str, nargs = '?', default = None, help = 'dataset name given to adc16_recorder.py, leave out with --benchmark')
+	p.add_argument('output', type = str, nargs = '?', default = None, help = 'archive file to write')
+	p.add_argument('-n', '--chunk', dest = 'chunk_captures', type = int, default = 64, help = 'Captures per chunk, default is 64')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Demux mode of the benchmark data, default is 2')
+	p.add_argument('--benchmark', action = 'store_true', dest = 'benchmark', help = 'time every codec on simulated captures instead of converting a dataset')
+	args = p.parse_args()
+
+	if args.benchmark:
+		for label, data in (('noise 3 LSB rms', test_signal(rms=3.0)), ('noise 20 LSB rms', test_signal(rms=20.0)),
+				('tone 40 LSB + noise 1 LSB', test_signal(rms=1.0, tone=40.0))):
+			for codecs in [(codec,) for codec in CODECS] + [CODECS]:
+				result = benchmark(data, args.demux_mode, args.chunk_captures, codecs)
+				print('%-26s %-20s ratio %5.2f  encode %7.1f MB/s  decode %7.1f MB/s' % (label, '+'.join(codecs),
+					result['ratio'], result['encode_mbps'], result['decode_mbps']))
+	else:
+		if args.dataset is None or args.output is None:
+			p.error('specify the dataset and the output archive, or --benchmark')
+		writer = convert(args.dataset, args.output, args.chunk_captures)
+		print('%d captures in %d chunks: %.1f MB -> %.1f MB (%.2fx)' % (writer.captures, len(writer.index),
+			writer.raw_bytes / 1e6, writer.size / 1e6, writer.raw_bytes / float(writer.size)))
@@ -0,0 +1,433 @@
+import re
+import time
+import struct
+import asyncio
+import logging
+import collections
+import numpy as np
+
+import adc16_layout
+
+
+# asyncio version of the board access in adc16.py, for driving many boards at
+# once from one thread.  Python 3 only.
+#
+# AsyncKatcpClient speaks the KATCP requests FpgaClient uses for register
+# and BRAM access (?write, ?read, ?listdev) over an asyncio stream.  Requests
+# are pipelined: send() writes the request straight away and returns a
+# future, and the replies, which a KATCP device sends in request order, are
+# matched to the oldest outstanding request by a reader task.  The 50 writes
+# of one SPI register write therefore cost one round trip instead of 50.
+#
+# AsyncADC16 has coroutine versions of the ADC16 methods used to set up and
+# capture a calibrated board (write_adc, enable_pattern, set_demux_fpga,
+# read_all_rams, ...).  Boards are run concurrently with asyncio.gather, see
+# gather_boards.  Calibration itself stays in adc16.py.
+#
+# KatcpStandIn is a local asyncio server answering the same requests from
+# memory, with a configurable reply latency, used by benchmark() to show
+# what pipelining and gathering buy when the link is latency bound.
+
+KATCP_PORT = 7147
+
+#KATCP argument escapes
+_ESCAPES = {b'\\': b'\\\\', b' ': b'\\_', b'\0': b'\\0', b'\n': b'\\n', b'\r': b'\\r', b'\x1b': b'\\e', b'\t': b'\\t'}
+_UNESCAPES = dict((v[1:], k) for k, v in _ESCAPES.items())
+_ESCAPE_RE = re.compile(b'[\\\\ \0\n\r\x1b\t]')
+_UNESCAPE_RE = re.compile(b'\\\\(.)')
+
+
+def escape(arg):
+	"""Escape one KATCP argument (bytes or str)."""
+	if not isinstance(arg, bytes):
+		arg = str(arg).encode('latin-1')
+	if not arg:
+		return b'\\@'
+	return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group()], arg)
+
+
+def unescape(arg):
+	if arg == b'\\@':
+		return b''
+	return _UNESCAPE_RE.sub(lambda m: _UNESCAPES[m.group(1)], arg)
+
+
+def format_message(mtype, name, *args):
+	"""KATCP message line, mtype is b'?', b'!' or b'#'."""
+	return b' '.join([mtype + name.encode('ascii')] + [escape(arg) for arg in args]) + b'\n'
+
+
+def parse_message(line):
+	"""Returns (mtype, name, args) of a KATCP message line, args as bytes."""
+	words = [w for w in line.rstrip(b'\r\n').split(b' ') if w]
+	if not words:
+		return None
+	return words[0][:1], words[0][1:].decode('ascii'), [unescape(w) for w in words[1:]]
+
+
+class KatcpError(Exception):
+	pass
+
+
+class AsyncKatcpClient():
+
+	def __init__(self, reader, writer):
+		self._reader = reader
+		self._writer = writer
+		#(name, future, informs) of every request sent and not answered yet, oldest first
+		self._pending = collections.deque()
+		self._reader_task = asyncio.ensure_future(self._read_replies())
+
+	@classmethod
+	async def connect(cls, host, port=KATCP_PORT):
+		reader, writer = await asyncio.open_connection(host, port)
+		return cls(reader, writer)
+
+	def send(self, name, *args):
+		"""
+		Send a request without waiting for the reply.  Returns a future of
+		(reply arguments, informs), or raising KatcpError if the device
+		does not answer 'ok'.
+		"""
+		future = asyncio.get_running_loop().create_future()
+		self._pending.append((name, future, []))
+		self._writer.write(format_message(b'?', name, *args))
+		return future
+
+	async def request(self, name, *args):
+		return await self.send(name, *args)
+
+	async def drain(self):
+		await self._writer.drain()
+
+	async def _read_replies(self):
+		try:
+			while True:
+				try:
+					line = await self._reader.readline()
+				except ConnectionError:
+					#Reset by the device, the outstanding requests fail below like on a clean close
+					line = b''
+				if not line:
+					break
+				message = parse_message(line)
+				if message is None:
+					continue
+				mtype, name, args = message
+				#Informs that belong to no request (#version-connect, #log ...) are dropped
+				if not self._pending or self._pending[0][0] != name:
+					if mtype == b'!':
+						logging.warning('Unexpected KATCP reply !{0}'.format(name))
+					continue
+				if mtype == b'#':
+					self._pending[0][2].append(args)
+				elif mtype == b'!':
+					name, future, informs = self._pending.popleft()
+					if future.done():
+						continue
+					if args and args[0] == b'ok':
+						future.set_result((args[1:], informs))
+					else:
+						future.set_exception(KatcpError('?{0} failed: {1}'.format(name, b' '.join(args).decode('latin-1'))))
+		finally:
+			while self._pending:
+				future = self._pending.popleft()[1]
+				if not future.done():
+					future.set_exception(ConnectionError('KATCP connection closed'))
+
+	def write(self, device, data, offset=0):
+		"""?write of raw bytes at a byte offset, returns the reply future."""
+		return self.send('write', device, offset, data)
+
+	async def read(self, device, size, offset=0):
+		args, informs = await self.send('read', device, offset, size)
+		return args[0]
+
+	async def listdev(self):
+		args, informs = await self.send('listdev')
+		return [inform[0].decode('ascii') for inform in informs]
+
+	async def close(self):
+		self._writer.close()
+		await self._reader_task
+		try:
+			await self._writer.wait_closed()
+		except ConnectionError:
+			pass
+
+
+#32 bit word as written by FpgaClient.write_int
+def pack_int(value):
+	return struct.pack('>i' if value < 0 else '>I', value)
+
+
+class AsyncADC16():
+
+	def __init__(self, client, chips=('a', 'b', 'c'), demux_mode=2, pipeline=True):
+		"""
+		client is a connected AsyncKatcpClient.  With pipeline off every
+		register write waits for its reply before the next is sent, which is
+		what the blocking FpgaClient does.
+		"""
+		self.client = client
+		self.demux_mode = demux_mode
+		self.pipeline = pipeline
+		self.chips = {}
+		for chip in chips:
+			if chip.lower() not in adc16_layout.CHIP_INDEX:
+				raise ValueError('Invalid chip name %r, available values: a to h' % (chip,))
+			self.chips[chip.lower()] = adc16_layout.CHIP_INDEX[chip.lower()]
+		self.chip_nums = sorted(self.chips.values())
+		self.chip_select = adc16_layout.chip_mask(self.chip_nums, adc16_layout.CHIP_SELECT)
+		#Same status cache as ADC16.status
+		self._status = None
+		self.status_ttl = 2.0
+
+	@classmethod
+	async def connect(cls, host, port=KATCP_PORT, **kwargs):
+		return cls(await AsyncKatcpClient.connect(host, port), **kwargs)
+
+	async def close(self):
+		await self.client.close()
+
+	async def write_ints(self, device, values, offset=0):
+		"""Write a sequence of 32 bit values to the same word, in order."""
+		if not self.pipeline:
+			for value in values:
+				await self.client.write(device, pack_int(value), offset * 4)
+			return
+		futures = [self.client.write(device, pack_int(value), offset * 4) for value in values]
+		await self.client.drain()
+		await asyncio.gather(*futures)
+
+	async def write_int(self, device, value, offset=0):
+		await self.write_ints(device, [value], offset)
+
+	async def read_int(self, device, offset=0):
+		return struct.unpack('>i', await self.client.read(device, 4, offset * 4))[0]
+
+	#Same SPI bit banging as ADC16.write_adc, all 50 controller writes are sent back to back
+	async def write_adc(self, addr, data, chip_select=None):
+		SCLK = 0x200
+		CS = self.chip_select if chip_select is None else chip_select
+		SDA_SHIFT = 8
+		states = [SCLK]
+		for i in range(8):
+			addr_bit = (addr >> (8 - i - 1)) & 1
+			states += [(addr_bit << SDA_SHIFT) | CS, (addr_bit << SDA_SHIFT) | CS | SCLK]
+		for j in range(16):
+			data_bit = (data >> (16 - j - 1)) & 1
+			states += [(data_bit << SDA_SHIFT) | CS, (data_bit << SDA_SHIFT) | CS | SCLK]
+		states.append(SCLK)
+		await self.write_ints('adc16_controller', states, offset=0)
+
+	async def enable_pattern(self, pattern, custom=None):
+		"""Same patterns as ADC16.enable_pattern, 'custom' needs its 8 bits as custom (there is no -p bitstream here)."""
+		if pattern not in ('ramp', 'deskew', 'sync', 'custom'):
+			raise ValueError('Invalid test pattern %r' % (pattern,))
+		if pattern == 'custom' and custom is None:
+			raise ValueError('The custom test pattern needs its 8 bit value as custom')
+		await self.write_adc(0x25, 0x00)
+		await self.write_adc(0x45, 0x00)
+		if pattern == 'ramp':
+			await self.write_adc(0x25, 0x0040)
+		elif pattern == 'deskew':
+			await self.write_adc(0x45, 0x0001)
+		elif pattern == 'sync':
+			await self.write_adc(0x45, 0x0002)
+		else:
+			await self.write_adc(0x26, (custom & 0xff) << 8)
+			await self.write_adc(0x25, 0x0010)
+
+	async def clear_pattern(self):
+		await self.write_adc(0x25, 0x00)
+		await self.write_adc(0x45, 0x00)
+
+	async def set_demux_fpga(self, fpga_demux):
+		modes = {1: 0, 2: 1, 4: 2}
+		if fpga_demux not in modes:
+			raise ValueError('Invalid demux mode %r' % (fpga_demux,))
+		await self.write_int('adc16_controller', (4 + modes[fpga_demux]) << 24, offset=1)
+
+	async def status(self, max_age=None):
+		"""Coroutine version of ADC16.status, a decoded controller word 0 at most max_age seconds old."""
+		if max_age is None:
+			max_age = self.status_ttl
+		now = time.time()
+		if self._status is None or now - self._status.time > max_age:
+			self._status = adc16_layout.decode_status(await self.read_int('adc16_controller', offset=0), now)
+		return self._status
+
+	async def clock_locked(self, max_age=None):
+		return (await self.status(max_age)).locked
+
+	async def snap_trigger(self):
+		SNAP_REQ = 0x00010000
+		await self.write_ints('adc16_controller', [0, SNAP_REQ], offset=1)
+		return time.time()
+
+	async def read_all_rams(self, chips=None):
+		"""Coroutine version of ADC16.read_all_rams, the BRAM reads are pipelined."""
+		chip_nums = self.chip_nums if chips is None else [self.chips[chip] for chip in chips]
+		trig_time = await self.snap_trigger()
+		reads = [self.client.read(adc16_layout.RAMS[chip_num], 1024) for chip_num in chip_nums]
+		if self.pipeline:
+			snapshots = await asyncio.gather(*reads)
+		else:
+			snapshots = [await read for read in reads]
+		data = np.empty((len(chip_nums), 1024), dtype=np.int8)
+		for row, snapshot in enumerate(snapshots):
+			data[row] = np.frombuffer(snapshot, dtype=np.int8)
+		return data, trig_time
+
+
+async def gather_boards(adcs, method, *args, **kwargs):
+	"""Run the same AsyncADC16 coroutine method on every board at once, returns the results in order."""
+	return await asyncio.gather(*(getattr(adc, method)(*args, **kwargs) for adc in adcs))
+
+
+async def poll_status(adcs, max_age=0):
+	"""
+	Coroutine version of adc16.poll_status: the ControllerStatus of every
+	board, or the exception raised for a board that could not be read.
+	"""
+	return await asyncio.gather(*(adc.status(max_age) for adc in adcs), return_exceptions=True)
+
+
+class KatcpStandIn():
+
+	def __init__(self, nchips=3, latency=0.0):
+		"""
+		In-memory stand-in for a board's KATCP server.  adc16_controller and
+		the adc16_wb_ram BRAMs of nchips chips are plain byte arrays.  Every
+		reply is held back latency seconds (as if it crossed a slow link),
+		without holding up the requests behind it.
+		"""
+		self.latency = latency
+		self.devices = {'adc16_controller': bytearray(16), 'sys_clkcounter': bytearray(4)}
+		rng = np.random.RandomState(0)
+		for chip_num in range(nchips):
+			self.devices[adc16_layout.RAMS[chip_num]] = bytearray(rng.randint(0, 256, 1024).astype(np.uint8).tobytes())
+		self.requests = 0
+		self.server = None
+		#Writer and handler task of every open connection
+		self.connections = {}
+
+	async def start(self, host='127.0.0.1', port=0):
+		"""Start listening, returns the port."""
+		self.server = await asyncio.start_server(self._serve, host, port)
+		return self.server.sockets[0].getsockname()[1]
+
+	async def stop(self):
+		self.server.close()
+		for writer in list(self.connections.values()):
+			writer.close()
+		await asyncio.gather(*self.connections)
+		await self.server.wait_closed()
+
+	def _handle(self, name, args):
+		self.requests += 1
+		try:
+			if name == 'write':
+				device, offset, data = args[0].decode('ascii'), int(args[1]), args[2]
+				self.devices[device][offset:offset + len(data)] = data
+				return [format_message(b'!', 'write', 'ok')]
+			elif name == 'read':
+				device, offset, size = args[0].decode('ascii'), int(args[1]), int(args[2])
+				return [format_message(b'!', 'read', 'ok', bytes(self.devices[device][offset:offset + size]))]
+			elif name == 'listdev':
+				return [format_message(b'#', 'listdev', device) for device in sorted(self.devices)] + \
+					[format_message(b'!', 'listdev', 'ok', len(self.devices))]
+		except (KeyError, IndexError, ValueError) as e:
+			return [format_message(b'!', name, 'fail', repr(e))]
+		return [format_message(b'!', name, 'invalid', 'unknown request')]
+
+	async def _serve(self, reader, writer):
+		#Replies wait in a queue with the time they are due, so they leave in order
+		outgoing = asyncio.Queue()
+		async def send():
+			while True:
+				due, data = await outgoing.get()
+				if data is None:
+					break
+				delay = due - asyncio.get_running_loop().time()
+				if delay > 0:
+					await asyncio.sleep(delay)
+				writer.write(data)
+		sender = asyncio.ensure_future(send())
+		task = asyncio.current_task()
+		self.connections[task] = writer
+		writer.write(format_message(b'#', 'version-connect', 'katcp-protocol', '5.0-M'))
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				message = parse_message(line)
+				if message is None or message[0] != b'?':
+					continue
+				data = b''.join(self._handle(message[1], message[2]))
+				outgoing.put_nowait((asyncio.get_running_loop().time() + self.latency, data))
+		finally:
+			outgoing.put_nowait((0, None))
+			await sender
+			writer.close()
+			del self.connections[task]
+
+
+async def _benchmark(nboards, nchips, latency, repeat):
+	standins = [KatcpStandIn(nchips, latency) for n in range(nboards)]
+	ports = [await standin.start() for standin in standins]
+	chips = adc16_layout.CHIP_NAMES[:nchips]
+	serial = [await AsyncADC16.connect('127.0.0.1', port, chips=chips, pipeline=False) for port in ports]
+	pipelined = [await AsyncADC16.connect('127.0.0.1', port, chips=chips) for port in ports]
+	async def work(adc):
+		for n in range(repeat):
+			await adc.enable_pattern('deskew')
+			await adc.read_all_rams()
+	result = {}
+	#One board after the other, every request waits for its reply (like FpgaClient)
+	start = time.time()
+	for adc in serial:
+		await work(adc)
+	result['serial'] = time.time() - start
+	#One board after the other, requests pipelined
+	start = time.time()
+	for adc in pipelined:
+		await work(adc)
+	result['pipelined'] = time.time() - start
+	#All boards at once, requests pipelined
+	start = time.time()
+	await asyncio.gather(*(work(adc) for adc in pipelined))
+	result['gathered'] = time.time() - start
+	result['requests'] = sum(standin.requests for standin in standins) // 3
+	for adc in serial + pipelined:
+		await adc.close()
+	for standin in standins:
+		await standin.stop()
+	return result
+
+
+def benchmark(nboards=8, nchips=3, latency=0.001, repeat=2):
+	"""
+	Seconds to set a test pattern and capture every chip repeat times on
+	nboards stand-in boards with latency seconds of reply latency, done
+	serially without pipelining ('serial'), serially with pipelining
+	('pipelined') and on all boards at once ('gathered').
+	"""
+	return asyncio.run(_benchmark(nboards, nchips, latency, repeat))
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_async.py [OPTIONS], benchmark pipelined and concurrent KATCP access against local stand-in boards')
+	p.add_argument('-b', '--boards', dest = 'nboards', type = int, default = 8, help = 'Number of stand-in boards, default is 8')
+	p.add_argument('-c', '--chips', dest = 'nchips', type = int, default = 3, help = 'Number of chips per board, default is 3')
+	p.add_argument('-l', '--latency', dest = 'latency', type = float, default = 0.001, help = 'Reply latency of the stand-in boards in seconds, default is 0.001')
+	p.add_argument('-n', '--repeat', dest = 'repeat', type = int, default = 2, help = 'Pattern and capture cycles per board, default is 2')
+	args = p.parse_args()
+
+	result = benchmark(args.nboards, args.nchips, args.latency, args.repeat)
+	print('%d boards, %d requests per board, %.1f ms latency' % (args.nboards, result['requests'] // args.nboards, args.latency * 1e3))
+	for mode in ('serial', 'pipelined', 'gathered'):
+		print('%-10s %8.3f s  %6.1fx' % (mode, result[mode], result['serial'] / result[mode]))
@@ -0,0 +1,164 @@
+import time
+import logging
+import numpy as np
+
+import adc16_layout
+
+
+# Bit error rate (BER) test of the LVDS lanes of every chip.
+#
+# The chips send a constant test pattern (deskew, sync or a custom byte)
+# while snapshots are captured with ADC16.read_all_rams for as long as the
+# test runs.  Every captured byte is XORed with the expected pattern and the
+# set bits are counted per (chip, lane, bit position) with np.unpackbits, so
+# a marginal bit of one lane stands out from the rest.  Nothing loops over
+# samples in Python; a whole batch of captures is counted at once.
+#
+# Rates come with Wilson score confidence intervals, which stay meaningful
+# when no errors have been seen yet (the upper bound then falls as ~z^2/bits).
+
+#Expected byte of each pattern in the signed snapshot data
+PATTERNS = {'deskew': adc16_layout.DESKEW_EXPECTED, 'sync': adc16_layout.SYNC_EXPECTED}
+
+
+def pattern_expected(pattern, custom=None):
+	"""Expected snapshot byte of a test pattern, custom is the raw 8 bit custom pattern."""
+	if pattern == 'custom':
+		#The snapshot holds the ADC's offset binary code with the MSB flipped
+		return (custom ^ 0x80) & 0xff
+	return PATTERNS[pattern]
+
+
+def wilson_interval(errors, trials, z=1.96):
+	"""Wilson score interval (low, high) of errors/trials, elementwise."""
+	errors = np.asarray(errors, dtype=np.float64)
+	n = np.maximum(np.asarray(trials, dtype=np.float64), 1)
+	p = errors / n
+	denom = 1 + z ** 2 / n
+	centre = (p + z ** 2 / (2 * n)) / denom
+	half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denom
+	return np.maximum(centre - half, 0), np.minimum(centre + half, 1)
+
+
+class BitErrorCounter():
+
+	def __init__(self, nchips, expected, z=1.96):
+		self.expected = np.uint8(expected & 0xff)
+		self.z = z
+		#errors[chip, lane, bit], bit 0 is the LSB
+		self.errors = np.zeros((nchips, 8, 8), dtype=np.int64)
+		#Samples seen per lane, each carries one bit per bit position
+		self.samples = 0
+
+	def add(self, captures):
+		"""Count a (captures, chips, snapshot_len) or (chips, snapshot_len) batch."""
+		captures = np.asarray(captures)
+		if captures.ndim == 2:
+			captures = captures[np.newaxis]
+		diff = captures.view(np.uint8) ^ self.expected
+		#(captures, chips, frames, lane, 1) -> bits MSB first along the last axis
+		frames = diff.reshape(diff.shape[0], diff.shape[1], -1, adc16_layout.FRAME_SIZE, 1)
+		bits = np.unpackbits(frames, axis=-1)
+		self.errors += bits.sum(axis=(0, 2), dtype=np.int64)[..., ::-1]
+		self.samples += diff.shape[0] * frames.shape[2]
+
+	def bits(self):
+		"""Bits checked per lane so far."""
+		return self.samples * 8
+
+	def result(self):
+		"""
+		Returns a dict of
+		  lane_ber, lane_low, lane_high   (chips, 8 lanes) BER and interval
+		  bit_ber, bit_low, bit_high      (chips, 8 lanes, 8 bits) per bit position
+		  bits                            bits checked per lane
+		"""
+		lane_errors = self.errors.sum(axis=-1)
+		lane_bits = self.bits()
+		lane_low, lane_high = wilson_interval(lane_errors, lane_bits, self.z)
+		bit_low, bit_high = wilson_interval(self.errors, self.samples, self.z)
+		return {'lane_ber': lane_errors / float(max(lane_bits, 1)), 'lane_low': lane_low, 'lane_high': lane_high,
+			'bit_ber': self.errors / float(max(self.samples, 1)), 'bit_low': bit_low, 'bit_high': bit_high,
+			'bits': lane_bits}
+
+
+def log_result(counter, chips):
+	result = counter.result()
+	logging.info('{0} bits per lane checked'.format(result['bits']))
+	for row, chip in enumerate(chips):
+		for k, lane in enumerate(adc16_layout.LANES):
+			bad_bits = [b for b in range(8) if counter.errors[row, k, b]]
+			logging.info('chip {0} lane {1}: BER {2:.3g} [{3:.3g}, {4:.3g}]{5}'.format(chip, lane,
+				result['lane_ber'][row, k], result['lane_low'][row, k], result['lane_high'][row, k],
+				' errors in bits {0}'.format(bad_bits) if bad_bits else ''))
+
+
+def run_ber(adc, pattern='deskew', custom=None, num_captures=None, duration=None, batch=64, report_every=60.0):
+	"""
+	Stream a test pattern from all chips of a calibrated ADC16 instance and
+	count bit errors until num_captures captures were taken or duration
+	seconds passed.  Logs the running BER every report_every seconds and
+	returns the BitErrorCounter.
+	"""
+	chips = sorted(adc.chips, key=adc.chips.get)
+	if pattern == 'custom' and custom is None:
+		custom = int(adc.test_pattern, 2)
+	counter = BitErrorCounter(len(chips), pattern_expected(pattern, custom))
+	adc.set_demux_fpga(4)
+	adc.enable_pattern(pattern, custom)
+	captures = np.empty((batch, len(chips), 1024), dtype=np.int8)
+	start = last_report = time.time()
+	n = 0
+	try:
+		while (num_captures is None or n < num_captures) and (duration is None or time.time() - start < duration):
+			count = batch if num_captures is None else min(batch, num_captures - n)
+			for i in range(count):
+				captures[i] = adc.read_all_rams(chips)[0]
+			counter.add(captures[:count])
+			n += count
+			if time.time() - last_report >= report_every:
+				log_result(counter, chips)
+				last_report = time.time()
+	finally:
+		adc.clear_pattern()
+		adc.set_demux_fpga(adc.demux_mode)
+	log_result(counter, chips)
+	return counter
+
+
+def benchmark(ncaptures=256, nchips=3, seconds=2.0):
+	"""Bits per second BitErrorCounter checks on the host."""
+	raw = np.random.randint(-128, 128, size=(ncaptures, nchips, 1024)).astype(np.int8)
+	counter = BitErrorCounter(nchips, adc16_layout.DESKEW_EXPECTED)
+	start = time.time()
+	while True:
+		counter.add(raw)
+		elapsed = time.time() - start
+		if elapsed >= seconds:
+			break
+	return counter.bits() * 8 * nchips / elapsed
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_ber.py HOST [OPTIONS], long-run bit error rate test of every lane of a calibrated board')
+	p.add_argument('host', type = str, nargs = '?', default = None, help = 'specify the host name, leave out with --benchmark')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Demux mode 1/2/4 the board was calibrated with')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips to test. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
+	p.add_argument('-p', '--pattern', dest = 'test_pattern', type = str, default = 'deskew', help = 'deskew, sync, or a custom pattern bitstream (ex. -p 10110110)')
+	p.add_argument('-n', '--captures', dest = 'num_captures', type = int, default = None, help = 'Number of captures to check')
+	p.add_argument('-t', '--time', dest = 'duration', type = float, default = None, help = 'Number of seconds to run for')
+	p.add_argument('-r', '--report', dest = 'report_every', type = float, default = 60.0, help = 'Seconds between running BER reports')
+	p.add_argument('--benchmark', action = 'store_true', dest = 'benchmark', help = 'time the host-side bit counting instead of testing a board')
+	args = p.parse_args()
+	logging.basicConfig(level = logging.INFO)
+
+	if args.benchmark:
+		print('%.1f Mbit/s checked on the host' % (benchmark(nchips=len(args.chips)) / 1e6))
+	else:
+		if args.num_captures is None and args.duration is None:
+			p.error('specify the number of captures (-n) and/or the duration (-t)')
+		import adc16
+		pattern = args.test_pattern if args.test_pattern in PATTERNS else 'custom'
+		a = adc16.ADC16(**{'host':args.host, 'bof':'', 'skip_flag':True, 'verbosity':False, 'chips':args.chips, 'demux_mode':args.demux_mode, 'test_pattern':args.test_pattern, 'gain':1})
+		run_ber(a, pattern, None, args.num_captures, args.duration, report_every=args.report_every)
@@ -1,5 +1,10 @@
 
+import os
+import json
+import time
+import corr
 import adc16
+import adc16_replay
 
 
 if __name__ == '__main__':
@@ -8,13 +13,21 @@ if __name__ == '__main__':
 	p.add_argument('host', type = str, default = '', help = 'specify the host name')
 	p.add_argument('bof', type = str, default = '', help = 'specify the bof file to load unto FPGA')
 	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Set demux mode 1/2/4') #add the explanation of different demux modes
-	p.add_argument('-g', '--gain', dest = 'gain', type = int, default = 1, help = 'Possible gain values (choose one): { 1 1.25 2 2.5 4 5 8 10 12.5 16 20 25 32 50 }, default is 1')
+	p.add_argument('-g', '--gain', dest = 'gain', type = float, default = 1, help = 'Possible gain values (choose one): { 1 1.25 2 2.5 4 5 8 10 12.5 16 20 25 32 50 }, default is 1')
 	p.add_argument('-i','--iters', dest = 'num_iters', type = int, default=1, help = 'Enter the number of snaps per tap')
 	p.add_argument('-r', '--reg', nargs = '+', dest = 'registers', type = int, default = [], help = 'enter registers and their values in [REGISTER] [VALUE] format')
-	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips you wish to calibrate. Ex: -c a b . Default all chips:  a b c.')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips you wish to calibrate. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
 	p.add_argument('-s', '--skip', action = 'store_true', dest = 'skip_flag', help = 'specify this flag if you want to skip programming the bof file unto the FPGA')	
 	p.add_argument('-v', '--verbosity', action = 'store_true', dest = 'verbosity', help = 'increase output verbosity') #add the explanation of different demux modes
 	p.add_argument('-p', '--pattern', dest = 'test_pattern', type=str,default = 'deskew',help = 'input the test pattern to calibrate adc(ex. deskew:10101010, sync:11110000),for custom pattern just enter bitstream(ex.-p 10110110 or -p 0 etc.')
+	p.add_argument('--record', dest = 'record_file', type = str, default = None, help = 'record all KATCP requests and responses to this file for replay with adc16_replay.py')
+	p.add_argument('--spi-trace', dest = 'spi_trace', type = int, default = 0, help = 'keep the last N SPI register writes in memory and log them if calibration fails (on by default with -v)')
+	p.add_argument('--auto-gain', dest = 'auto_gain', type = float, default = None, help = 'after calibrating, range the gain of every input to this target RMS in LSB (e.g. 16)')
+	p.add_argument('--clock', action = 'store_true', dest = 'measure_clock', help = 'measure and print the board clock (from sys_clkcounter) before calibrating')
+	p.add_argument('--validate', action = 'store_true', dest = 'validate', help = 'check every lane with one snapshot of the ramp pattern after calibrating')
+	p.add_argument('--budget', dest = 'budget', type = float, default = None, help = 'calibrate within this many seconds, reusing known taps (see --taps) when a full sweep does not fit')
+	p.add_argument('--taps', dest = 'taps_file', type = str, default = None, help = 'start from the taps saved in this JSON file (if it exists) and save the calibrated taps to it')
+	p.add_argument('--trace', dest = 'trace_file', type = str, default = None, help = 'write a Chrome/Perfetto trace of the calibration phases to this file')
 	
 	args = p.parse_args()
 	demux_mode=args.demux_mode
@@ -27,14 +40,60 @@ if __name__ == '__main__':
 	verbosity = args.verbosity
 	chips = args.chips
 	test_pattern = args.test_pattern
+	trace_file = args.trace_file
+	record_file = args.record_file
+	spi_trace = args.spi_trace
+	auto_gain = args.auto_gain
+	measure_clock = args.measure_clock
+	validate = args.validate
+	budget = args.budget
+	taps_file = args.taps_file
 #define an ADC16 class object and pass it keyword arguments
 p
-a=adc16.ADC16(**{'host':host, 'bof':bof, 'skip_flag':skip_flag, 'verbosity':verbosity, 'chips':chips,'demux_mode':demux_mode,'test_pattern':test_pattern, 'gain':gain})
+settings = {'host':host, 'bof':bof, 'skip_flag':skip_flag, 'verbosity':verbosity, 'chips':chips,'demux_mode':demux_mode,'test_pattern':test_pattern, 'gain':gain, 'spi_trace':spi_trace}
+client = None
+if record_file:
+	client = adc16_replay.RecordingClient(corr.katcp_wrapper.FpgaClient(host, adc16.katcp_port, timeout=10), record_file, settings)
+	#ADC16 skips its connection wait when handed a client
+	time.sleep(1)
+a=adc16.ADC16(client=client, **settings)
 
 
 
+if trace_file:
+	a.enable_tracing()
+
 #calibrate the adc16 chips using test patterns
-a.calibrate()
+try:
+	if measure_clock:
+		print('Board clock: %.3f +- %.3f MHz' % a.measure_clock())
+	saved_taps = None
+	if taps_file and os.path.exists(taps_file):
+		with open(taps_file) as f:
+			saved_taps = json.load(f)
+		print('Loaded the taps of chips %s from %s' % (' '.join(a.load_taps(saved_taps)), taps_file))
+	if record_file:
+		#What replay needs to take the same path as this calibration
+		client.header['session'].update({'budget': budget, 'taps': saved_taps, 'clock': measure_clock,
+			'auto_gain': auto_gain, 'validate': validate})
+	report = a.calibrate(budget)
+	if record_file:
+		client.header['session']['plan'] = [report['path'], report['window']]
+	print('Calibration path: %s, margin %s taps, %.2f s' % (report['path'], 'unknown' if report['margin'] is None else report['margin'], report['seconds']))
+	if taps_file:
+		a.save_taps(taps_file)
+	if auto_gain:
+		a.auto_gain(target_rms=auto_gain)
+	if validate and not a.validate_ramp()['ok']:
+		print('Ramp validation failed, see the log for the lanes with errors')
+finally:
+	#calibrate exits on failures, save the trace of how far it got
+	if trace_file:
+		a.tracer.save(trace_file)
+		print('Calibration trace written to %s'%trace_file)
+	if record_file:
+		client.close()
+		print('KATCP recording written to %s'%record_file)
 
 	
 	
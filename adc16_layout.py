@@ -0,0 +1,210 @@
+import collections
+import numpy as np
+
+
+# Sample layout of the adc16_wb_ram{n} snapshot BRAMs.  This module only
+# depends on numpy so that offline analysis code can use it without corr or
+# a connection to a board.
+#
+# Each BRAM holds 8-byte frames.  Which byte of a frame belongs to which ADC
+# input depends on the demux mode the ADC and FPGA were set to (see
+# set_demux_adc and set_demux_fpga in adc16.py):
+#
+#   demux 1 (quad channel):   inputs 1,2,3,4   bytes [0,4] [1,5] [2,6] [3,7]
+#   demux 2 (dual channel):   inputs 1,3       bytes [0,4,1,5] [2,6,3,7]
+#   demux 4 (single channel): input 1          bytes [0,2,4,6,1,3,5,7]
+#
+# These are the same orderings plot_chans.py uses, expressed as index
+# tables so a whole batch of snapshots can be rearranged with one fancy
+# index instead of a Python loop over the frames.
+
+FRAME_SIZE = 8
+
+DEMUX_ORDER = {
+	1: [[0, 4], [1, 5], [2, 6], [3, 7]],
+	2: [[0, 4, 1, 5], [2, 6, 3, 7]],
+	4: [[0, 2, 4, 6, 1, 3, 5, 7]],
+}
+
+#ADC inputs present in the de-interleaved output of each demux mode
+DEMUX_INPUTS = {
+	1: (1, 2, 3, 4),
+	2: (1, 3),
+	4: (1,),
+}
+
+
+def deinterleave(data, demux_mode):
+	"""
+	Rearrange raw snapshot samples into per-input time series.
+
+	data can have any number of leading (batch, chip, ...) axes, the last axis
+	holds the raw BRAM samples and must be a multiple of 8 long.  Returns an
+	array of shape (..., inputs, samples_per_input).
+	"""
+	if demux_mode not in DEMUX_ORDER:
+		raise ValueError('Invalid demux mode %r, possible values are 1, 2 and 4' % (demux_mode,))
+	data = np.asarray(data)
+	nsamp = data.shape[-1]
+	if nsamp % FRAME_SIZE:
+		raise ValueError('Snapshot length %d is not a multiple of %d' % (nsamp, FRAME_SIZE))
+	order = np.array(DEMUX_ORDER[demux_mode])
+	ninputs = order.shape[0]
+	frames = data.reshape(data.shape[:-1] + (nsamp // FRAME_SIZE, FRAME_SIZE))
+	#(..., frames, inputs, bytes per input per frame)
+	out = frames[..., order]
+	out = out.swapaxes(-3, -2)
+	return out.reshape(data.shape[:-1] + (ninputs, nsamp // ninputs))
+
+
+# During calibration the FPGA is put in demux 4 mode and byte k of every frame
+# is treated as coming from LVDS lane LANES[k] of the chip (see walk_taps and
+# sync_chips in adc16.py).
+
+LANES = ('1a', '1b', '2a', '2b', '3a', '3b', '4a', '4b')
+
+#Test patterns as seen in the signed snapshot data
+DESKEW_EXPECTED = 0x2a		#10101010
+SYNC_EXPECTED = 0x70		#11110000
+
+
+def lane_errors(data, expected=DESKEW_EXPECTED):
+	"""
+	Number of samples per lane that differ from the expected test pattern.
+	data is a raw (..., snapshot_len) snapshot taken with the FPGA in demux 4
+	mode, the result has shape (..., 8) in LANES order.
+	"""
+	data = np.asarray(data)
+	frames = data.reshape(data.shape[:-1] + (-1, FRAME_SIZE))
+	return (frames != expected).sum(axis=-2)
+
+
+
+# The ramp test pattern counts through every ADC code, so one snapshot of it
+# exercises every bit and every byte boundary of all lanes at once.  Each
+# lane sees a ramp with a fixed step per sample (the same step for every
+# lane), which ramp_check finds from the sample differences.  A lane whose
+# deserializer word boundary is off by s bits (a missing bitslip) delivers
+# words made of the last 8-s bits of one sample and the first s bits of the
+# next, so ramp_check rebuilds every lane with its word boundary moved by
+# each of the 8 possible amounts across consecutive samples.  The shift that
+# turns the lane back into a ramp of the common step gives s.  Bits that
+# disagree with the fitted ramp afterwards are bit errors (bad delay taps,
+# marginal eye).  A lane that no shift turns into a ramp for most of the
+# samples is not receiving the pattern at all, its slip means nothing.
+
+#Fraction of sample steps that must follow the ramp for a lane to count as receiving it
+RAMP_MIN_MONOTONIC = 0.5
+
+def _modes(values, nbins=256):
+	"""Most common value and its count along the last axis of a non-negative int array."""
+	lead = values.shape[:-1]
+	rows = int(np.prod(lead))
+	idx = np.arange(rows)[:, np.newaxis] * nbins + values.reshape(rows, -1)
+	counts = np.bincount(idx.ravel(), minlength=rows * nbins).reshape(lead + (nbins,))
+	return counts.argmax(axis=-1), counts
+
+
+def ramp_check(data, step=None):
+	"""
+	Check a raw (..., snapshot_len) snapshot of the ramp pattern taken with
+	the FPGA in demux 4 mode.  step is the ramp step per lane sample, None
+	finds it as the most common step of all lanes.  Returns a dict of
+
+	  step        ramp step used
+	  ramp        (..., 8) True for lanes receiving the ramp (with some word
+	              boundary), slip and bit_errors only mean something there
+	  slip        (..., 8) bits each lane's word boundary is off in the serial
+	              stream, -4 to 3: 0 = word aligned, > 0 late, < 0 early
+	  monotonic   (..., 8) fraction of sample steps that match the ramp
+	  bit_errors  (..., 8 lanes, 8 bits) samples differing from the ramp per
+	              bit (bit 0 is the LSB), after moving the word boundary
+	  aligned     (..., 8) True for lanes that are word aligned without errors
+	"""
+	data = np.asarray(data)
+	#Back to the ADC's offset binary codes, (..., lanes, samples)
+	raw = (data.view(np.uint8) ^ 0x80).astype(np.int32)
+	lanes = raw.reshape(data.shape[:-1] + (-1, FRAME_SIZE)).swapaxes(-1, -2)
+	#Every word boundary shift of every lane, (shifts, ..., lanes, samples - 1): shift k takes
+	#the last 8-k bits of a sample and the first k bits of the next one (MSB first on the wire)
+	k = np.arange(8).reshape((8,) + (1,) * lanes.ndim)
+	shifted = ((lanes[..., :-1] << k) | (lanes[..., 1:] >> (8 - k))) & 0xff
+	nsamp = shifted.shape[-1]
+	steps, counts = _modes(np.diff(shifted, axis=-1) % 256)
+	if step is None:
+		step = int(np.bincount(steps[0].ravel(), minlength=256).argmax())
+	score = counts[..., step] / float(nsamp - 1)
+	#Ties go to the smallest shift
+	shift = score.argmax(axis=0)
+	monotonic = score.max(axis=0)
+	aligned_lanes = np.take_along_axis(shifted, shift[np.newaxis, ..., np.newaxis], axis=0)[0]
+	t = np.arange(nsamp)
+	offset = _modes((aligned_lanes - step * t) % 256)[0]
+	ideal = (offset[..., np.newaxis] + step * t) % 256
+	diff = (aligned_lanes ^ ideal).astype(np.uint8)
+	bit_errors = np.unpackbits(diff[..., np.newaxis], axis=-1).sum(axis=-2)[..., ::-1]
+	#Moving the word boundary k bits later fixes a lane whose boundary came 8-k bits late (k bits early)
+	slip = (4 - shift) % 8 - 4
+	ramp = monotonic >= RAMP_MIN_MONOTONIC
+	return {'step': step, 'ramp': ramp, 'slip': slip, 'monotonic': monotonic, 'bit_errors': bit_errors,
+		'aligned': ramp & (slip == 0) & (bit_errors.sum(axis=-1) == 0)}
+
+
+# Per-chip bit fields of the adc16_controller words (see the memory map at the
+# top of adc16.py).  Chip letters a-h are chip numbers 0-7, SNAP designs only
+# have a-c, ROACH2 designs all eight.  The masks are worked out once here so
+# code acting on several chips just ORs them together:
+#
+#   word 0  chip select of the SPI interface    bit n
+#   word 1  bitslip                             bit 8+n
+#   word 2  delay strobe of the 'a' lanes       bits 4n..4n+3 (lanes 1a,2a,3a,4a)
+#   word 3  delay strobe of the 'b' lanes       bits 4n..4n+3 (lanes 1b,2b,3b,4b)
+
+CHIP_NAMES = 'abcdefgh'
+CHIP_INDEX = dict((name, n) for n, name in enumerate(CHIP_NAMES))
+
+#Snapshot BRAM of each chip number
+RAMS = tuple('adc16_wb_ram%d' % n for n in range(len(CHIP_NAMES)))
+
+#Fields of CHIP_MASKS entries
+CHIP_SELECT, BITSLIP, STROBE = 0, 1, 2
+
+#(chip select, bitslip, delay strobe) masks of each chip number
+CHIP_MASKS = tuple((1 << n, 1 << (8 + n), 0xf << (4 * n)) for n in range(len(CHIP_NAMES)))
+
+#(strobe bit of the lane in every chip's nibble, controller word) of each lane in LANES order
+LANE_STROBE = tuple((0x11111111 << (k // 2), 2 + k % 2) for k in range(len(LANES)))
+
+
+def chip_mask(chip_nums, field):
+	"""OR of one field of CHIP_MASKS over a chip number or a list of them."""
+	if isinstance(chip_nums, (int, np.integer)):
+		chip_nums = [chip_nums]
+	mask = 0
+	for n in chip_nums:
+		mask |= CHIP_MASKS[n][field]
+	return mask
+
+
+# Word 0 of adc16_controller holds the status bits next to the 3-wire (SPI)
+# interface, see the memory map in adc16.py:
+#
+#   bits 24-25  LL    clock locked bits, any set means locked
+#   bits 20-23  NNNN  number of ADC chips the design supports
+#   bits 16-17  RR    ROACH2 revision the design expects
+#   bit  9      C     SCLK
+#   bit  8      D     SDATA
+#   bits 0-7          chip selects
+#
+# NNNN and RR are fixed when the design is compiled.
+
+ControllerStatus = collections.namedtuple('ControllerStatus',
+	['word', 'lock_bits', 'locked', 'num_chips', 'revision', 'sclk', 'sdata', 'chip_select', 'time'])
+
+
+def decode_status(word, timestamp=None):
+	"""ControllerStatus of a controller word 0 value (read_int's signed result is fine)."""
+	word &= 0xffffffff
+	return ControllerStatus(word=word, lock_bits=(word >> 24) & 3, locked=bool((word >> 24) & 3),
+		num_chips=(word >> 20) & 0xf, revision=(word >> 16) & 3, sclk=(word >> 9) & 1, sdata=(word >> 8) & 1,
+		chip_select=word & 0xff, time=timestamp)
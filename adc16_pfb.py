@@ -0,0 +1,128 @@
+import time
+import numpy as np
+
+import adc16_layout
+
+
+# Polyphase filterbank (PFB) channelizer for captured ADC data.
+#
+# A plain FFT of a single snapshot (what fft.py does) has a sinc shaped
+# channel response, so strong signals leak into many neighbouring channels
+# and tones between bin centres lose up to ~4 dB (scalloping).  A PFB puts a
+# windowed-sinc FIR in front of the FFT which gives each channel a flat
+# top and steep skirts, the same structure as the CASPER pfb_fir + fft
+# blocks in the FPGA.
+#
+# Like the CASPER blocks the FFT is real-input and 2*nchan points long, and
+# only the first nchan channels are kept (DC up to, but not including,
+# Nyquist).  Each spectrum consumes 2*nchan new samples and needs
+# ntaps*2*nchan samples of history, so a snapshot of N samples per input
+# yields N//(2*nchan) - ntaps + 1 spectra.  Snapshots are not contiguous in
+# time, so spectra never span two snapshots.
+#
+# All methods accept arrays with any number of leading axes, e.g. the
+# (snapshots, chips, inputs, samples) output of adc16_layout.deinterleave,
+# and process them in one vectorized pass.
+
+
+def pfb_coeffs(nchan, ntaps, window='hamming'):
+	"""Windowed-sinc FIR coefficients, shaped (ntaps, 2*nchan)."""
+	fft_len = 2 * nchan
+	x = np.arange(ntaps * fft_len, dtype=np.float64)
+	coeffs = np.sinc(x / fft_len - ntaps / 2.0)
+	coeffs *= getattr(np, window)(ntaps * fft_len)
+	return coeffs.reshape(ntaps, fft_len)
+
+
+class PolyphaseFilterbank():
+
+	def __init__(self, nchan=32, ntaps=4, window='hamming'):
+		self.nchan = nchan
+		self.ntaps = ntaps
+		self.fft_len = 2 * nchan
+		self.coeffs = pfb_coeffs(nchan, ntaps, window)
+
+	def num_spectra(self, nsamp):
+		return nsamp // self.fft_len - self.ntaps + 1
+
+	def fir(self, data):
+		"""
+		Run the polyphase FIR front end.  Returns real (..., spectra, 2*nchan)
+		blocks ready for the FFT.
+		"""
+		data = np.asarray(data)
+		nsamp = data.shape[-1]
+		nspec = self.num_spectra(nsamp)
+		if nspec < 1:
+			raise ValueError('Need at least %d samples per input for %d taps of %d channels, got %d'
+				% (self.ntaps * self.fft_len, self.ntaps, self.nchan, nsamp))
+		nblocks = nsamp // self.fft_len
+		blocks = data[..., :nblocks * self.fft_len].reshape(data.shape[:-1] + (nblocks, self.fft_len))
+		#One multiply-accumulate over the whole batch per tap, the tap loop is
+		#the only Python level loop
+		out = blocks[..., 0:nspec, :] * self.coeffs[0]
+		for t in range(1, self.ntaps):
+			out += blocks[..., t:t + nspec, :] * self.coeffs[t]
+		return out
+
+	def channelize(self, data):
+		"""Complex channel voltages, shaped (..., spectra, nchan)."""
+		return np.fft.rfft(self.fir(data), axis=-1)[..., :self.nchan]
+
+	def power(self, data, axis=None):
+		"""
+		Power spectrum averaged over all spectra of each input, shaped
+		(..., nchan).  If axis is given the result is also averaged over that
+		leading axis (e.g. axis=0 to integrate over snapshots).
+		"""
+		spectra = self.channelize(data)
+		power = (spectra.real ** 2 + spectra.imag ** 2).mean(axis=-2)
+		if axis is not None:
+			power = power.mean(axis=axis)
+		return power
+
+
+def snapshot_power(snapshots, demux_mode, nchan=32, ntaps=4, window='hamming'):
+	"""
+	Integrated power spectra of a batch of raw snapshots.  snapshots has
+	shape (..., snapshot_len) (e.g. (snapshots, chips, 1024)), the result is
+	(..., inputs, nchan) averaged over the leading snapshot axis.
+	"""
+	pfb = PolyphaseFilterbank(nchan, ntaps, window)
+	data = adc16_layout.deinterleave(snapshots, demux_mode).astype(np.float32)
+	return pfb.power(data, axis=0)
+
+
+def benchmark(nchan=32, ntaps=4, nsnap=256, snapshot_len=1024, demux_mode=4, seconds=2.0):
+	"""
+	Time the channelizer on random int8 snapshots and return the number of
+	ADC samples processed per second.  numpy runs the FIR and FFT on a
+	single thread so this is a per core figure.
+	"""
+	pfb = PolyphaseFilterbank(nchan, ntaps)
+	raw = np.random.randint(-128, 128, size=(nsnap, snapshot_len)).astype(np.int8)
+	nsamples = 0
+	start = time.time()
+	while True:
+		data = adc16_layout.deinterleave(raw, demux_mode).astype(np.float32)
+		pfb.power(data, axis=0)
+		nsamples += raw.size
+		elapsed = time.time() - start
+		if elapsed >= seconds:
+			break
+	return nsamples / elapsed
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_pfb.py [OPTIONS], benchmark the polyphase filterbank channelizer')
+	p.add_argument('-n', '--nchan', dest = 'nchan', type = int, default = 32, help = 'Number of output channels, default is 32')
+	p.add_argument('-t', '--taps', dest = 'ntaps', type = int, default = 4, help = 'Number of PFB taps, default is 4')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 4, help = 'Demux mode 1/2/4 the snapshots are de-interleaved with, default is 4')
+	p.add_argument('-b', '--batch', dest = 'nsnap', type = int, default = 256, help = 'Number of 1024 sample snapshots processed per call, default is 256')
+	p.add_argument('-T', '--time', dest = 'seconds', type = float, default = 2.0, help = 'Benchmark duration in seconds')
+	args = p.parse_args()
+
+	rate = benchmark(args.nchan, args.ntaps, args.nsnap, 1024, args.demux_mode, args.seconds)
+	print('PFB %d channels, %d taps, demux %d, %d snapshots per call: %.1f Msamples/s per core'
+		% (args.nchan, args.ntaps, args.demux_mode, args.nsnap, rate / 1e6))
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+try:
+	import Queue as queue
+except ImportError:
+	import queue
+
+
+# Records snapshots from the selected chips to an on-disk dataset that can be
+# opened zero-copy with np.memmap.
+#
+# A dataset called NAME is made of three files:
+#
+#   NAME.dat   int8 samples, one record of snapshot_len bytes per chip per
+#              capture, row-major (records, snapshot_len)
+#   NAME.idx   one INDEX_DTYPE entry per record (see below)
+#   NAME.json  header: layout version, snapshot length, index dtype and the
+#              number of valid records
+#
+# Both .dat and .idx are preallocated and grown chunk records at a time, so
+# the files may be longer than the valid data; readers must only look at the
+# first 'count' records from the header (open_dataset does this).  The header
+# is rewritten (atomically) every time the files grow and on close.
+#
+# Captures are handed to a background writer thread through a bounded queue
+# so the capture loop only pays for the KATCP reads.  The queue applies back
+# pressure if the disk cannot keep up.
+
+LAYOUT_VERSION = 1
+
+INDEX_DTYPE = np.dtype([
+	('timestamp', '<f8'),	#trigger time of the capture (time.time())
+	('capture', '<u4'),	#capture number, shared by all chips of one trigger
+	('chip', 'u1'),		#chip number (0 = a, 1 = b ...)
+	('demux_mode', 'u1'),
+	('gain', '<f4'),
+])
+
+
+def _write_header(path, header):
+	tmp = path + '.json.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(header, f)
+	os.rename(tmp, path + '.json')
+
+
+def open_dataset(path):
+	"""
+	Open a recorded dataset read-only.  Returns (data, index) memmaps, data
+	is (records, snapshot_len) int8 and index is an INDEX_DTYPE array.
+	"""
+	with open(path + '.json') as f:
+		header = json.load(f)
+	if header['version'] != LAYOUT_VERSION:
+		raise ValueError('Unsupported dataset layout version %r' % (header['version'],))
+	count = header['count']
+	if count == 0:
+		return (np.zeros((0, header['snapshot_len']), dtype=np.int8), np.zeros(0, dtype=INDEX_DTYPE))
+	data = np.memmap(path + '.dat', dtype=np.int8, mode='r', shape=(count, header['snapshot_len']))
+	index = np.memmap(path + '.idx', dtype=INDEX_DTYPE, mode='r', shape=(count,))
+	return data, index
+
+
+def dataset_layout(index):
+	"""(number of captures, chip numbers, demux mode) of a dataset, from its open_dataset index."""
+	if not len(index):
+		return 0, [], None
+	#Records are capture major, every capture has a record per chip
+	chip_nums = index['chip'][index['capture'] == index['capture'][0]].tolist()
+	return len(index) // len(chip_nums), chip_nums, int(index['demux_mode'][0])
+
+
+class CaptureRecorder():
+
+	def __init__(self, path, snapshot_len=1024, chunk=4096, queue_size=1024):
+		self.path = path
+		self.snapshot_len = snapshot_len
+		self.chunk = chunk
+		self.count = 0
+		self.captures = 0
+		self.capacity = 0
+		self.data = None
+		self.index = None
+		self._grow()
+		self._queue = queue.Queue(maxsize=queue_size)
+		self._error = None
+		self._start_time = time.time()
+		self._writer = threading.Thread(target=self._write_loop)
+		self._writer.daemon = True
+		self._writer.start()
+
+	def _header(self):
+		return {'version': LAYOUT_VERSION, 'snapshot_len': self.snapshot_len,
+			'index_dtype': INDEX_DTYPE.descr, 'count': self.count}
+
+	#Extends both files by one chunk of records and remaps them
+	def _grow(self):
+		if self.data is not None:
+			self.data.flush()
+			self.index.flush()
+		self.data = None
+		self.index = None
+		mode = 'r+b' if self.capacity else 'wb'
+		self.capacity += self.chunk
+		for ext, itemsize in (('.dat', self.snapshot_len), ('.idx', INDEX_DTYPE.itemsize)):
+			with open(self.path + ext, mode) as f:
+				f.truncate(self.capacity * itemsize)
+		self.data = np.memmap(self.path + '.dat', dtype=np.int8, mode='r+', shape=(self.capacity, self.snapshot_len))
+		self.index = np.memmap(self.path + '.idx', dtype=INDEX_DTYPE, mode='r+', shape=(self.capacity,))
+		_write_header(self.path, self._header())
+
+	def _write_loop(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			if self._error is not None:
+				#Keep draining after a failure so producers blocked on a full queue (and close) are not stuck
+				continue
+			data, trig_time, chip_nums, demux_mode, gain = item
+			try:
+				while self.count + len(data) > self.capacity:
+					self._grow()
+				rows = slice(self.count, self.count + len(data))
+				self.data[rows] = data
+				entries = self.index[rows]
+				entries['timestamp'] = trig_time
+				entries['capture'] = self.captures
+				entries['chip'] = chip_nums
+				entries['demux_mode'] = demux_mode
+				entries['gain'] = gain
+				self.count += len(data)
+				self.captures += 1
+			except Exception as e:
+				logging.error('Capture recorder write failed: {0}'.format(e))
+				self._error = e
+
+	def append(self, data, trig_time, chip_nums, demux_mode, gain):
+		"""
+		Queue one capture, data is the (chips, snapshot_len) array returned
+		by ADC16.read_all_rams and chip_nums the chip number of each row.
+		"""
+		if self._error is not None:
+			raise self._error
+		self._queue.put((np.array(data, dtype=np.int8, copy=True), trig_time, chip_nums, demux_mode, gain))
+
+	def close(self):
+		"""
+		Drain the queue, trim the files to the recorded data and write the
+		final header.  If a write failed the header is written for the
+		records stored before the failure (count only moves once a capture
+		is fully written), the files are left untrimmed and the write error
+		is raised.
+		"""
+		self._queue.put(None)
+		self._writer.join()
+		self.elapsed = time.time() - self._start_time
+		if self._error is not None:
+			if self.data is not None:
+				self.data.flush()
+				self.index.flush()
+			self.data = None
+			self.index = None
+			_write_header(self.path, self._header())
+			raise self._error
+		self.data.flush()
+		self.index.flush()
+		self.data = None
+		self.index = None
+		for ext, itemsize in (('.dat', self.snapshot_len), ('.idx', INDEX_DTYPE.itemsize)):
+			with open(self.path + ext, 'r+b') as f:
+				f.truncate(self.count * itemsize)
+		_write_header(self.path, self._header())
+
+	def report(self):
+		"""Sustained captures/s and disk throughput in MB/s of a closed recording."""
+		nbytes = self.count * (self.snapshot_len + INDEX_DTYPE.itemsize)
+		return {'captures': self.captures, 'records': self.count, 'seconds': self.elapsed,
+			'captures_per_sec': self.captures / self.elapsed, 'mbytes_per_sec': nbytes / self.elapsed / 1e6}
+
+
+def record(adc, recorder, num_captures=None, duration=None):
+	"""
+	Capture the chips of an ADC16 instance with read_all_rams until
+	num_captures captures have been taken or duration seconds have passed.
+	"""
+	chips = sorted(adc.chips, key=adc.chips.get)
+	chip_nums = [adc.chips[chip] for chip in chips]
+	start = time.time()
+	n = 0
+	while (num_captures is None or n < num_captures) and (duration is None or time.time() - start < duration):
+		data, trig_time = adc.read_all_rams(chips)
+		recorder.append(data, trig_time, chip_nums, adc.demux_mode, adc.gain)
+		n += 1
+	return n
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	import adc16
+	p = ArgumentParser(description = 'python adc16_recorder.py HOST BOF_FILE OUTPUT [OPTIONS], record snapshots of a calibrated board')
+	p.add_argument('host', type = str, default = '', help = 'specify the host name')
+	p.add_argument('bof', type = str, default = '', help = 'specify the bof file to load unto FPGA')
+	p.add_argument('output', type = str, help = 'dataset name, writes OUTPUT.dat, OUTPUT.idx and OUTPUT.json')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Demux mode 1/2/4 the board was calibrated with')
+	p.add_argument('-g', '--gain', dest = 'gain', type = float, default = 1, help = 'Gain the board was calibrated with, stored in the index')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips you wish to record. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
+	p.add_argument('-n', '--captures', dest = 'num_captures', type = int, default = None, help = 'Number of captures to record')
+	p.add_argument('-t', '--time', dest = 'duration', type = float, default = None, help = 'Number of seconds to record for')
+	p.add_argument('--chunk', dest = 'chunk', type = int, default = 4096, help = 'Number of records the files grow by at a time')
+	p.add_argument('-v', '--verbosity', action = 'store_true', dest = 'verbosity', help = 'increase output verbosity')
+	args = p.parse_args()
+	if args.num_captures is None and args.duration is None:
+		p.error('specify the number of captures (-n) and/or the duration (-t)')
+
+	a = adc16.ADC16(**{'host':args.host, 'bof':args.bof, 'skip_flag':True, 'verbosity':args.verbosity, 'chips':args.chips, 'demux_mode':args.demux_mode, 'test_pattern':'deskew', 'gain':args.gain})
+	recorder = CaptureRecorder(args.output, chunk=args.chunk)
+	try:
+		record(a, recorder, args.num_captures, args.duration)
+	finally:
+		recorder.close()
+	report = recorder.report()
+	print('Recorded {captures} captures ({records} snapshots) in {seconds:.1f} s: {captures_per_sec:.1f} captures/s, {mbytes_per_sec:.2f} MB/s'.format(**report))
@@ -0,0 +1,168 @@
+import json
+import time
+import base64
+
+
+# Record and replay of the KATCP traffic between ADC16 and its FpgaClient.
+#
+# RecordingClient sits between ADC16 and a real FpgaClient and writes every
+# call (method, arguments, result and how long the board took to answer) to
+# a trace file, one JSON object per line.  The first line is a header with
+# the ADC16 settings the recording was made with and a 'session' dict of
+# what the recording tool did with them beyond a plain calibrate (e.g. the
+# time budget, the taps it started from, the tap search path taken and the
+# steps run around the calibration: clock measurement, auto gain and ramp
+# validation), which is written again when the recording is closed.
+#
+# ReplayClient reads a trace back and answers ADC16's calls from it with no
+# network or sleeps, checking that every call matches the recorded one.  Any
+# change to the calibration code that issues different requests than the
+# recording shows up as a ReplayMismatch at the first differing call.
+#
+# Binary results (snapshot reads) are stored base64 encoded.
+
+TRACE_VERSION = 1
+
+#Methods that return raw bytes
+BINARY_RESULTS = ('read',)
+
+
+class ReplayMismatch(Exception):
+	pass
+
+
+def _jsonable(obj):
+	#numpy integers from register arithmetic
+	return int(obj)
+
+
+class RecordingClient():
+
+	def __init__(self, client, path, settings=None):
+		self._client = client
+		self._path = path
+		self._file = open(path, 'w')
+		self._start = time.time()
+		self.header = {'version': TRACE_VERSION, 'created': self._start, 'settings': settings or {}, 'session': {}}
+		self._file.write(json.dumps(self.header) + '\n')
+
+	def __getattr__(self, name):
+		attr = getattr(self._client, name)
+		if not callable(attr):
+			return attr
+		def recorded(*args, **kwargs):
+			entry = {'method': name, 'args': args, 'kwargs': kwargs, 't': time.time() - self._start}
+			try:
+				result = attr(*args, **kwargs)
+			except Exception as e:
+				entry['dt'] = time.time() - self._start - entry['t']
+				entry['error'] = '{0}: {1}'.format(type(e).__name__, e)
+				self._file.write(json.dumps(entry, default=_jsonable) + '\n')
+				raise
+			entry['dt'] = time.time() - self._start - entry['t']
+			if name in BINARY_RESULTS:
+				entry['result'] = base64.b64encode(result).decode('ascii')
+			else:
+				entry['result'] = result
+			self._file.write(json.dumps(entry, default=_jsonable) + '\n')
+			return result
+		return recorded
+
+	def close(self):
+		"""Close the trace and write the header again with the final session."""
+		self._file.close()
+		with open(self._path) as f:
+			lines = f.readlines()
+		lines[0] = json.dumps(self.header, default=_jsonable) + '\n'
+		with open(self._path, 'w') as f:
+			f.writelines(lines)
+
+
+def load_trace(path):
+	"""Returns the header and the list of recorded calls of a trace file."""
+	with open(path) as f:
+		header = json.loads(f.readline())
+		if header['version'] != TRACE_VERSION:
+			raise ValueError('Unsupported trace version %r' % (header['version'],))
+		calls = [json.loads(line) for line in f if line.strip()]
+	for call in calls:
+		if call['method'] in BINARY_RESULTS and 'result' in call:
+			call['result'] = base64.b64decode(call['result'])
+	return header, calls
+
+
+class ReplayClient():
+
+	def __init__(self, path):
+		self.header, self.calls = load_trace(path)
+		self.settings = self.header['settings']
+		self.position = 0
+
+	def __getattr__(self, name):
+		if name.startswith('_'):
+			raise AttributeError(name)
+		def replayed(*args, **kwargs):
+			if self.position >= len(self.calls):
+				raise ReplayMismatch('Call {0} {1}{2} past the end of the recording'.format(self.position, name, args))
+			call = self.calls[self.position]
+			if call['method'] != name or call['args'] != list(args) or call['kwargs'] != kwargs:
+				raise ReplayMismatch('Call {0} is {1}{2} {3}, recording has {4}{5} {6}'.format(self.position,
+					name, tuple(args), kwargs, call['method'], tuple(call['args']), call['kwargs']))
+			self.position += 1
+			if 'error' in call:
+				raise RuntimeError('Recorded error: ' + call['error'])
+			return call['result']
+		return replayed
+
+	def finished(self):
+		return self.position == len(self.calls)
+
+	def recorded_time(self):
+		"""Seconds the board spent answering the calls replayed so far."""
+		return sum(call['dt'] for call in self.calls[:self.position])
+
+
+def replay_calibration(path, repeat=1):
+	"""
+	Run ADC16.calibrate against a recording repeat times, with the budget,
+	starting taps and tap search path of the recorded session, and the
+	clock measurement, auto gain and ramp validation steps if the session
+	ran them.  Returns the number of calls replayed, the seconds they took
+	on the board and the best host-side seconds per calibration.
+	"""
+	import adc16
+	best = None
+	for i in range(repeat):
+		client = ReplayClient(path)
+		session = client.header.get('session', {})
+		settings = dict(client.settings)
+		settings.update({'client': client, 'pattern_settle': 0})
+		start = time.time()
+		a = adc16.ADC16(**settings)
+		if session.get('clock'):
+			a.measure_clock(interval=0)
+		if session.get('taps'):
+			a.load_taps(session['taps'])
+		plan = session.get('plan')
+		a.calibrate(session.get('budget'), plan and tuple(plan))
+		if session.get('auto_gain'):
+			a.auto_gain(target_rms=session['auto_gain'])
+		if session.get('validate'):
+			a.validate_ramp()
+		elapsed = time.time() - start
+		if not client.finished():
+			raise ReplayMismatch('Calibration finished after {0} of {1} recorded calls'.format(client.position, len(client.calls)))
+		best = elapsed if best is None else min(best, elapsed)
+	return client.position, client.recorded_time(), best
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_replay.py TRACE [OPTIONS], replay a calibration recorded with adc16_init.py --record')
+	p.add_argument('trace', type = str, help = 'trace file written by adc16_init.py --record')
+	p.add_argument('-n', '--repeat', dest = 'repeat', type = int, default = 1, help = 'number of times to replay the calibration, the best time is reported')
+	args = p.parse_args()
+
+	ncalls, board_time, host_time = replay_calibration(args.trace, args.repeat)
+	print('Replayed %i KATCP calls: %.2f s on the board, %.4f s host-side (%.1f us per call)'
+		% (ncalls, board_time, host_time, 1e6 * host_time / max(ncalls, 1)))
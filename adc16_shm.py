@@ -0,0 +1,305 @@
+import time
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+
+# Fan-out of one capture stream to several consumer processes (plotter,
+# spectrometer, recorder ...) through a ring of snapshot slots in shared
+# memory.  Python 3.8+ only.
+#
+# One capture process owns the board connection and publishes every
+# read_all_rams capture into the ring (CaptureRing), so the board sees one
+# stream of KATCP reads however many consumers there are, and all consumers
+# see the same data.  Consumers attach by name (RingReader) and get numpy
+# views straight into the shared block, no copies.
+#
+# The block holds a header, one (seq, timestamp) entry per slot and the slot
+# data, (slots, chips, snapshot_len) int8.  Capture number n goes to slot
+# n % slots.  The writer sets the slot's seq to -1 while it fills the slot
+# and to n once the slot is complete, then bumps the header's seq (the number
+# of captures published).  A reader knows a view of capture n is still intact
+# while the slot's seq is n, which RingReader.valid checks; a reader that
+# falls more than a ring behind skips ahead and counts the captures it lost.
+
+MAGIC = 0x41443136		#'AD16'
+LAYOUT_VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+	('magic', '<u4'),
+	('version', '<u4'),
+	('nslots', '<u4'),
+	('nchips', '<u4'),
+	('snapshot_len', '<u4'),
+	('demux_mode', '<u4'),
+	('closed', '<u4'),	#set by the writer when it stops
+	('chip_nums', 'u1', (8,)),
+	('seq', '<i8'),		#number of captures published
+])
+
+SLOT_DTYPE = np.dtype([
+	('seq', '<i8'),		#capture number held by the slot, -1 while it is written
+	('timestamp', '<f8'),	#trigger time of the capture
+])
+
+#Keep the slot data cache line aligned
+_ALIGN = 64
+
+
+def _layout(nslots, nchips, snapshot_len):
+	"""Byte offsets of the slot table and slot data, and the total size."""
+	slots_offset = -(-HEADER_DTYPE.itemsize // _ALIGN) * _ALIGN
+	data_offset = -(-(slots_offset + nslots * SLOT_DTYPE.itemsize) // _ALIGN) * _ALIGN
+	return slots_offset, data_offset, data_offset + nslots * nchips * snapshot_len
+
+
+def _attach(name):
+	#Readers must not unlink the block when they exit, only the writer owns it.  Before Python 3.13
+	#attaching always registers the block with the resource tracker, so keep it from registering.
+	try:
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError:
+		from multiprocessing import resource_tracker
+		register = resource_tracker.register
+		resource_tracker.register = lambda name, rtype: None
+		try:
+			return shared_memory.SharedMemory(name=name)
+		finally:
+			resource_tracker.register = register
+
+
+class Overrun(Exception):
+	pass
+
+
+class _Ring():
+
+	def _map(self, shm):
+		self.shm = shm
+		self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+		if self.header['magic'] != MAGIC or self.header['version'] != LAYOUT_VERSION:
+			raise ValueError('%s is not a version %d capture ring' % (shm.name, LAYOUT_VERSION))
+		self.nslots = int(self.header['nslots'])
+		self.nchips = int(self.header['nchips'])
+		self.snapshot_len = int(self.header['snapshot_len'])
+		slots_offset, data_offset, size = _layout(self.nslots, self.nchips, self.snapshot_len)
+		self.slots = np.ndarray((self.nslots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=slots_offset)
+		self.data = np.ndarray((self.nslots, self.nchips, self.snapshot_len), dtype=np.int8, buffer=shm.buf, offset=data_offset)
+
+	@property
+	def name(self):
+		return self.shm.name
+
+	@property
+	def chip_nums(self):
+		return self.header['chip_nums'][:self.nchips].tolist()
+
+	@property
+	def demux_mode(self):
+		return int(self.header['demux_mode'])
+
+	def published(self):
+		"""Number of captures published so far."""
+		return int(self.header['seq'])
+
+	def _release(self):
+		#Views into the block have to go before it can be closed
+		self.header = self.slots = self.data = None
+		self.shm.close()
+
+
+class CaptureRing(_Ring):
+
+	def __init__(self, name, chip_nums, demux_mode, nslots=64, snapshot_len=1024):
+		"""Create the ring (name None picks a free name), owned by the capture process."""
+		nchips = len(chip_nums)
+		size = _layout(nslots, nchips, snapshot_len)[2]
+		shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+		header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+		header[()] = (MAGIC, LAYOUT_VERSION, nslots, nchips, snapshot_len, demux_mode, 0, list(chip_nums) + [0] * (8 - nchips), 0)
+		del header
+		self._map(shm)
+		self.slots['seq'] = -1
+
+	def publish(self, data, trig_time):
+		"""Write one (chips, snapshot_len) capture to the next slot, returns its capture number."""
+		n = int(self.header['seq'])
+		slot = n % self.nslots
+		self.slots['seq'][slot] = -1
+		self.data[slot] = data
+		self.slots['timestamp'][slot] = trig_time
+		self.slots['seq'][slot] = n
+		self.header['seq'] = n + 1
+		return n
+
+	def close(self):
+		"""Tell the readers no more captures are coming and remove the block."""
+		self.header['closed'] = 1
+		self._release()
+		self.shm.unlink()
+
+
+class RingReader(_Ring):
+
+	def __init__(self, name, start='latest'):
+		"""
+		Attach to a CaptureRing.  start is 'latest' to begin with the next
+		capture published or 'oldest' for the oldest capture still in the ring.
+		"""
+		self._map(_attach(name))
+		published = self.published()
+		self.position = published if start == 'latest' else max(published - self.nslots, 0)
+		#Captures skipped because this reader fell more than a ring behind
+		self.lost = 0
+
+	def valid(self, seq):
+		"""True while the slot of capture seq still holds it (a view of it is intact)."""
+		return int(self.slots['seq'][seq % self.nslots]) == seq
+
+	def view(self, seq):
+		"""Zero-copy (chips, snapshot_len) view of capture seq and its trigger time, check valid(seq) after use."""
+		slot = seq % self.nslots
+		timestamp = float(self.slots['timestamp'][slot])
+		if not self.valid(seq):
+			raise Overrun('Capture %d is no longer in the ring' % seq)
+		return self.data[slot], timestamp
+
+	def read(self, seq):
+		"""Copy of capture seq and its trigger time, raises Overrun if the writer got to it first."""
+		data, timestamp = self.view(seq)
+		data = data.copy()
+		if not self.valid(seq):
+			raise Overrun('Capture %d was overwritten while it was read' % seq)
+		return data, timestamp
+
+	def next(self, timeout=None, poll=0.0005):
+		"""
+		Wait for the next capture and return (seq, view, timestamp), or None
+		on timeout or when the writer closed the ring.  The view is zero-copy:
+		check valid(seq) once done with it if the reader may be slow.
+		"""
+		deadline = None if timeout is None else time.time() + timeout
+		while True:
+			published = self.published()
+			if published - self.position > self.nslots - 1:
+				#Too far behind, the oldest slot is being rewritten
+				skip = published - self.nslots + 1
+				self.lost += skip - self.position
+				self.position = skip
+			if self.position < published:
+				seq = self.position
+				try:
+					data, timestamp = self.view(seq)
+				except Overrun:
+					continue
+				self.position += 1
+				return seq, data, timestamp
+			if self.header['closed'] or (deadline is not None and time.time() >= deadline):
+				return None
+			time.sleep(poll)
+
+	def close(self):
+		self._release()
+
+
+def capture(read_all_rams, ring, num_captures=None, duration=None):
+	"""
+	Publish captures from read_all_rams (ADC16.read_all_rams or anything
+	returning (data, trigger time) like it) into ring until num_captures
+	captures or duration seconds.  Returns the number of captures.
+	"""
+	start = time.time()
+	n = 0
+	while (num_captures is None or n < num_captures) and (duration is None or time.time() - start < duration):
+		data, trig_time = read_all_rams()
+		ring.publish(data, trig_time)
+		n += 1
+	return n
+
+
+def _benchmark_reader(name, results, index):
+	reader = RingReader(name, start='oldest')
+	count = 0
+	checksum = 0
+	while True:
+		item = reader.next(timeout=5)
+		if item is None:
+			break
+		seq, data, timestamp = item
+		#Touch the data like a real consumer would
+		checksum += int(data[:, 0].sum())
+		if reader.valid(seq):
+			count += 1
+		else:
+			reader.lost += 1
+	results[index] = (count, reader.lost)
+	reader.close()
+
+
+def benchmark(nreaders=3, nchips=3, nslots=64, seconds=2.0, rate=1000.0):
+	"""
+	Publish random captures at rate captures/s (0 for as fast as possible)
+	for seconds with nreaders reader processes attached.  Returns the
+	captures/s published and the (captures seen, captures lost) of every
+	reader.
+	"""
+	raw = np.random.randint(-128, 128, size=(16, nchips, 1024)).astype(np.int8)
+	ring = CaptureRing(None, list(range(nchips)), 2, nslots)
+	results = multiprocessing.Manager().dict()
+	readers = [multiprocessing.Process(target=_benchmark_reader, args=(ring.name, results, i)) for i in range(nreaders)]
+	for reader in readers:
+		reader.start()
+	#Give the readers time to attach
+	time.sleep(0.5)
+	n = 0
+	start = time.time()
+	while time.time() - start < seconds:
+		ring.publish(raw[n % len(raw)], time.time())
+		n += 1
+		if rate:
+			delay = start + n / rate - time.time()
+			if delay > 0:
+				time.sleep(delay)
+	elapsed = time.time() - start
+	ring.header['closed'] = 1
+	for reader in readers:
+		reader.join()
+	ring.close()
+	return n / elapsed, [results[i] for i in range(nreaders)]
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_shm.py [HOST NAME] [OPTIONS], publish captures of a calibrated board to a shared memory ring for other processes')
+	p.add_argument('host', type = str, nargs = '?', default = None, help = 'specify the host name, leave out with --benchmark')
+	p.add_argument('name', type = str, nargs = '?', default = 'adc16_ring', help = 'shared memory name readers attach to, default is adc16_ring')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Demux mode 1/2/4 the board was calibrated with')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips to capture. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
+	p.add_argument('-s', '--slots', dest = 'nslots', type = int, default = 64, help = 'Number of captures the ring holds, default is 64')
+	p.add_argument('-n', '--captures', dest = 'num_captures', type = int, default = None, help = 'Number of captures to publish, default is until interrupted')
+	p.add_argument('-t', '--time', dest = 'duration', type = float, default = None, help = 'Number of seconds to publish for')
+	p.add_argument('-r', '--readers', dest = 'nreaders', type = int, default = 3, help = 'Reader processes with --benchmark, default is 3')
+	p.add_argument('-R', '--rate', dest = 'rate', type = float, default = 1000.0, help = 'Captures/s published with --benchmark, 0 for as fast as possible, default is 1000')
+	p.add_argument('--benchmark', action = 'store_true', dest = 'benchmark', help = 'publish random data to local reader processes instead of capturing')
+	args = p.parse_args()
+
+	if args.benchmark:
+		rate, readers = benchmark(args.nreaders, len(args.chips), args.nslots, rate=args.rate)
+		print('%.0f captures/s published (%.1f MB/s)' % (rate, rate * len(args.chips) * 1024 / 1e6))
+		for i, (count, lost) in enumerate(readers):
+			print('reader %d: %d captures, %d lost' % (i, count, lost))
+	else:
+		if args.host is None:
+			p.error('specify the host name or --benchmark')
+		import asyncio
+		import adc16_async
+		loop = asyncio.new_event_loop()
+		adc = loop.run_until_complete(adc16_async.AsyncADC16.connect(args.host, chips=args.chips, demux_mode=args.demux_mode))
+		ring = CaptureRing(args.name, adc.chip_nums, args.demux_mode, args.nslots)
+		try:
+			capture(lambda: loop.run_until_complete(adc.read_all_rams()), ring, args.num_captures, args.duration)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			ring.close()
+			loop.run_until_complete(adc.close())
@@ -0,0 +1,121 @@
+import time
+import numpy as np
+
+import adc16_layout
+
+
+# Health statistics of sampled ADC data.
+#
+# Everything is derived from one histogram per (chip, input): the snapshots
+# are de-interleaved, every sample is turned into a bin number unique to its
+# chip and input, and a single np.bincount over the whole batch counts them.
+# Mean, RMS, clipping, per-bit activity and the effective number of bits are
+# then cheap reductions over the 256 bins instead of more passes over the
+# samples.  Histograms of different batches simply add, so StatsAccumulator
+# (and offline analysis of recorded data) can integrate as long as needed.
+
+NBINS = 256
+
+#Sample value of each histogram bin
+BIN_VALUES = np.arange(-128, 128)
+
+#Bit k of the offset binary ADC code of each bin, (256, 8)
+BIN_BITS = (np.arange(NBINS)[:, None] >> np.arange(8)) & 1
+
+
+def input_histograms(snapshots, demux_mode):
+	"""
+	Histograms of each ADC input over a batch of snapshots.  snapshots is a
+	(snapshots, chips, snapshot_len) or (chips, snapshot_len) int8 array as
+	returned by ADC16.read_all_rams, the result is (chips, inputs, 256) with
+	bin 0 counting -128 and bin 255 counting 127.
+	"""
+	snapshots = np.asarray(snapshots)
+	if snapshots.ndim == 2:
+		snapshots = snapshots[np.newaxis]
+	data = adc16_layout.deinterleave(snapshots, demux_mode)
+	nchips, ninputs = data.shape[1], data.shape[2]
+	#Bin number = 256 * (chip, input) index + offset binary sample value
+	base = (np.arange(nchips * ninputs, dtype=np.intp) * NBINS + 128).reshape(1, nchips, ninputs, 1)
+	counts = np.bincount((data + base).ravel(), minlength=nchips * ninputs * NBINS)
+	return counts.reshape(nchips, ninputs, NBINS)
+
+
+def histogram_stats(hist):
+	"""
+	Statistics of (..., 256) histograms, returns a dict of arrays shaped like
+	the leading axes:
+
+	  count          number of samples
+	  mean, rms      in LSB
+	  std            RMS about the mean
+	  clip_fraction  fraction of samples at the rails (-128 or 127)
+	  bit_fraction   (..., 8) fraction of samples with each ADC code bit set
+	  stuck_bits     (..., 8) True for bits that never toggled
+	  effective_bits entropy of the histogram in bits, i.e. how many bits of
+	                 the 8 the signal actually exercises
+	"""
+	hist = np.asarray(hist, dtype=np.float64)
+	count = hist.sum(axis=-1)
+	n = np.maximum(count, 1)
+	mean = hist.dot(BIN_VALUES) / n
+	rms = np.sqrt(hist.dot(BIN_VALUES ** 2) / n)
+	std = np.sqrt(np.maximum(rms ** 2 - mean ** 2, 0))
+	clip_fraction = (hist[..., 0] + hist[..., -1]) / n
+	bit_fraction = hist.dot(BIN_BITS) / n[..., np.newaxis]
+	stuck_bits = ((bit_fraction == 0) | (bit_fraction == 1)) & (count[..., np.newaxis] > 0)
+	p = hist / n[..., np.newaxis]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		effective_bits = -np.where(p > 0, p * np.log2(p), 0).sum(axis=-1)
+	return {'count': count, 'mean': mean, 'rms': rms, 'std': std, 'clip_fraction': clip_fraction,
+		'bit_fraction': bit_fraction, 'stuck_bits': stuck_bits, 'effective_bits': effective_bits}
+
+
+def snapshot_stats(snapshots, demux_mode):
+	"""histogram_stats of input_histograms, shaped (chips, inputs)."""
+	return histogram_stats(input_histograms(snapshots, demux_mode))
+
+
+class StatsAccumulator():
+
+	def __init__(self, demux_mode):
+		self.demux_mode = demux_mode
+		self.hist = None
+
+	def add(self, snapshots):
+		hist = input_histograms(snapshots, self.demux_mode)
+		if self.hist is None:
+			self.hist = hist
+		else:
+			self.hist += hist
+
+	def stats(self):
+		return histogram_stats(self.hist)
+
+
+def benchmark(nsnap=256, nchips=3, demux_mode=2, seconds=2.0):
+	"""Samples per second snapshot_stats processes on random int8 snapshots."""
+	raw = np.random.randint(-128, 128, size=(nsnap, nchips, 1024)).astype(np.int8)
+	nsamples = 0
+	start = time.time()
+	while True:
+		snapshot_stats(raw, demux_mode)
+		nsamples += raw.size
+		elapsed = time.time() - start
+		if elapsed >= seconds:
+			break
+	return nsamples / elapsed
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_stats.py [OPTIONS], benchmark the ADC health statistics')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 2, help = 'Demux mode 1/2/4 the snapshots are de-interleaved with, default is 2')
+	p.add_argument('-c', '--chips', dest = 'nchips', type = int, default = 3, help = 'Number of chips per capture, default is 3')
+	p.add_argument('-b', '--batch', dest = 'nsnap', type = int, default = 256, help = 'Number of captures processed per call, default is 256')
+	p.add_argument('-T', '--time', dest = 'seconds', type = float, default = 2.0, help = 'Benchmark duration in seconds')
+	args = p.parse_args()
+
+	rate = benchmark(args.nsnap, args.nchips, args.demux_mode, args.seconds)
+	print('Statistics of %d captures x %d chips per call, demux %d: %.1f Msamples/s, %.0f captures/s'
+		% (args.nsnap, args.nchips, args.demux_mode, rate / 1e6, rate / (args.nchips * 1024)))
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import threading
+
+
+# Span tracing for ADC16 calibration, written out in the Chrome trace event
+# format (load the file in chrome://tracing or https://ui.perfetto.dev).
+#
+# Every span becomes one complete ('X') event.  Spans opened inside another
+# span are drawn nested under it.  When the FpgaClient is wrapped with
+# Tracer.wrap, each span also carries the number of KATCP calls made while it
+# was open, in total and per client method (write_int, read, ...).
+#
+# ADC16 holds a NullTracer by default whose span() hands back one shared
+# do-nothing context manager, so instrumented code costs next to nothing when
+# tracing is off.
+
+
+class _NullSpan():
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def set(self, **args):
+		pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTracer():
+
+	def span(self, name, **args):
+		return _NULL_SPAN
+
+	def wrap(self, client):
+		return client
+
+
+#Proxy around an FpgaClient that counts calls per method for the tracer
+class CountingClient():
+
+	def __init__(self, client, tracer):
+		self._client = client
+		self._tracer = tracer
+
+	def __getattr__(self, name):
+		attr = getattr(self._client, name)
+		if not callable(attr):
+			return attr
+		tracer = self._tracer
+		def counted(*args, **kwargs):
+			tracer.count(name)
+			return attr(*args, **kwargs)
+		return counted
+
+
+class _Span():
+
+	def __init__(self, tracer, name, args):
+		self.tracer = tracer
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.time()
+		self.total = self.tracer.total
+		self.counts = dict(self.tracer.counts)
+		return self
+
+	def set(self, **args):
+		"""Add args found out while the span is open (results rather than inputs)."""
+		self.args.update(args)
+
+	def __exit__(self, *exc):
+		end = time.time()
+		tracer = self.tracer
+		args = dict(self.args)
+		args['katcp_calls'] = tracer.total - self.total
+		for method, n in tracer.counts.items():
+			if n != self.counts.get(method, 0):
+				args['katcp_' + method] = n - self.counts.get(method, 0)
+		if exc[0] is not None:
+			args['error'] = exc[0].__name__
+		tracer.events.append({'name': self.name, 'cat': 'adc16', 'ph': 'X',
+			'ts': (self.start - tracer.start) * 1e6, 'dur': (end - self.start) * 1e6,
+			'pid': tracer.pid, 'tid': threading.current_thread().ident, 'args': args})
+		return False
+
+
+class Tracer():
+
+	def __init__(self):
+		self.events = []
+		self.counts = {}
+		self.total = 0
+		self.start = time.time()
+		self.pid = os.getpid()
+
+	def wrap(self, client):
+		"""Return a proxy of client whose calls are counted in the spans."""
+		return CountingClient(client, self)
+
+	def count(self, method):
+		self.total += 1
+		self.counts[method] = self.counts.get(method, 0) + 1
+
+	def span(self, name, **args):
+		"""Context manager timing one span, args are shown with the event."""
+		return _Span(self, name, args)
+
+	def save(self, path):
+		with open(path, 'w') as f:
+			json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+# Fixed size ring buffer of the last SPI register writes made by
+# ADC16.write_adc, kept in memory instead of logging every SCLK edge.  Each
+# frame is (time, chip select bits, register, value).  ADC16 dumps it to the
+# log when calibration gives up.
+
+class SpiTraceRing():
+
+	def __init__(self, size=256):
+		self.size = size
+		self.frames = [None] * size
+		self.total = 0
+
+	def record(self, chip_select, addr, data):
+		self.frames[self.total % self.size] = (time.time(), chip_select, addr, data)
+		self.total += 1
+
+	def last(self):
+		"""The buffered frames, oldest first."""
+		if self.total <= self.size:
+			return self.frames[:self.total]
+		start = self.total % self.size
+		return self.frames[start:] + self.frames[:start]
+
+	def format(self):
+		lines = []
+		for t, chip_select, addr, data in self.last():
+			lines.append('{0:.6f} cs={1:08b} reg=0x{2:02x} value=0x{3:04x}'.format(t, chip_select, addr, data))
+		return lines
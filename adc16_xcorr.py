@@ -0,0 +1,130 @@
+import time
+import numpy as np
+
+import adc16_layout
+
+
+# Cross-correlation of every pair of ADC inputs, to check that inputs on
+# different chips are time aligned after calibration.
+#
+# Captures must be time aligned across chips (ADC16.read_all_rams).  Each
+# call to CrossCorrelator.add takes a batch of captures, does one batched
+# real FFT of every input (zero padded to twice the length so the
+# correlation is linear, not circular) and forms the full cross-spectral
+# matrix of all inputs with one batched matrix product per frequency
+# channel.  The matrices are integrated over all captures added; lags and
+# coherence are only worked out from the integrated spectra at the end.
+#
+# The sign convention is: a positive lag for pair (i, j) means input i sees
+# the signal lag samples after input j.  Lags are in samples of the
+# de-interleaved input streams of the demux mode in use.
+
+
+def input_labels(chip_nums, demux_mode):
+	"""Labels of the de-interleaved inputs, e.g. ['a1', 'a3', 'b1', ...]"""
+	return ['{0}{1}'.format(adc16_layout.CHIP_NAMES[c], i) for c in chip_nums for i in adc16_layout.DEMUX_INPUTS[demux_mode]]
+
+
+class CrossCorrelator():
+
+	def __init__(self, ninputs, nsamp):
+		self.ninputs = ninputs
+		self.nsamp = nsamp
+		self.fft_len = 2 * nsamp
+		self.pairs = np.triu_indices(ninputs, 1)
+		#Integrated cross-spectral matrix, (frequency, input, input)
+		self.spectra = np.zeros((nsamp + 1, ninputs, ninputs), dtype=np.complex128)
+		self.count = 0
+
+	def add(self, data):
+		"""Integrate a (captures, inputs, samples) batch."""
+		data = np.asarray(data, dtype=np.float64)
+		data = data - data.mean(axis=-1)[..., np.newaxis]
+		spectra = np.fft.rfft(data, n=self.fft_len, axis=-1)
+		#(frequency, inputs, captures) @ (frequency, captures, inputs)
+		spectra = spectra.transpose(2, 1, 0)
+		self.spectra += np.matmul(spectra, spectra.conj().transpose(0, 2, 1))
+		self.count += data.shape[0]
+
+	def result(self):
+		"""
+		Returns a dict with per pair arrays (pairs in np.triu_indices order):
+
+		  pairs      (i, j) input index arrays
+		  lag        lag of the correlation peak, with sub-sample parabolic
+		             interpolation
+		  peak       normalised correlation coefficient at the peak
+		  coherence  magnitude squared coherence averaged over the band
+		"""
+		i, j = self.pairs
+		cross = self.spectra[:, i, j].T
+		autos = np.real(self.spectra[:, np.arange(self.ninputs), np.arange(self.ninputs)]).T
+		corr = np.fft.irfft(cross, n=self.fft_len, axis=-1)
+		energy = np.fft.irfft(autos, n=self.fft_len, axis=-1)[:, 0]
+		norm = np.sqrt(np.maximum(energy[i] * energy[j], 1e-30))
+		mag = np.abs(corr)
+		peak_idx = mag.argmax(axis=-1)
+		rows = np.arange(len(i))
+		y0 = mag[rows, (peak_idx - 1) % self.fft_len]
+		y1 = mag[rows, peak_idx]
+		y2 = mag[rows, (peak_idx + 1) % self.fft_len]
+		denom = y0 - 2 * y1 + y2
+		frac = np.where(denom != 0, 0.5 * (y0 - y2) / np.where(denom != 0, denom, 1), 0)
+		lag = np.where(peak_idx < self.nsamp, peak_idx, peak_idx - self.fft_len) + frac
+		#Skip DC, the mean was removed
+		sxy = np.abs(cross[:, 1:]) ** 2
+		sxx_syy = autos[i, 1:] * autos[j, 1:]
+		coherence = (sxy / np.maximum(sxx_syy, 1e-30)).mean(axis=-1)
+		return {'pairs': self.pairs, 'lag': lag, 'peak': corr[rows, peak_idx] / norm, 'coherence': coherence}
+
+
+def correlate_captures(captures, demux_mode):
+	"""
+	Pairwise lags and coherence of all inputs of a (captures, chips,
+	snapshot_len) array from ADC16.read_all_rams.
+	"""
+	data = adc16_layout.deinterleave(captures, demux_mode)
+	data = data.reshape(data.shape[0], -1, data.shape[-1])
+	xc = CrossCorrelator(data.shape[1], data.shape[2])
+	xc.add(data)
+	return xc.result()
+
+
+def benchmark(ncaptures=256, nchips=3, demux_mode=1, seconds=2.0):
+	"""Captures per second correlate_captures integrates on random data."""
+	raw = np.random.randint(-128, 128, size=(ncaptures, nchips, 1024)).astype(np.int8)
+	n = 0
+	start = time.time()
+	while True:
+		correlate_captures(raw, demux_mode)
+		n += ncaptures
+		elapsed = time.time() - start
+		if elapsed >= seconds:
+			break
+	return n / elapsed
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	p = ArgumentParser(description = 'python adc16_xcorr.py HOST [OPTIONS], measure the delay between every pair of inputs of a calibrated board')
+	p.add_argument('host', type = str, nargs = '?', default = None, help = 'specify the host name, leave out with --benchmark')
+	p.add_argument('-d', '--demux', dest = 'demux_mode', type = int, default = 1, help = 'Demux mode 1/2/4 the board was calibrated with')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips to correlate. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
+	p.add_argument('-n', '--captures', dest = 'num_captures', type = int, default = 100, help = 'Number of captures to integrate')
+	p.add_argument('--benchmark', action = 'store_true', dest = 'benchmark', help = 'time the correlator on random data instead of capturing')
+	args = p.parse_args()
+
+	if args.benchmark:
+		rate = benchmark(nchips=len(args.chips), demux_mode=args.demux_mode)
+		ninputs = len(args.chips) * len(adc16_layout.DEMUX_INPUTS[args.demux_mode])
+		print('%d inputs (%d pairs), demux %d: %.0f captures/s' % (ninputs, ninputs * (ninputs - 1) // 2, args.demux_mode, rate))
+	else:
+		import adc16
+		a = adc16.ADC16(**{'host':args.host, 'bof':'', 'skip_flag':True, 'verbosity':False, 'chips':args.chips, 'demux_mode':args.demux_mode, 'test_pattern':'deskew', 'gain':1})
+		chips = sorted(a.chips, key=a.chips.get)
+		captures = np.array([a.read_all_rams(chips)[0] for n in range(args.num_captures)])
+		result = correlate_captures(captures, args.demux_mode)
+		labels = input_labels([a.chips[chip] for chip in chips], args.demux_mode)
+		print('pair      lag    peak  coherence')
+		for k, (i, j) in enumerate(zip(*result['pairs'])):
+			print('%-3s %-3s %6.2f %7.3f %10.3f' % (labels[i], labels[j], result['lag'][k], result['peak'][k], result['coherence'][k]))
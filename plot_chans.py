@@ -12,7 +12,7 @@ if __name__ == '__main__':
 	p.add_argument('-g', '--gain', dest = 'gain', type = int, default = 0, help = 'Set the gain')
 	p.add_argument('-i','--iters', dest = 'num_iters', type = int, default=1, help = 'Enter the number of snaps per tap')
 	p.add_argument('-r', '--reg', nargs = '+', dest = 'registers', type = int, default = [], help = 'enter registers and their values in [REGISTER] [VALUE] format')
-	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips you wish to calibrate. Ex: -c a b . Default all chips:  a b c.')
+	p.add_argument('-c', '--chips', nargs = '+', dest = 'chips', type = str, default = ['a','b','c'], help = 'Input chips you wish to calibrate. Ex: -c a b . Default all chips:  a b c (a to h on 8 chip designs).')
 	p.add_argument('-s', '--skip', action = 'store_true', dest = 'skip_flag', help = 'specify this flag if you want to skip programming the bof file unto the FPGA')	
 	p.add_argument('-v', '--verbosity', action = 'store_true', dest = 'verbosity', help = 'increase output verbosity') #add the explanation of different demux modes
 	p.add_argument('-p', '--pattern', dest = 'test_pattern', type=str,default = 'deskew',help = 'input the test pattern to calibrate adc(ex. deskew:10101010, sync:11110000),for custom pattern just enter bitstream(ex.-p 10110110 or -p 0 etc.')
@@ -31,41 +31,33 @@ if __name__ == '__main__':
 #define an ADC16 class object and pass it keyword arguments
 a=adc16.ADC16(**{'host':host, 'bof':bof, 'skip_flag':skip_flag, 'verbosity':verbosity, 'chips':chips,'demux_mode':demux_mode,'test_pattern':test_pattern,'gain':gain})
 
-chip_dict={}
-for chip in chips:
-	if chip == 'a'or chip == 'A':
-		chip_dict['a'] = 0
-	elif chip == 'b' or chip ==  'B':
-		chip_dict['b'] = 1
-	elif chip == 'c' or chip == 'C':
-		chip_dict['c'] = 2
-	else:
-		logging.error('Invalid chip name passed, available values: a, b or c, default is all chips selected')
-		exit(1)
+#ADC16 validated the chip names and numbered them (a=0 ... h=7)
+chip_dict=a.chips
 
-for chip, chip_num in chip_dict.iteritems():
+#Capture all chips on one snap request so the traces of different chips are time aligned
+chip_order = sorted(chip_dict, key=chip_dict.get)
+#One column of plots per chip
+ncols = len(chip_order)
+a.enable_pattern('deskew')
+pattern_snaps, pattern_time = a.read_all_rams(chip_order)
+a.write_adc(0x25,0x00)
+a.write_adc(0x45,0x00)
+data_snaps, data_time = a.read_all_rams(chip_order)
 
-	#calibrate the adc16 chips using test patterns
-	#a.set_demux_fpga(1)
-	snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
-#	for i in snapshot:
-#		print i
-	snapshot=snapshot.tolist()
+for row, chip in enumerate(chip_order):
+	chip_num = chip_dict[chip]
 	input1_data=[]
 	input2_data=[]
 	input3_data=[]
 	input4_data=[]
 	i = 0
 	if demux_mode == 2:
-		a.enable_pattern('deskew')
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
-		plt.subplot(3,3,1+chip_num)
+		snapshot=pattern_snaps[row]
+		plt.subplot(3,ncols,1+row)
 		plt.title('Test Pattern chip %s'%chip)
 		plt.ylim([0,50])
 		plt.plot(snapshot)
-		a.write_adc(0x25,0x00)
-		a.write_adc(0x45,0x00)
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
+		snapshot=data_snaps[row]
 		while i<1024:
 			input1_data.append(snapshot[i])
 			input1_data.append(snapshot[i+4])
@@ -77,25 +69,22 @@ for chip, chip_num in chip_dict.iteritems():
 			input3_data.append(snapshot[i+3])
 			input3_data.append(snapshot[i+7])
 			i+=8
-		plt.subplot(3,3,4+chip_num)
+		plt.subplot(3,ncols,ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input1_data)
 		plt.title('Input 1 data chip %s'%chip)
-		plt.subplot(3,3,7+chip_num)
+		plt.subplot(3,ncols,2*ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input3_data)
 		plt.title('Input 3 data chip %s'%chip)
 
 	elif demux_mode == 1:
-		a.enable_pattern('deskew')
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
-		plt.subplot(5,3,1+chip_num)
+		snapshot=pattern_snaps[row]
+		plt.subplot(5,ncols,1+row)
 		plt.ylim([0,50])
 		plt.title('Test Pattern chip %s'%chip)
 		plt.plot(snapshot)
-		a.write_adc(0x25,0x00)
-		a.write_adc(0x45,0x00)
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
+		snapshot=data_snaps[row]
 		while i<1024:
 			input1_data.append(snapshot[i])
 			input2_data.append(snapshot[i+1])
@@ -103,32 +92,29 @@ for chip, chip_num in chip_dict.iteritems():
 			input4_data.append(snapshot[i+3])
 			
 			i+=4
-		plt.subplot(5,3,4+chip_num)
+		plt.subplot(5,ncols,ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input1_data)
 		plt.title('Input 1 data')
-		plt.subplot(5,3,7+chip_num)
+		plt.subplot(5,ncols,2*ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input2_data)
 		plt.title('Input 2 data')
-		plt.subplot(5,3,10+chip_num)
+		plt.subplot(5,ncols,3*ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input3_data)
 		plt.title('Input 3 data')
-		plt.subplot(5,3,13+chip_num)
+		plt.subplot(5,ncols,4*ncols+1+row)
 		plt.ylim([-40,40])
 		plt.plot(input4_data)
 		plt.title('Input 4 data')
 	elif demux_mode == 4:
-		a.enable_pattern('deskew')
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
-		plt.subplot(2,3,1+chip_num)
+		snapshot=pattern_snaps[row]
+		plt.subplot(2,ncols,1+row)
 		plt.ylim([0,50])
 		plt.title('Test Pattern chip %s'%chip)
 		plt.plot(snapshot)
-		a.write_adc(0x25,0x00)
-		a.write_adc(0x45,0x00)
-		snapshot=a.read_ram('adc16_wb_ram{0}'.format(chip_num))
+		snapshot=data_snaps[row]
 		while i<1024:
 			input1_data.append(snapshot[i])
 			input1_data.append(snapshot[i+2])
@@ -139,7 +125,7 @@ for chip, chip_num in chip_dict.iteritems():
 			input1_data.append(snapshot[i+5])
 			input1_data.append(snapshot[i+7])
 			i+=8			
-		plt.subplot(2,3,4+chip_num)
+		plt.subplot(2,ncols,ncols+1+row)
 		plt.ylim([-6,6])
 		plt.plot(input1_data)
 		plt.title('Input 1 data chip %s'%chip)
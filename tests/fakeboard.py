@@ -0,0 +1,152 @@
+import time
+import random
+import numpy as np
+
+
+# Simulated SNAP/ROACH2 board for the tests, standing in for the FpgaClient
+# ADC16 talks to (pass it as the client kwarg).
+#
+# It decodes what ADC16 writes to adc16_controller the way the gateware
+# does: 3-wire (SPI) writes on word 0 set the chip registers that select the
+# test patterns, bit 8+n of word 1 bitslips chip n's lane (bits 5-7), bit 16
+# of word 1 triggers the snapshot BRAMs and the strobe words 2 and 3 load
+# the tap in the low bits of word 1 into their lanes.
+#
+# Every lane has an eye centred on a random tap (eye) with eye_half error free
+# taps on either side, and a word boundary that is slip_true bits late until
+# it is bitslipped.  Outside the eye a lane delivers random bytes.  A lane
+# whose boundary is off by r bits delivers the last 8-r bits of one sample
+# and the first r bits of the next, MSB first as on the wire.  The deskew
+# pattern (10101010) reads the same at any even boundary, the simulator
+# delivers it whatever the boundary so the tap sweep only depends on the eye.
+#
+# calls counts the requests made per method.
+#
+# Run the tests from the top of the repository with
+#
+#   python -m unittest discover -s tests
+#
+# The tests of adc16 itself are skipped where it can't be imported (it needs
+# corr, so Python 2).
+
+class FakeBoard():
+
+	def __init__(self, nchips=3, seed=1, eye_half=5, noise=4.0):
+		rng = random.Random(seed)
+		self.nchips = nchips
+		self.eye_half = eye_half
+		self.noise = noise
+		#Eye centre and word boundary offset of every lane, [chip][lane] in LANES order
+		self.eye = [[rng.randint(eye_half + 4, 31 - eye_half - 4) for k in range(8)] for n in range(8)]
+		self.slip_true = [[rng.randint(0, 7) for k in range(8)] for n in range(8)]
+		self.slip = [[0] * 8 for n in range(8)]
+		self.tap = [[0] * 8 for n in range(8)]
+		self.bitslip_works = True
+		self.regs = [0] * 4
+		self.chip_regs = [{} for n in range(8)]
+		self.captured = {}
+		self.calls = {}
+		self._spi_bits = []
+		self._sclk = 0
+		self._rng = np.random.RandomState(seed)
+
+	def _call(self, name):
+		self.calls[name] = self.calls.get(name, 0) + 1
+
+	def ncalls(self):
+		return sum(self.calls.values())
+
+	def is_connected(self):
+		self._call('is_connected')
+		return True
+
+	def progdev(self, bof):
+		self._call('progdev')
+		return 'ok'
+
+	def listdev(self):
+		self._call('listdev')
+		return ['adc16_controller', 'sys_clkcounter'] + ['adc16_wb_ram%d' % n for n in range(self.nchips)]
+
+	def est_brd_clk(self):
+		self._call('est_brd_clk')
+		return 250.0
+
+	def write_int(self, device, value, blindwrite=False, offset=0):
+		self._call('write_int')
+		value &= 0xffffffff
+		if offset == 0:
+			chip_select, sdata, sclk = value & 0xff, (value >> 8) & 1, (value >> 9) & 1
+			if not chip_select:
+				self._spi_bits = []
+			elif sclk and not self._sclk:
+				self._spi_bits.append(sdata)
+				if len(self._spi_bits) == 24:
+					word = 0
+					for bit in self._spi_bits:
+						word = (word << 1) | bit
+					for n in range(8):
+						if chip_select >> n & 1:
+							self.chip_regs[n][word >> 16] = word & 0xffff
+					self._spi_bits = []
+			self._sclk = sclk
+			self.regs[0] = value
+		elif offset == 1:
+			lane = (value >> 5) & 7
+			for n in range(8):
+				if value >> (8 + n) & 1 and self.bitslip_works:
+					self.slip[n][lane] = (self.slip[n][lane] + 1) % 8
+			if value & 0x10000 and not self.regs[1] & 0x10000:
+				self._capture()
+			self.regs[1] = value
+		elif offset in (2, 3):
+			for bit in range(32):
+				if value >> bit & 1:
+					self.tap[bit // 4][2 * (bit % 4) + offset - 2] = self.regs[1] & 0x1f
+			self.regs[offset] = value
+
+	def read_int(self, device, offset=0):
+		self._call('read_int')
+		if offset == 0:
+			#Clock locked, NNNN chips, revision 1
+			return 0x03000000 | (self.nchips << 20) | (1 << 16) | (self.regs[0] & 0x3ff)
+		return self.regs[offset]
+
+	def read_uint(self, device, offset=0):
+		self._call('read_uint')
+		#sys_clkcounter of a 250 MHz clock
+		return int(time.time() * 250e6) & 0xffffffff
+
+	def read(self, device, size, offset=0):
+		self._call('read')
+		data = self.captured.get(int(device[len('adc16_wb_ram'):]), np.zeros(1024, dtype=np.int8))
+		return data[offset:offset + size].tobytes()
+
+	#Offset binary codes chip n's lane k sends for count samples
+	def _pattern(self, n, count):
+		regs = self.chip_regs[n]
+		if regs.get(0x45, 0) & 1:
+			return np.full(count, 0xaa)
+		if regs.get(0x45, 0) & 2:
+			return np.full(count, 0xf0)
+		if regs.get(0x25, 0) & 0x40:
+			return (np.arange(count) + 17) % 256
+		if regs.get(0x25, 0) & 0x10:
+			return np.full(count, regs.get(0x26, 0) >> 8)
+		return (np.clip(np.round(self._rng.randn(count) * self.noise), -128, 127).astype(int) + 128) % 256
+
+	def _lane(self, n, k, count):
+		if abs(self.tap[n][k] - self.eye[n][k]) > self.eye_half:
+			return self._rng.randint(0, 256, count)
+		codes = self._pattern(n, count)
+		r = 0 if self.chip_regs[n].get(0x45, 0) & 1 else (self.slip_true[n][k] - self.slip[n][k]) % 8
+		following = np.append(codes[1:], codes[-1])
+		return ((codes << r) | (following >> (8 - r))) & 0xff
+
+	def _capture(self):
+		for n in range(self.nchips):
+			data = np.empty(1024, dtype=np.int8)
+			for k in range(8):
+				#The snapshot holds the codes with the MSB flipped
+				data[k::8] = (self._lane(n, k, 128) ^ 0x80).astype(np.uint8).view(np.int8)
+			self.captured[n] = data
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import adc16_analyze
+import adc16_layout
+import adc16_pfb
+import adc16_recorder
+import adc16_stats
+
+
+class AnalyzeTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'captures')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_shards(self):
+		#Not a whole number of shards or batches
+		adc16_analyze.make_dataset(self.path, ncaptures=700, nchips=2)
+		single = adc16_analyze.analyze(self.path, processes=1, shard_captures=700, nchan=16)
+		sharded = adc16_analyze.analyze(self.path, processes=3, shard_captures=150, nchan=16)
+		self.assertEqual((single['captures'], sharded['captures']), (700, 700))
+		self.assertEqual(sharded['labels'], ['a1', 'a3', 'b1', 'b3'])
+		self.assertEqual(sharded['hist'].tolist(), single['hist'].tolist())
+		np.testing.assert_allclose(sharded['power'], single['power'], rtol=1e-5)
+		for name, value in single['stats'].items():
+			np.testing.assert_allclose(sharded['stats'][name], value, err_msg=name)
+		#And the whole dataset in one go
+		data, index = adc16_recorder.open_dataset(self.path)
+		captures = np.asarray(data).reshape(700, 2, 1024)
+		self.assertEqual(single['hist'].tolist(), adc16_stats.input_histograms(captures, 2).tolist())
+		samples = adc16_layout.deinterleave(captures, 2).astype(np.float64)
+		np.testing.assert_allclose(single['power'], adc16_pfb.PolyphaseFilterbank(16, 4).power(samples, axis=0), rtol=1e-4)
+
+	def test_demux_mode(self):
+		adc16_analyze.make_dataset(self.path, ncaptures=10, nchips=1, demux_mode=2)
+		result = adc16_analyze.analyze(self.path, processes=1, demux_mode=1)
+		self.assertEqual(result['power'].shape, (1, 4, 32))
+		self.assertEqual(result['labels'], ['a1', 'a2', 'a3', 'a4'])
+
+	def test_empty(self):
+		adc16_recorder.CaptureRecorder(self.path).close()
+		self.assertRaises(ValueError, adc16_analyze.analyze, self.path, processes=1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,112 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy as np
+
+import adc16_archive
+import adc16_layout
+import adc16_recorder
+
+
+class CodecTest(unittest.TestCase):
+
+	def test_pack_bits(self):
+		rng = np.random.RandomState(0)
+		for width in range(9):
+			for count in (0, 1, 8, 13, 1000):
+				values = rng.randint(0, 1 << width, count)
+				payload = adc16_archive.pack_bits(values, width)
+				self.assertEqual(len(payload), -(-count // 8) * width)
+				self.assertEqual(adc16_archive.unpack_bits(payload, width, count).tolist(), values.tolist())
+
+	def test_codecs(self):
+		signals = {'noise': adc16_archive.test_signal(8, 3, rms=3.0), 'tone': adc16_archive.test_signal(8, 3, rms=0.5, tone=60),
+			'full scale': adc16_archive.test_signal(8, 3, rms=100.0), 'constant': np.zeros((8, 3, 1024), dtype=np.int8)}
+		for name, data in signals.items():
+			chunk = adc16_layout.deinterleave(data, 2)
+			for codec in adc16_archive.CODECS:
+				encoded = adc16_archive.encode_chunk(chunk, (codec,))
+				decoded = adc16_archive.decode_chunk(*(encoded + (chunk.shape,)))
+				self.assertEqual(decoded.tolist(), chunk.tolist(), '{0} with {1}'.format(name, encoded[0]))
+			codec, width, reference, payload = adc16_archive.encode_chunk(chunk)
+			self.assertLessEqual(len(payload), chunk.size)
+			if name != 'full scale':
+				self.assertNotEqual(codec, 'raw', name)
+
+	def test_frame_of_reference_width(self):
+		#+-6 LSB takes 4 bits per sample
+		chunk = np.tile(np.arange(-6, 7, dtype=np.int8), (1, 1, 1, 8))
+		codec, width, reference, payload = adc16_archive.encode_chunk(chunk, ('for',))
+		self.assertEqual((codec, width, reference), ('for', 4, -6))
+
+
+class ArchiveTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'captures.arc')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_round_trip(self):
+		data = adc16_archive.test_signal(40, 3, rms=3.0, tone=20)
+		times = 1e9 + np.arange(40) * 0.01
+		writer = adc16_archive.ArchiveWriter(self.path, [0, 1, 2], 2, chunk_captures=16)
+		writer.append_many(data[:30], times[:30])
+		for capture in range(30, 40):
+			writer.append(data[capture], times[capture])
+		writer.close()
+		self.assertEqual(writer.captures, 40)
+		self.assertEqual(writer.size, os.path.getsize(self.path))
+		self.assertLess(writer.size, writer.raw_bytes)
+		reader = adc16_archive.ArchiveReader(self.path)
+		self.assertEqual(len(reader), 3)
+		self.assertEqual((reader.captures, reader.chip_nums, reader.demux_mode), (40, [0, 1, 2], 2))
+		self.assertEqual(reader.index['first'].tolist(), [0, 16, 32])
+		expected = adc16_layout.deinterleave(data, 2)
+		chunk, chunk_times = reader.read_chunk(2)
+		self.assertEqual(chunk.tolist(), expected[32:].tolist())
+		self.assertEqual(chunk_times.tolist(), times[32:].tolist())
+		for capture in (0, 15, 16, 39):
+			self.assertEqual(reader.chunk_of(capture), capture // 16)
+			samples, trig_time = reader.read_capture(capture)
+			self.assertEqual(samples.tolist(), expected[capture].tolist())
+			self.assertEqual(trig_time, times[capture])
+		reader.close()
+
+	def test_convert(self):
+		data = adc16_archive.test_signal(10, 2, rms=3.0)
+		dataset = os.path.join(self.tmp, 'captures')
+		recorder = adc16_recorder.CaptureRecorder(dataset)
+		for capture in range(10):
+			recorder.append(data[capture], 100.0 + capture, [0, 2], 4, 1)
+		recorder.close()
+		adc16_archive.convert(dataset, self.path, chunk_captures=4)
+		reader = adc16_archive.ArchiveReader(self.path)
+		self.assertEqual((reader.captures, reader.chip_nums, reader.demux_mode), (10, [0, 2], 4))
+		chunk, times = reader.read_chunk(2)
+		self.assertEqual(chunk.tolist(), adc16_layout.deinterleave(data[8:], 4).tolist())
+		self.assertEqual(times.tolist(), [108.0, 109.0])
+		reader.close()
+
+	def test_not_closed(self):
+		writer = adc16_archive.ArchiveWriter(self.path, [0], 4, chunk_captures=4)
+		writer.append_many(adc16_archive.test_signal(4, 1), [0.0] * 4)
+		writer._file.close()
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter('always')
+			self.assertRaises(ValueError, adc16_archive.ArchiveReader, self.path)
+			with open(self.path, 'r+b') as f:
+				f.write(b'X')
+			self.assertRaises(ValueError, adc16_archive.ArchiveReader, self.path)
+			gc.collect()
+		#The reader closes its file before raising (there is no ResourceWarning on Python 2 to check)
+		self.assertEqual([str(w.message) for w in caught if w.category.__name__ == 'ResourceWarning'], [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,120 @@
+import time
+import unittest
+
+#adc16_async (and asyncio) are Python 3 only. The tests drive the event loop from plain functions, so this
+#file still compiles on Python 2
+try:
+	import asyncio
+	import adc16_async
+except (ImportError, SyntaxError):
+	adc16_async = None
+
+
+if adc16_async is not None:
+
+	class ChattyStandIn(adc16_async.KatcpStandIn):
+		#Sends a #log inform, which belongs to no request, and an inform of the request itself before every reply
+		def _handle(self, name, args):
+			replies = adc16_async.KatcpStandIn._handle(self, name, args)
+			if name == 'listdev':
+				return replies
+			return [adc16_async.format_message(b'#', 'log', 'info', 'handling ?' + name),
+				adc16_async.format_message(b'#', name, 'extra')] + replies
+
+
+@unittest.skipIf(adc16_async is None, 'adc16_async needs Python 3')
+class EscapeTest(unittest.TestCase):
+
+	def test_round_trip(self):
+		for arg in (b'', b'plain', b'a b', b'\\', b'\\_', b'\0\n\r\x1b\t', bytes(range(256))):
+			escaped = adc16_async.escape(arg)
+			self.assertNotIn(b' ', escaped)
+			self.assertNotIn(b'\n', escaped)
+			self.assertEqual(adc16_async.unescape(escaped), arg)
+		self.assertEqual(adc16_async.escape(b''), b'\\@')
+		self.assertEqual(adc16_async.escape(b'a b\\'), b'a\\_b\\\\')
+		self.assertEqual(adc16_async.escape(12), b'12')
+
+	def test_message(self):
+		line = adc16_async.format_message(b'?', 'write', 'adc16_controller', 4, b'\x00 \n\xff')
+		self.assertEqual(line.count(b'\n'), 1)
+		self.assertEqual(adc16_async.parse_message(line), (b'?', 'write', [b'adc16_controller', b'4', b'\x00 \n\xff']))
+		self.assertEqual(adc16_async.parse_message(b'!read ok \\@\r\n'), (b'!', 'read', [b'ok', b'']))
+		self.assertIsNone(adc16_async.parse_message(b'\n'))
+
+
+@unittest.skipIf(adc16_async is None, 'adc16_async needs Python 3')
+class ClientTest(unittest.TestCase):
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.standin = None
+		self.client = None
+
+	def tearDown(self):
+		if self.client is not None:
+			self.loop.run_until_complete(self.client.close())
+		if self.standin is not None:
+			self.loop.run_until_complete(self.standin.stop())
+		asyncio.set_event_loop(None)
+		self.loop.close()
+
+	def connect(self, standin):
+		self.standin = standin
+		port = self.loop.run_until_complete(standin.start())
+		self.client = self.loop.run_until_complete(adc16_async.AsyncKatcpClient.connect('127.0.0.1', port))
+		return self.client
+
+	#Runs the coroutines as tasks started in order, so their requests go out back to back before any reply is
+	#read. Returns their results, or the exceptions they raised
+	def run_all(self, *coroutines):
+		tasks = [self.loop.create_task(coroutine) for coroutine in coroutines]
+		self.loop.run_until_complete(asyncio.wait(tasks))
+		return [task.exception() or task.result() for task in tasks]
+
+	def test_informs(self):
+		client = self.connect(ChattyStandIn(nchips=2))
+		write, read, listdev = self.run_all(client.request('write', 'adc16_controller', 4, b'\x01\x02\x03\x04'),
+			client.read('adc16_controller', 4, 4), client.listdev())
+		self.assertEqual(write, ([], [[b'extra']]))
+		self.assertEqual(read, b'\x01\x02\x03\x04')
+		self.assertEqual(listdev, sorted(self.standin.devices))
+
+	def test_pipelined(self):
+		latency = 0.05
+		client = self.connect(ChattyStandIn(nchips=3, latency=latency))
+		rams = [adc16_async.adc16_layout.RAMS[n] for n in (2, 0, 1)]
+		start = time.time()
+		results = self.run_all(*([client.request('write', 'adc16_controller', 4 * n, bytes([n] * 4)) for n in range(4)] +
+			[client.read(ram, 1024) for ram in rams] + [client.read('adc16_controller', 16)]))
+		#Eight requests, about one reply latency
+		self.assertLess(time.time() - start, 4 * latency)
+		self.assertEqual(self.standin.requests, 8)
+		self.assertEqual(results[:4], [([], [[b'extra']])] * 4)
+		self.assertEqual(results[4:7], [bytes(self.standin.devices[ram]) for ram in rams])
+		self.assertEqual(results[7], bytes([0] * 4 + [1] * 4 + [2] * 4 + [3] * 4))
+
+	def test_errors(self):
+		client = self.connect(ChattyStandIn(nchips=1))
+		#The failed requests take their own replies, the ones behind them still get theirs
+		results = self.run_all(client.request('read', 'no_such_device', 0, 4), client.request('frobnicate'),
+			client.request('write', 'adc16_controller', 0, b'\xff' * 4), client.read('adc16_controller', 4))
+		self.assertIsInstance(results[0], adc16_async.KatcpError)
+		self.assertIn('?read failed: fail', str(results[0]))
+		self.assertIsInstance(results[1], adc16_async.KatcpError)
+		self.assertIn('?frobnicate failed: invalid', str(results[1]))
+		self.assertEqual(results[2:], [([], [[b'extra']]), b'\xff' * 4])
+
+	def test_connection_closed(self):
+		client = self.connect(adc16_async.KatcpStandIn(nchips=1, latency=0.05))
+		#The device goes away with the request unread, which resets the connection
+		read = self.loop.create_task(client.read('adc16_controller', 4))
+		self.loop.run_until_complete(asyncio.gather(client.drain(), self.standin.stop()))
+		self.standin = None
+		self.loop.run_until_complete(asyncio.wait([read]))
+		self.assertIsInstance(read.exception(), ConnectionError)
+
+
+if __name__ == '__main__':
+	unittest.main()
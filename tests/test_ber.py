@@ -0,0 +1,59 @@
+import math
+import unittest
+import numpy as np
+
+import adc16_ber
+import adc16_layout
+
+
+class BitErrorCounterTest(unittest.TestCase):
+
+	def test_counts(self):
+		counter = adc16_ber.BitErrorCounter(3, adc16_layout.DESKEW_EXPECTED)
+		data = np.full((5, 3, 1024), adc16_layout.DESKEW_EXPECTED, dtype=np.int8)
+		#Bit 0 of chip b lane 1b in 7 samples, bit 6 of chip c lane 4b in one
+		data[0, 1, 1:8 * 7:8] ^= 0x01
+		data[4, 2, 1023] ^= 0x40
+		counter.add(data[:4])
+		counter.add(data[4])
+		self.assertEqual(counter.samples, 5 * 128)
+		self.assertEqual(counter.bits(), 5 * 128 * 8)
+		self.assertEqual(counter.errors.sum(), 8)
+		self.assertEqual(counter.errors[1, 1, 0], 7)
+		self.assertEqual(counter.errors[2, 7, 6], 1)
+		result = counter.result()
+		self.assertEqual(result['lane_ber'][1, 1], 7.0 / counter.bits())
+		self.assertEqual(result['bit_ber'][2, 7, 6], 1.0 / counter.samples)
+		self.assertEqual(result['lane_ber'][0].sum(), 0)
+		self.assertTrue((result['lane_low'] <= result['lane_ber']).all())
+		self.assertTrue((result['lane_ber'] <= result['lane_high']).all())
+
+	def test_custom_pattern(self):
+		expected = adc16_ber.pattern_expected('custom', 0xb6)
+		counter = adc16_ber.BitErrorCounter(1, expected)
+		counter.add(np.full((1, 1024), 0xb6 ^ 0x80, dtype=np.uint8).view(np.int8))
+		self.assertEqual(counter.errors.sum(), 0)
+		self.assertEqual(adc16_ber.pattern_expected('sync'), adc16_layout.SYNC_EXPECTED)
+
+	def test_wilson_interval(self):
+		low, high = adc16_ber.wilson_interval(0, 1e6)
+		self.assertEqual(low, 0)
+		#No errors: the upper bound is about z^2/n
+		self.assertAlmostEqual(high * 1e6, 1.96 ** 2, delta=0.01)
+		low, high = adc16_ber.wilson_interval([10, 500], [1000, 1000])
+		self.assertTrue((low < [0.01, 0.5]).all() and ([0.01, 0.5] < high).all())
+		self.assertAlmostEqual(0.5 - low[1], high[1] - 0.5)
+
+	def test_wilson_reference(self):
+		#Textbook form, one rate at a time
+		errors, trials = [0, 1, 7, 500, 999, 1000, 3], [1000, 1000, 1000, 1000, 1000, 1000, 10]
+		low, high = adc16_ber.wilson_interval(errors, trials, z=2.5)
+		for x, n, l, h in zip(errors, trials, low, high):
+			centre = (x + 2.5 ** 2 / 2) / (n + 2.5 ** 2)
+			half = 2.5 / (n + 2.5 ** 2) * math.sqrt(x * (n - x) / float(n) + 2.5 ** 2 / 4)
+			self.assertAlmostEqual(l, max(centre - half, 0))
+			self.assertAlmostEqual(h, min(centre + half, 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
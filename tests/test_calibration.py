@@ -0,0 +1,217 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+import fakeboard
+
+#adc16 needs corr (and matplotlib), and only runs on Python 2
+try:
+	import adc16
+except (ImportError, SyntaxError):
+	adc16 = None
+
+logging.disable(logging.WARNING)
+
+
+def make_adc16(board, chips='abc', **kwargs):
+	settings = {'host': None, 'bof': None, 'skip_flag': True, 'verbosity': False, 'chips': list(chips),
+		'demux_mode': 2, 'test_pattern': '10110110', 'gain': 1, 'client': board, 'pattern_settle': 0}
+	settings.update(kwargs)
+	return adc16.ADC16(**settings)
+
+
+@unittest.skipIf(adc16 is None, 'adc16 needs corr and Python 2')
+class CalibrateTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def assertCentred(self, board, a):
+		for chip, n in a.chips.items():
+			self.assertEqual(a.taps[chip], board.eye[n])
+			self.assertEqual(board.tap[n], board.eye[n])
+			self.assertEqual(board.slip[n], board.slip_true[n])
+
+	def test_calibrate(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		result = a.calibrate()
+		self.assertEqual(result['path'], 'full')
+		self.assertEqual(result['chips'], {'a': 'full', 'b': 'full', 'c': 'full'})
+		self.assertEqual(result['margin'], board.eye_half)
+		self.assertCentred(board, a)
+
+	def test_trace_spans(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.enable_tracing()
+		before = board.ncalls()
+		a.calibrate()
+		spans = dict((event['name'], event['args']) for event in a.tracer.events)
+		self.assertEqual(spans['walk_taps']['chips'], 'abc')
+		self.assertEqual(spans['calibrate']['katcp_calls'], board.ncalls() - before)
+		for chip, n in a.chips.items():
+			self.assertEqual(spans['sweep']['good_taps_' + chip], [2 * board.eye_half + 1] * 8)
+			self.assertEqual(spans['tap_apply']['taps_' + chip], board.eye[n])
+			#A fresh board is bitslipped all the way to each lane's word boundary
+			self.assertEqual(spans['sync_chips']['bitslips_' + chip], board.slip_true[n])
+
+	def test_calibrate_eight_chips(self):
+		board = fakeboard.FakeBoard(nchips=8, seed=2)
+		a = make_adc16(board, 'abcdefgh')
+		a.calibrate()
+		self.assertCentred(board, a)
+
+	def test_recalibrate_incremental(self):
+		#A 3 tap eye, so a drift of one tap shows up inside the +-2 window
+		board = fakeboard.FakeBoard(eye_half=1)
+		a = make_adc16(board)
+		a.calibrate()
+		board.eye[0] = [tap + 1 for tap in board.eye[0]]
+		board.eye[2][3] -= 1
+		self.assertEqual(a.recalibrate_incremental(), {'a': 'tracked', 'b': 'tracked', 'c': 'tracked'})
+		self.assertCentred(board, a)
+		self.assertEqual(a.margins, {'a': [1] * 8, 'b': [1] * 8, 'c': [1] * 8})
+
+	def test_recalibrate_lost_eye(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.calibrate()
+		board.eye[1][5] += 8 if board.eye[1][5] < 16 else -8
+		self.assertEqual(a.recalibrate_incremental(), {'a': 'tracked', 'b': 'full', 'c': 'tracked'})
+		self.assertCentred(board, a)
+		self.assertEqual(a.margins['b'], [board.eye_half] * 8)
+
+	def test_measure_clock(self):
+		boards = [fakeboard.FakeBoard(), fakeboard.FakeBoard()]
+		adcs = [make_adc16(board) for board in boards]
+		for mhz, error_mhz in adc16.measure_clocks(adcs, interval=0.05):
+			self.assertLess(abs(mhz - 250), error_mhz + 1e-3)
+		#Measured once per session
+		self.assertEqual(adcs[0].measure_clock(), adcs[0].board_clock)
+		self.assertEqual(boards[0].calls['read_uint'], 2)
+
+	def test_cached_taps(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.calibrate()
+		path = os.path.join(self.tmp, 'taps.json')
+		a.save_taps(path)
+		#A power cycled board: taps back to 0, lanes not bitslipped
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		self.assertEqual(a.load_taps(path), ['a', 'b', 'c'])
+		result = a.calibrate(plan=('cached', 0), budget=60)
+		self.assertEqual(result['path'], 'cached')
+		self.assertEqual(result['chips'], {'a': 'tracked', 'b': 'tracked', 'c': 'tracked'})
+		self.assertEqual(result['margin'], board.eye_half)
+		self.assertCentred(board, a)
+
+	def test_cached_taps_without_margins(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.calibrate()
+		saved = {'taps': a.taps}
+		a = make_adc16(fakeboard.FakeBoard())
+		a.load_taps(saved)
+		self.assertIsNone(a.calibrate(plan=('cached', 0), budget=60)['margin'])
+		self.assertEqual(a.margins, {})
+
+	def test_cached_taps_round_trip(self):
+		#adc16_init.py --taps: load, calibrate, save, then load again next time
+		a = make_adc16(fakeboard.FakeBoard())
+		a.calibrate()
+		path = os.path.join(self.tmp, 'taps.json')
+		with open(path, 'w') as f:
+			json.dump({'taps': a.taps, 'margins': {'a': None}}, f)
+		for i in range(2):
+			board = fakeboard.FakeBoard()
+			a = make_adc16(board)
+			self.assertEqual(a.load_taps(path), ['a', 'b', 'c'])
+			self.assertIsNone(a.calibrate(plan=('cached', 0), budget=60)['margin'])
+			self.assertCentred(board, a)
+			a.save_taps(path)
+		with open(path) as f:
+			self.assertEqual(json.load(f)['margins'], {})
+
+	def test_plan_taps(self):
+		#Captures dominate, as on a board where every snapshot BRAM is a read request
+		latency = (1e-3, 5e-2)
+		a = make_adc16(fakeboard.FakeBoard())
+		def cost(window):
+			requests, captures, settles = a.tap_search_cost(window)
+			return requests * latency[0] + captures * latency[1]
+		#Nothing to start from: always the full sweep
+		self.assertEqual(a.plan_taps(0, latency), ('full', None))
+		a.taps = {'a': [16] * 8, 'b': [16] * 8, 'c': [16] * 8}
+		self.assertEqual(a.plan_taps(cost(None), latency), ('full', None))
+		self.assertEqual(a.plan_taps(cost(2), latency), ('incremental', 2))
+		self.assertEqual(a.plan_taps(cost(1), latency), ('incremental', 1))
+		self.assertEqual(a.plan_taps(0, latency), ('cached', 0))
+
+	def test_tap_search_cost(self):
+		a = make_adc16(fakeboard.FakeBoard())
+		a.calibrate()
+		saved = json.loads(json.dumps({'taps': a.taps, 'bitslips': a.bitslips}))
+		for window in (None, 2, 1, 0):
+			#A freshly programmed board, its lanes as many bits late as the saved bitslips
+			board = fakeboard.FakeBoard()
+			a = make_adc16(board)
+			a.load_taps(saved)
+			requests, captures, settles = a.tap_search_cost(window)
+			board.calls = {}
+			if window is None:
+				a.walk_taps()
+				a.clear_pattern()
+				a.set_demux_fpga(a.demux_mode)
+			else:
+				a.recalibrate_incremental(window, sync=True)
+			#A capture is a snap request (two writes) and a read per chip
+			self.assertEqual(board.calls['read'] % 3, 0)
+			actual_captures = board.calls['read'] // 3
+			actual_requests = board.ncalls() - actual_captures * 5
+			if window is None:
+				#No eye reaches tap 0 or 31, the bitslip check needs none of the 4 bitslips charged for it
+				self.assertEqual((requests - actual_requests, captures - actual_captures), (4 * (3 + 2 * 8), 4 * 2))
+			else:
+				self.assertEqual((requests, captures), (actual_requests, actual_captures))
+
+	def test_status_cached(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.clock_locked()
+		a.adc16_based()
+		self.assertEqual(board.calls['read_int'], 1)
+		self.assertEqual(a.status().num_chips, 3)
+		a.status(max_age=0)
+		self.assertEqual(board.calls['read_int'], 2)
+
+	def test_validate_ramp(self):
+		board = fakeboard.FakeBoard()
+		a = make_adc16(board)
+		a.calibrate()
+		self.assertTrue(a.validate_ramp()['ok'])
+		#Chip b lane 2a one bit late, chip c lane 4b out of its eye
+		board.slip[1][2] -= 1
+		board.tap[2][7] = board.eye[2][7] + board.eye_half + 1
+		result = a.validate_ramp()
+		self.assertFalse(result['ok'])
+		bad = list(zip(*(~result['aligned']).nonzero()))
+		self.assertEqual(sorted(bad), [(1, 2), (2, 7)])
+		self.assertEqual(result['slip'][1, 2], 1)
+		self.assertFalse(result['ramp'][2, 7])
+
+	def test_bitslip_not_working(self):
+		board = fakeboard.FakeBoard()
+		board.bitslip_works = False
+		self.assertRaises(SystemExit, make_adc16(board).calibrate)
+
+
+if __name__ == '__main__':
+	unittest.main()
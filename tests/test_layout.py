@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+
+import adc16_layout
+
+
+#Snapshot (frames interleaved in LANES order) of lanes given as (8, samples) offset binary codes
+def snapshot(lanes):
+	lanes = np.asarray(lanes)
+	return (lanes.T.ravel() ^ 0x80).astype(np.uint8).view(np.int8)
+
+
+#Codes a lane sends with its word boundary r bits late
+def late(codes, r):
+	following = np.append(codes[1:], codes[-1])
+	return ((codes << r) | (following >> (8 - r))) & 0xff
+
+
+class RampCheckTest(unittest.TestCase):
+
+	def setUp(self):
+		self.ramp = (np.arange(128) * 3 + 17) % 256
+
+	def test_aligned(self):
+		result = adc16_layout.ramp_check(snapshot([self.ramp] * 8))
+		self.assertEqual(result['step'], 3)
+		self.assertTrue(result['aligned'].all())
+		self.assertTrue((result['slip'] == 0).all())
+		self.assertEqual(result['bit_errors'].sum(), 0)
+
+	def test_slip(self):
+		for r in range(1, 8):
+			lanes = [self.ramp] * 8
+			lanes[5] = late(self.ramp, r)
+			result = adc16_layout.ramp_check(snapshot(lanes))
+			self.assertTrue(result['ramp'].all())
+			self.assertEqual(result['slip'].tolist(), [0] * 5 + [(r + 4) % 8 - 4] + [0] * 2)
+			self.assertEqual(result['aligned'].tolist(), [True] * 5 + [False] + [True] * 2)
+			self.assertEqual(result['bit_errors'].sum(), 0)
+
+	def test_bit_errors(self):
+		lanes = np.array([self.ramp] * 8)
+		#Bit 2 of lane 3a flipped in every 10th sample
+		lanes[4, ::10] ^= 0x04
+		result = adc16_layout.ramp_check(snapshot(lanes))
+		self.assertFalse(result['aligned'][4])
+		self.assertEqual(result['slip'][4], 0)
+		self.assertEqual(result['bit_errors'][4].nonzero()[0].tolist(), [2])
+		self.assertEqual(result['bit_errors'][4, 2], len(range(0, 127, 10)))
+
+	def test_no_ramp(self):
+		lanes = [self.ramp] * 8
+		lanes[0] = np.random.RandomState(0).randint(0, 256, 128)
+		result = adc16_layout.ramp_check(snapshot(lanes))
+		self.assertEqual(result['ramp'].tolist(), [False] + [True] * 7)
+		self.assertFalse(result['aligned'][0])
+
+	def test_batch(self):
+		lanes = [self.ramp] * 8
+		lanes[7] = late(self.ramp, 6)
+		data = np.array([snapshot([self.ramp] * 8), snapshot(lanes)])
+		result = adc16_layout.ramp_check(data)
+		self.assertEqual(result['slip'].shape, (2, 8))
+		self.assertEqual(result['slip'][1, 7], -2)
+		self.assertEqual(int(result['aligned'].sum()), 15)
+
+
+class LayoutTest(unittest.TestCase):
+
+	def test_deinterleave(self):
+		data = np.random.RandomState(0).randint(-128, 128, (2, 3, 64)).astype(np.int8)
+		for demux_mode, order in adc16_layout.DEMUX_ORDER.items():
+			samples = adc16_layout.deinterleave(data, demux_mode)
+			self.assertEqual(samples.shape, (2, 3, len(adc16_layout.DEMUX_INPUTS[demux_mode]), 64 // len(order)))
+			#Frame by frame, as plot_chans.py does it
+			for index in np.ndindex(data.shape[:-1]):
+				frames = data[index].reshape(-1, 8)
+				expected = [[frame[byte] for frame in frames for byte in input_bytes] for input_bytes in order]
+				self.assertEqual(samples[index].tolist(), expected)
+		self.assertRaises(ValueError, adc16_layout.deinterleave, data, 3)
+		self.assertRaises(ValueError, adc16_layout.deinterleave, data[..., :60], 2)
+
+	def test_lane_errors(self):
+		data = np.full((3, 1024), adc16_layout.DESKEW_EXPECTED, dtype=np.int8)
+		data[1, 3::8][:10] = 0
+		self.assertEqual(adc16_layout.lane_errors(data).tolist(), [[0] * 8, [0, 0, 0, 10, 0, 0, 0, 0], [0] * 8])
+
+
+	def test_chip_mask(self):
+		self.assertEqual(adc16_layout.chip_mask([0, 2], adc16_layout.CHIP_SELECT), 0x5)
+		self.assertEqual(adc16_layout.chip_mask(1, adc16_layout.BITSLIP), 0x200)
+		self.assertEqual(adc16_layout.chip_mask(range(8), adc16_layout.STROBE), 0xffffffff)
+
+
+	def test_decode_status(self):
+		status = adc16_layout.decode_status(-0x7ccefd01, 1.5)
+		self.assertEqual(status.word, 0x833102ff)
+		self.assertEqual((status.lock_bits, status.locked, status.num_chips, status.revision), (3, True, 3, 1))
+		self.assertEqual((status.sclk, status.sdata, status.chip_select, status.time), (1, 0, 0xff, 1.5))
+		self.assertFalse(adc16_layout.decode_status(0x00800000).locked)
+
+
+if __name__ == '__main__':
+	unittest.main()
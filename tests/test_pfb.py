@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+
+import adc16_layout
+import adc16_pfb
+
+
+#Spectra of one input the long way: for each spectrum window its ntaps*2*nchan samples with the whole filter,
+#sum the taps into 2*nchan points and take the FFT
+def direct_spectra(samples, nchan, ntaps):
+	fft_len = 2 * nchan
+	coeffs = adc16_pfb.pfb_coeffs(nchan, ntaps).ravel()
+	spectra = []
+	for first in range(0, len(samples) - ntaps * fft_len + 1, fft_len):
+		windowed = samples[first:first + ntaps * fft_len] * coeffs
+		spectra.append(np.fft.fft(windowed.reshape(ntaps, fft_len).sum(axis=0))[:nchan])
+	return np.array(spectra)
+
+
+class PolyphaseFilterbankTest(unittest.TestCase):
+
+	def test_channelize(self):
+		data = np.random.RandomState(0).randint(-128, 128, (2, 3, 520)).astype(np.float64)
+		for nchan, ntaps in ((32, 4), (8, 1), (16, 3)):
+			pfb = adc16_pfb.PolyphaseFilterbank(nchan, ntaps)
+			spectra = pfb.channelize(data)
+			self.assertEqual(spectra.shape, (2, 3, pfb.num_spectra(520), nchan))
+			for index in np.ndindex(data.shape[:-1]):
+				np.testing.assert_allclose(spectra[index], direct_spectra(data[index], nchan, ntaps), rtol=1e-9, atol=1e-6)
+			power = np.abs(spectra) ** 2
+			np.testing.assert_allclose(pfb.power(data), power.mean(axis=-2))
+			np.testing.assert_allclose(pfb.power(data, axis=0), power.mean(axis=-2).mean(axis=0))
+
+	def test_tone(self):
+		#A tone on a channel centre stays in that channel
+		pfb = adc16_pfb.PolyphaseFilterbank(32, 4)
+		power = pfb.power(np.cos(np.pi * 10.0 / 32 * np.arange(4096)))
+		self.assertEqual(int(np.argmax(power)), 10)
+		self.assertLess(np.delete(power, [9, 10, 11]).max(), power[10] * 1e-4)
+
+	def test_too_short(self):
+		pfb = adc16_pfb.PolyphaseFilterbank(32, 4)
+		self.assertEqual(pfb.num_spectra(256), 1)
+		self.assertRaises(ValueError, pfb.fir, np.zeros(255))
+
+	def test_snapshot_power(self):
+		snapshots = np.random.RandomState(1).randint(-128, 128, (4, 3, 1024)).astype(np.int8)
+		power = adc16_pfb.snapshot_power(snapshots, 2, nchan=16, ntaps=2)
+		self.assertEqual(power.shape, (3, 2, 16))
+		inputs = adc16_layout.deinterleave(snapshots, 2).astype(np.float64)
+		for chip in range(3):
+			for i in range(2):
+				expected = np.mean([(np.abs(direct_spectra(inputs[n, chip, i], 16, 2)) ** 2).mean(axis=0) for n in range(4)], axis=0)
+				np.testing.assert_allclose(power[chip, i], expected, rtol=1e-4)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+import os
+import logging
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import adc16_recorder
+
+logging.disable(logging.ERROR)
+
+
+class CaptureRecorderTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'captures')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_round_trip(self):
+		#A chunk smaller than the recording, so the files grow while it runs
+		recorder = adc16_recorder.CaptureRecorder(self.path, chunk=16)
+		captures = np.random.RandomState(0).randint(-128, 128, (20, 2, 1024)).astype(np.int8)
+		for n, capture in enumerate(captures):
+			recorder.append(capture, 100.0 + n, [0, 2], 2, 1.5)
+		recorder.close()
+		self.assertEqual((recorder.captures, recorder.count), (20, 40))
+		self.assertEqual(os.path.getsize(self.path + '.dat'), 40 * 1024)
+		data, index = adc16_recorder.open_dataset(self.path)
+		self.assertEqual(data.tolist(), captures.reshape(40, 1024).tolist())
+		self.assertEqual(index['capture'].tolist(), np.repeat(np.arange(20), 2).tolist())
+		self.assertEqual(index['chip'].tolist(), [0, 2] * 20)
+		self.assertEqual(index['timestamp'][-1], 119.0)
+		self.assertEqual(adc16_recorder.dataset_layout(index), (20, [0, 2], 2))
+		self.assertEqual(adc16_recorder.dataset_layout(index[:0]), (0, [], None))
+
+	def test_write_error(self):
+		#Captures of the wrong length fail in the writer thread, which must keep draining the queue
+		recorder = adc16_recorder.CaptureRecorder(self.path, chunk=16, queue_size=2)
+		capture = np.zeros((1, 1024), dtype=np.int8)
+		for n in range(3):
+			recorder.append(capture, n, [0], 2, 1)
+		recorder.append(np.zeros((1, 512), dtype=np.int8), 3, [0], 2, 1)
+		for n in range(10):
+			try:
+				recorder.append(capture, 4 + n, [0], 2, 1)
+			except ValueError:
+				break
+		else:
+			self.fail('append did not raise the write error')
+		self.assertRaises(ValueError, recorder.close)
+		data, index = adc16_recorder.open_dataset(self.path)
+		self.assertEqual(len(data), 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,156 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+import adc16_replay
+import fakeboard
+
+#adc16 needs corr (and matplotlib), and only runs on Python 2
+try:
+	import adc16
+except (ImportError, SyntaxError):
+	adc16 = None
+
+logging.disable(logging.WARNING)
+
+SETTINGS = {'host': None, 'bof': None, 'skip_flag': True, 'verbosity': False, 'chips': ['a', 'b', 'c'],
+	'demux_mode': 2, 'test_pattern': '10110110', 'gain': 1}
+
+
+#Answers the few FpgaClient calls the tests make from a dict of registers
+class RegisterClient():
+
+	def __init__(self):
+		self.regs = {}
+
+	def write_int(self, device, value, blindwrite=False, offset=0):
+		self.regs[offset] = value
+
+	def read_int(self, device, offset=0):
+		return self.regs.get(offset, 0)
+
+	def read(self, device, size, offset=0):
+		return bytes(bytearray(range(offset, offset + size)))
+
+	def progdev(self, bof):
+		raise IOError('no such file ' + bof)
+
+
+class ReplayClientTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'calls.trace')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def record(self):
+		client = adc16_replay.RecordingClient(RegisterClient(), self.path, {'chips': ['a']})
+		client.write_int('adc16_controller', 0x10000, offset=1, blindwrite=True)
+		results = [client.read_int('adc16_controller', offset=1), client.read('adc16_wb_ram0', 16, offset=8)]
+		self.assertRaises(IOError, client.progdev, 'missing.bof')
+		client.close()
+		return results
+
+	def test_round_trip(self):
+		results = self.record()
+		client = adc16_replay.ReplayClient(self.path)
+		self.assertEqual(client.settings, {'chips': ['a']})
+		self.assertEqual(len(client.calls), 4)
+		client.write_int('adc16_controller', 0x10000, offset=1, blindwrite=True)
+		self.assertEqual([client.read_int('adc16_controller', offset=1), client.read('adc16_wb_ram0', 16, offset=8)], results)
+		self.assertFalse(client.finished())
+		self.assertRaises(RuntimeError, client.progdev, 'missing.bof')
+		self.assertTrue(client.finished())
+		self.assertGreaterEqual(client.recorded_time(), 0)
+
+	def test_mismatch(self):
+		self.record()
+		client = adc16_replay.ReplayClient(self.path)
+		self.assertRaises(adc16_replay.ReplayMismatch, client.write_int, 'adc16_controller', 0x10000, offset=2, blindwrite=True)
+		client = adc16_replay.ReplayClient(self.path)
+		self.assertRaises(adc16_replay.ReplayMismatch, client.read_int, 'adc16_controller', offset=1)
+
+	def test_past_the_end(self):
+		self.record()
+		client = adc16_replay.ReplayClient(self.path)
+		client.position = len(client.calls)
+		self.assertRaises(adc16_replay.ReplayMismatch, client.read_int, 'adc16_controller', offset=1)
+
+
+@unittest.skipIf(adc16 is None, 'adc16 needs corr and Python 2')
+class ReplayCalibrationTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.path = os.path.join(self.tmp, 'calibration.trace')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	#Records a session the way adc16_init.py --record does
+	def record(self, board, budget=None, taps=None, clock=False, auto_gain=None, validate=False):
+		client = adc16_replay.RecordingClient(board, self.path, SETTINGS)
+		a = adc16.ADC16(client=client, pattern_settle=0, **SETTINGS)
+		if clock:
+			a.measure_clock(interval=0)
+		if taps:
+			a.load_taps(taps)
+		client.header['session'].update({'budget': budget, 'taps': taps, 'clock': clock,
+			'auto_gain': auto_gain, 'validate': validate})
+		report = a.calibrate(budget)
+		client.header['session']['plan'] = [report['path'], report['window']]
+		if auto_gain:
+			a.auto_gain(target_rms=auto_gain)
+		if validate:
+			a.validate_ramp()
+		client.close()
+		return a, report
+
+	def test_calibrate(self):
+		board = fakeboard.FakeBoard()
+		self.record(board)
+		calls, board_time, host_time = adc16_replay.replay_calibration(self.path, repeat=2)
+		self.assertEqual(calls, board.ncalls())
+
+	def test_session(self):
+		board = fakeboard.FakeBoard()
+		self.record(board, clock=True, auto_gain=16, validate=True)
+		calls, board_time, host_time = adc16_replay.replay_calibration(self.path, repeat=2)
+		self.assertEqual(calls, board.ncalls())
+
+	def test_cached_taps(self):
+		a, report = self.record(fakeboard.FakeBoard())
+		saved = {'taps': a.taps, 'margins': a.margins}
+		#No time for anything but checking the saved taps, the replay must take that path whatever its own latency
+		board = fakeboard.FakeBoard()
+		a, report = self.record(board, budget=0, taps=saved)
+		self.assertEqual(report['path'], 'cached')
+		calls, board_time, host_time = adc16_replay.replay_calibration(self.path)
+		self.assertEqual(calls, board.ncalls())
+
+	def test_mismatch(self):
+		self.record(fakeboard.FakeBoard())
+		with open(self.path) as f:
+			lines = f.readlines()
+		header = json.loads(lines[0])
+		header['settings']['chips'] = ['a', 'b']
+		with open(self.path, 'w') as f:
+			f.writelines([json.dumps(header) + '\n'] + lines[1:])
+		self.assertRaises(adc16_replay.ReplayMismatch, adc16_replay.replay_calibration, self.path)
+
+	def test_truncated(self):
+		self.record(fakeboard.FakeBoard())
+		with open(self.path) as f:
+			lines = f.readlines()
+		with open(self.path, 'w') as f:
+			f.writelines(lines[:-10])
+		self.assertRaises(adc16_replay.ReplayMismatch, adc16_replay.replay_calibration, self.path)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,89 @@
+import os
+import unittest
+import multiprocessing
+import numpy as np
+
+#adc16_shm needs multiprocessing.shared_memory, Python 3.8+
+try:
+	import adc16_shm
+except (ImportError, SyntaxError):
+	adc16_shm = None
+
+
+#Reader process: copies of the first count captures in the ring
+def read_captures(name, count, results):
+	reader = adc16_shm.RingReader(name, start='oldest')
+	captures = []
+	while len(captures) < count:
+		item = reader.next(timeout=5)
+		if item is None:
+			break
+		seq, data, timestamp = item
+		captures.append((seq, data.tolist(), timestamp))
+	reader.close()
+	results.put(captures)
+
+
+@unittest.skipIf(adc16_shm is None, 'adc16_shm needs Python 3.8')
+class CaptureRingTest(unittest.TestCase):
+
+	def setUp(self):
+		self.ring = adc16_shm.CaptureRing(None, [0, 2], 2, nslots=4)
+		self.captures = np.random.RandomState(0).randint(-128, 128, (10, 2, 1024)).astype(np.int8)
+
+	def tearDown(self):
+		if self.ring is not None:
+			self.ring.close()
+
+	def test_round_trip(self):
+		reader = adc16_shm.RingReader(self.ring.name)
+		self.assertEqual((reader.chip_nums, reader.demux_mode, reader.nslots), ([0, 2], 2, 4))
+		for n in range(3):
+			self.assertEqual(self.ring.publish(self.captures[n], 100.0 + n), n)
+		self.assertEqual(reader.published(), 3)
+		for n in range(3):
+			seq, view, timestamp = reader.next(timeout=1)
+			self.assertEqual((seq, timestamp), (n, 100.0 + n))
+			self.assertEqual(view.tolist(), self.captures[n].tolist())
+			self.assertTrue(reader.valid(seq))
+		self.assertIsNone(reader.next(timeout=0))
+		data, timestamp = reader.read(1)
+		self.assertEqual((data.tolist(), timestamp), (self.captures[1].tolist(), 101.0))
+		reader.close()
+
+	def test_overrun(self):
+		reader = adc16_shm.RingReader(self.ring.name, start='oldest')
+		for n in range(10):
+			self.ring.publish(self.captures[n], float(n))
+		#Only the newest 3 of the 4 slots are safe to read, the oldest is the next to be rewritten
+		self.assertFalse(reader.valid(5))
+		self.assertRaises(adc16_shm.Overrun, reader.read, 5)
+		seq, view, timestamp = reader.next(timeout=1)
+		self.assertEqual((seq, reader.lost), (7, 7))
+		self.assertEqual(view.tolist(), self.captures[7].tolist())
+		reader.close()
+
+	def test_other_process(self):
+		results = multiprocessing.Queue()
+		process = multiprocessing.Process(target=read_captures, args=(self.ring.name, 3, results))
+		process.start()
+		for n in range(3):
+			self.ring.publish(self.captures[n], 100.0 + n)
+		captures = results.get(timeout=10)
+		process.join()
+		self.assertEqual([(seq, timestamp) for seq, data, timestamp in captures], [(0, 100.0), (1, 101.0), (2, 102.0)])
+		self.assertEqual([data for seq, data, timestamp in captures], self.captures[:3].tolist())
+		#The reader leaving must not remove the block, closing the ring does
+		name = self.ring.name
+		reader = adc16_shm.RingReader(name)
+		self.ring.close()
+		self.ring = None
+		self.assertIsNone(reader.next(timeout=0))
+		reader.close()
+		self.assertRaises(FileNotFoundError, adc16_shm.RingReader, name)
+		if os.path.isdir('/dev/shm'):
+			self.assertNotIn(name.lstrip('/'), os.listdir('/dev/shm'))
+
+
+if __name__ == '__main__':
+	unittest.main()
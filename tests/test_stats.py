@@ -0,0 +1,70 @@
+import math
+import unittest
+import collections
+import numpy as np
+
+import adc16_layout
+import adc16_stats
+
+
+class StatsTest(unittest.TestCase):
+
+	def setUp(self):
+		rng = np.random.RandomState(0)
+		self.snapshots = np.clip(np.round(rng.randn(3, 2, 1024) * 30), -128, 127).astype(np.int8)
+		#Chip b bytes 2, 3, 6 and 7 stuck at 4: input 3 in demux 2, inputs 3 and 4 in demux 1
+		self.snapshots[:, 1, 2::8] = 4
+		self.snapshots[:, 1, 6::8] = 4
+		self.snapshots[:, 1, 3::8] = 4
+		self.snapshots[:, 1, 7::8] = 4
+
+	def test_histograms(self):
+		hist = adc16_stats.input_histograms(self.snapshots, 2)
+		self.assertEqual(hist.shape, (2, 2, 256))
+		#One sample at a time
+		inputs = adc16_layout.deinterleave(self.snapshots, 2)
+		for chip in range(2):
+			for i in range(2):
+				expected = [0] * 256
+				for snapshot in inputs[:, chip, i]:
+					for sample in snapshot:
+						expected[int(sample) + 128] += 1
+				self.assertEqual(hist[chip, i].tolist(), expected)
+		self.assertEqual(adc16_stats.input_histograms(self.snapshots[0], 2).tolist(),
+			adc16_stats.input_histograms(self.snapshots[:1], 2).tolist())
+
+	def test_stats(self):
+		stats = adc16_stats.snapshot_stats(self.snapshots, 1)
+		inputs = adc16_layout.deinterleave(self.snapshots, 1)
+		for chip in range(2):
+			for i in range(4):
+				samples = [int(sample) for sample in inputs[:, chip, i].ravel()]
+				n = float(len(samples))
+				mean = sum(samples) / n
+				rms = math.sqrt(sum(sample ** 2 for sample in samples) / n)
+				std = math.sqrt(sum((sample - mean) ** 2 for sample in samples) / n)
+				clipped = sum(1 for sample in samples if sample in (-128, 127)) / n
+				bits = [sum((sample + 128) >> k & 1 for sample in samples) / n for k in range(8)]
+				entropy = -sum(c / n * math.log(c / n, 2) for c in collections.Counter(samples).values())
+				self.assertEqual(stats['count'][chip, i], n)
+				self.assertAlmostEqual(stats['mean'][chip, i], mean)
+				self.assertAlmostEqual(stats['rms'][chip, i], rms)
+				self.assertAlmostEqual(stats['std'][chip, i], std, places=5)
+				self.assertAlmostEqual(stats['clip_fraction'][chip, i], clipped)
+				np.testing.assert_allclose(stats['bit_fraction'][chip, i], bits)
+				self.assertEqual(stats['stuck_bits'][chip, i].tolist(), [b in (0, 1) for b in bits])
+				self.assertAlmostEqual(stats['effective_bits'][chip, i], entropy)
+		self.assertEqual(stats['stuck_bits'][1, 2:].tolist(), [[True] * 8] * 2)
+		self.assertEqual(stats['effective_bits'][1, 2:].tolist(), [0, 0])
+		self.assertFalse(stats['stuck_bits'][:, :2].any())
+
+	def test_accumulator(self):
+		accumulator = adc16_stats.StatsAccumulator(2)
+		for snapshot in self.snapshots:
+			accumulator.add(snapshot)
+		self.assertEqual(accumulator.hist.tolist(), adc16_stats.input_histograms(self.snapshots, 2).tolist())
+		np.testing.assert_allclose(accumulator.stats()['rms'], adc16_stats.snapshot_stats(self.snapshots, 2)['rms'])
+
+
+if __name__ == '__main__':
+	unittest.main()
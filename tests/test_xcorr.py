@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+
+import adc16_xcorr
+
+
+class CrossCorrelatorTest(unittest.TestCase):
+
+	def setUp(self):
+		#Inputs 1 and 2 see the noise on input 0 5 samples later and 2 samples earlier
+		rng = np.random.RandomState(0)
+		signal = rng.randn(6, 300) * 20
+		self.data = np.array([signal[:, 10:266], signal[:, 5:261], signal[:, 12:268]]).transpose(1, 0, 2)
+		self.data += rng.randn(*self.data.shape)
+
+	def test_spectra(self):
+		xc = adc16_xcorr.CrossCorrelator(3, 256)
+		xc.add(self.data[:4])
+		xc.add(self.data[4:])
+		self.assertEqual(xc.count, 6)
+		#One pair at a time: X_i times the conjugate of X_j, summed over the captures
+		data = self.data - self.data.mean(axis=-1)[..., np.newaxis]
+		for i in range(3):
+			for j in range(3):
+				expected = 0
+				for capture in data:
+					expected = expected + np.fft.rfft(capture[i], n=512) * np.conj(np.fft.rfft(capture[j], n=512))
+				np.testing.assert_allclose(xc.spectra[:, i, j], expected, rtol=1e-9, atol=1e-6)
+
+	def test_lags(self):
+		xc = adc16_xcorr.CrossCorrelator(3, 256)
+		xc.add(self.data)
+		result = xc.result()
+		self.assertEqual([(int(i), int(j)) for i, j in zip(*result['pairs'])], [(0, 1), (0, 2), (1, 2)])
+		#Positive when i sees the signal after j
+		np.testing.assert_allclose(result['lag'], [-5, 2, 7], atol=0.1)
+		self.assertTrue((result['peak'] > 0.9).all())
+		self.assertTrue((result['coherence'] > 0.5).all())
+		#The lag of the time domain correlation peak, sum over n of x_i[n + lag] x_j[n]
+		data = self.data - self.data.mean(axis=-1)[..., np.newaxis]
+		for pair, (i, j) in enumerate(zip(*result['pairs'])):
+			corr = sum(np.correlate(capture[i], capture[j], mode='full') for capture in data)
+			self.assertEqual(int(np.argmax(corr)) - 255, int(round(result['lag'][pair])))
+
+	def test_correlate_captures(self):
+		captures = np.random.RandomState(1).randint(-128, 128, (8, 2, 1024)).astype(np.int8)
+		captures[:, 1] = captures[:, 0]
+		result = adc16_xcorr.correlate_captures(captures, 2)
+		#Chip b is a copy of chip a: inputs a1/b1 and a3/b3 line up exactly
+		self.assertEqual(adc16_xcorr.input_labels([0, 1], 2), ['a1', 'a3', 'b1', 'b3'])
+		pairs = dict(((int(i), int(j)), n) for n, (i, j) in enumerate(zip(*result['pairs'])))
+		for pair in ((0, 2), (1, 3)):
+			self.assertAlmostEqual(result['lag'][pairs[pair]], 0)
+			self.assertAlmostEqual(result['peak'][pairs[pair]], 1)
+		self.assertLess(abs(result['peak'][pairs[(0, 1)]]), 0.5)
+
+
+if __name__ == '__main__':
+	unittest.main()